@@ -2,6 +2,11 @@ import streamlit as st
 from main import LLMIntegration
 from router import Router
 from guardrails import Guardrails
+from cache import AnswerCache
+from feedback import FeedbackCollector
+from metrics import metrics, trace
+from embeddings import EMBEDDING_WARMUP, warm_up
+import solver
 import json
 from typing import Dict, List
 import time
@@ -9,19 +14,30 @@ import time
 # Initialize components
 @st.cache_resource
 def init_components():
+    # Load the embedding model in the background while the rest of the app starts
+    if EMBEDDING_WARMUP:
+        warm_up()
+    if solver.SOLVER_ENABLED:
+        solver.warm_up()
     return {
         "llm": LLMIntegration(),
         "router": Router(),
-        "guardrails": Guardrails()
+        "guardrails": Guardrails(),
+        "cache": AnswerCache(),
+        "feedback": FeedbackCollector()
     }
 
-def display_response(response: str, source: str, context: List[Dict]):
+def display_response(response: str, source: str, context: List[Dict], show_response: bool = True):
     """Display the response and its source information."""
-    st.markdown("### Response")
-    st.write(response)
+    if show_response:
+        st.markdown("### Response")
+        st.write(response)
     
     st.markdown("### Source")
-    st.write(f"Information retrieved from: {source.upper()}")
+    if source == "solver":
+        st.write("Computed exactly by the symbolic solver (SymPy)")
+    else:
+        st.write(f"Information retrieved from: {source.upper()}")
     
     if context:
         st.markdown("### Context")
@@ -35,6 +51,99 @@ def display_response(response: str, source: str, context: List[Dict]):
                 elif "url" in item:
                     st.write(f"Source: {item['url']}")
 
+def answer_query(components: Dict, query: str):
+    """Validate, retrieve, generate and display the answer to one question."""
+    # Validate input
+    is_valid, error = components["guardrails"].validate_input(query)
+    if not is_valid:
+        st.error(f"Invalid input: {error}")
+        return
+        
+    # Sanitize input
+    sanitized_query = components["guardrails"].sanitize_input(query)
+    
+    # Plain algebra/calculus is answered exactly, skipping the cache, retrieval and the LLM
+    solved = components["router"].solve(sanitized_query)
+    if solved is not None:
+        source, context = solved
+        display_response(context[0]["answer"], source, context)
+        display_feedback(components, sanitized_query, context[0]["answer"], source, context,
+                         components["router"].last_route())
+        return
+    
+    cache = components["cache"]
+    with st.spinner("Searching for answers..."):
+        # Check the answer cache: exact match first, then a semantic match on the embedding
+        query_embedding = None
+        cached = cache.get(sanitized_query)
+        if cached is None:
+            query_embedding = components["router"].kb.embed_query(sanitized_query)
+            cached = cache.get_similar(sanitized_query, query_embedding)
+        
+        if cached is not None:
+            source, context = cached["source"], cached["context"]
+            route = {"source": source, "cached": True}
+        else:
+            # Route query
+            # The solver already passed on this question above
+            source, context = components["router"].route_query(sanitized_query, query_embedding=query_embedding,
+                                                               use_solver=False)
+            route = components["router"].last_route()
+            
+            # Drop context chunks that fail the safety checks, then validate the rest
+            context, _ = components["guardrails"].filter_context(context)
+            is_valid, error = components["guardrails"].validate_context(context)
+            if not is_valid:
+                st.error(f"Error retrieving context: {error}")
+                return
+    
+    if cached is not None:
+        response = cached["answer"]
+        display_response(response, source, context)
+    else:
+        # Stream the response through the same output guardrails as a complete one
+        st.markdown("### Response")
+        placeholder = st.empty()
+        guarded = components["guardrails"].guard_stream(
+            components["llm"].stream_response(sanitized_query, context)
+        )
+        with placeholder.container():
+            st.write_stream(guarded)
+        
+        if not guarded.is_valid:
+            placeholder.empty()
+            st.error(f"Error generating response: {guarded.error}")
+            return
+        response = guarded.text
+        
+        if source != "error":
+            cache.put(sanitized_query, source, context, response, query_embedding=query_embedding)
+            
+        # Display results
+        display_response(response, source, context, show_response=False)
+        
+    display_feedback(components, sanitized_query, response, source, context, route)
+
+def record_feedback(components: Dict, record: Dict, is_helpful: bool):
+    """Store a feedback click together with the routing decision behind the answer."""
+    components["feedback"].collect_feedback(is_helpful=is_helpful, **record)
+    st.session_state["feedback_message"] = (
+        "Thank you for your feedback!" if is_helpful else "Thank you for your feedback. We'll try to improve!"
+    )
+
+def display_feedback(components: Dict, query: str, response: str, source: str, context: List[Dict], route):
+    """
+    Display the feedback buttons. Clicks are recorded in on_click callbacks, which run on
+    the rerun the click triggers even though the answer itself is not shown again.
+    """
+    record = {"query": query, "response": response, "context": context, "source": source, "route": route}
+    st.markdown("### Feedback")
+    col1, col2 = st.columns(2)
+    with col1:
+        st.button("👍 Helpful", on_click=record_feedback, args=(components, record, True))
+    with col2:
+        st.button("👎 Not Helpful", on_click=record_feedback, args=(components, record, False))
+
 def main():
     st.title("AI Math Knowledge Assistant")
     st.write("Ask any math question and I'll try to help you find the answer!")
@@ -42,6 +151,10 @@ def main():
     # Initialize components
     components = init_components()
     
+    message = st.session_state.pop("feedback_message", None)
+    if message:
+        st.success(message)
+    
     # Input area
     query = st.text_area("Enter your question:", height=100)
     
@@ -49,47 +162,11 @@ def main():
         if not query:
             st.error("Please enter a question!")
             return
-            
-        # Validate input
-        is_valid, error = components["guardrails"].validate_input(query)
-        if not is_valid:
-            st.error(f"Invalid input: {error}")
-            return
-            
-        # Sanitize input
-        sanitized_query = components["guardrails"].sanitize_input(query)
         
-        with st.spinner("Searching for answers..."):
-            # Route query
-            source, context = components["router"].route_query(sanitized_query)
-            
-            # Validate context
-            is_valid, error = components["guardrails"].validate_context(context)
-            if not is_valid:
-                st.error(f"Error retrieving context: {error}")
-                return
-                
-            # Generate response
-            response = components["llm"].generate_response(sanitized_query, context)
-            
-            # Validate response
-            is_valid, error = components["guardrails"].validate_output(response)
-            if not is_valid:
-                st.error(f"Error generating response: {error}")
-                return
-                
-            # Display results
-            display_response(response, source, context)
-            
-            # Add feedback mechanism
-            st.markdown("### Feedback")
-            col1, col2 = st.columns(2)
-            with col1:
-                if st.button("👍 Helpful"):
-                    st.success("Thank you for your feedback!")
-            with col2:
-                if st.button("👎 Not Helpful"):
-                    st.error("Thank you for your feedback. We'll try to improve!")
+        # Time every stage of this request; traces are only written when TRACE_LOG_PATH is set
+        with trace("streamlit_request"):
+            answer_query(components, query)
+        metrics.export()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
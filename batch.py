@@ -0,0 +1,342 @@
+#batch.py
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from dotenv import load_dotenv
+from metrics import metrics, trace
+
+load_dotenv()
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))
+BATCH_EMBED_SIZE = int(os.getenv("BATCH_EMBED_SIZE", 64))
+PINECONE_CONCURRENCY = int(os.getenv("PINECONE_CONCURRENCY", 8))
+TAVILY_CONCURRENCY = int(os.getenv("TAVILY_CONCURRENCY", 2))
+GROQ_CONCURRENCY = int(os.getenv("GROQ_CONCURRENCY", 4))
+GROQ_REQUESTS_PER_MINUTE = float(os.getenv("GROQ_REQUESTS_PER_MINUTE", 30))
+TAVILY_REQUESTS_PER_MINUTE = float(os.getenv("TAVILY_REQUESTS_PER_MINUTE", 60))
+
+class ServiceLimiter:
+    """
+    Caps concurrent calls to one remote service and paces them to a request rate.
+    ``backoff`` pauses every caller after the service reports a rate limit.
+    """
+    def __init__(self, name: str, max_concurrency: int, requests_per_minute: Optional[float] = None):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.min_interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+        self.throttled = 0
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_slot)
+            self._next_slot = start + self.min_interval
+        if start > now:
+            time.sleep(start - now)
+        return self
+
+    def __exit__(self, *exc):
+        self._semaphore.release()
+        return False
+
+    def backoff(self, delay: float):
+        """Hold off all callers for ``delay`` seconds."""
+        with self._lock:
+            self.throttled += 1
+            self._next_slot = max(self._next_slot, time.monotonic() + delay)
+
+class _Limited:
+    """Proxy that runs the named methods of ``target`` under a ServiceLimiter."""
+    def __init__(self, target, limiter: ServiceLimiter, methods: Iterable[str]):
+        self._target = target
+        self._limiter = limiter
+        self._methods = set(methods)
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name not in self._methods:
+            return attr
+
+        def limited(*args, **kwargs):
+            with self._limiter:
+                return attr(*args, **kwargs)
+        return limited
+
+def _is_rate_limited(response: str) -> bool:
+    lowered = response.lower()
+    return response.startswith("Error generating response") and ("429" in lowered or "rate limit" in lowered)
+
+class BatchRunner:
+    """
+    Answers many questions through Guardrails -> Router -> LLMIntegration.
+
+    Questions are embedded in batches rather than one embed_query call each, answered
+    with bounded overall concurrency, and calls to Pinecone, Tavily and Groq are capped
+    separately. Results stream to JSONL with per-stage timings, and a rerun skips
+    questions already answered successfully in the output file.
+    """
+    def __init__(self,
+                 router=None,
+                 llm=None,
+                 guardrails=None,
+                 concurrency: int = BATCH_CONCURRENCY,
+                 embed_batch_size: int = BATCH_EMBED_SIZE,
+                 pinecone_concurrency: int = PINECONE_CONCURRENCY,
+                 tavily_concurrency: int = TAVILY_CONCURRENCY,
+                 groq_concurrency: int = GROQ_CONCURRENCY,
+                 groq_requests_per_minute: float = GROQ_REQUESTS_PER_MINUTE,
+                 tavily_requests_per_minute: float = TAVILY_REQUESTS_PER_MINUTE,
+                 max_llm_retries: int = 3):
+        from router import Router
+        from main import LLMIntegration
+        from guardrails import Guardrails
+
+        self.concurrency = concurrency
+        self.embed_batch_size = embed_batch_size
+        self.max_llm_retries = max_llm_retries
+
+        self.limiters = {
+            "pinecone": ServiceLimiter("pinecone", pinecone_concurrency),
+            "tavily": ServiceLimiter("tavily", tavily_concurrency, tavily_requests_per_minute),
+            "groq": ServiceLimiter("groq", groq_concurrency, groq_requests_per_minute),
+        }
+
+        router = router if router is not None else Router()
+        self.kb = router.kb
+        # Same routing settings as the given router, with its KB and web clients rate limited
+        self.router = Router(
+            similarity_threshold=router.similarity_threshold,
+            concurrent=router.concurrent,
+            latency_budget=router.latency_budget,
+            web_hedge_delay=router.web_hedge_delay,
+            kb=_Limited(router.kb, self.limiters["pinecone"], {"search_knowledge_base"}),
+            web_search=_Limited(router.web_search, self.limiters["tavily"], {"search"}),
+            solver=router.solver,
+            model_path=router.model.path,
+            explore_rate=router.explore_rate
+        )
+        self.llm = llm if llm is not None else LLMIntegration()
+        self.guardrails = guardrails if guardrails is not None else Guardrails()
+
+    def answer(self, item: Dict, query_embedding: Optional[List[float]] = None) -> Dict:
+        """Answer one question, recording how long each stage took in milliseconds."""
+        with trace("batch_item", id=item["id"]):
+            return self._answer(item, query_embedding)
+
+    def _answer(self, item: Dict, query_embedding: Optional[List[float]] = None) -> Dict:
+        question = item.get("question") or item.get("query") or ""
+        result = {"id": item["id"], "question": question, "source": None, "answer": None,
+                  "error": None, "retryable": False, "timings": {}}
+        timings = result["timings"]
+        started = time.perf_counter()
+
+        def stage(name, start):
+            timings[name] = round((time.perf_counter() - start) * 1000, 2)
+
+        try:
+            t = time.perf_counter()
+            is_valid, error = self.guardrails.validate_input(question)
+            if is_valid:
+                question = self.guardrails.sanitize_input(question)
+            stage("guardrails_input", t)
+            if not is_valid:
+                # Deterministic rejection: rerunning would reject it again
+                result["error"] = f"Invalid input: {error}"
+                return result
+
+            # From here on failures (provider, retrieval, timeouts) may succeed on a rerun
+            result["retryable"] = True
+            t = time.perf_counter()
+            source, context = self.router.route_query(question, query_embedding=query_embedding)
+            stage("route", t)
+            result["source"] = source
+            if source == "solver":
+                # Exact symbolic answer: no context to check and no LLM call
+                result["answer"] = context[0]["answer"]
+                return result
+
+            t = time.perf_counter()
+            # Drop only the offending chunks rather than failing the whole question
+            context, dropped = self.guardrails.filter_context(context)
+            result["context"] = [
+                {k: v for k, v in c.items() if k in ("source", "page", "url", "score")} for c in context
+            ]
+            if dropped:
+                result["dropped_context"] = len(dropped)
+            is_valid, error = self.guardrails.validate_context(context)
+            stage("guardrails_context", t)
+            if not is_valid:
+                result["error"] = f"Error retrieving context: {error}"
+                return result
+
+            t = time.perf_counter()
+            response = self._generate(question, context)
+            stage("llm", t)
+            if response.startswith("Error generating response"):
+                result["error"] = response
+                return result
+
+            t = time.perf_counter()
+            is_valid, error = self.guardrails.validate_output(response)
+            stage("guardrails_output", t)
+            if not is_valid:
+                result["error"] = f"Error generating response: {error}"
+                return result
+            result["answer"] = response
+        except Exception as e:
+            result["error"] = f"Unexpected error: {e}"
+            result["retryable"] = True
+        finally:
+            result["retryable"] = result["retryable"] and result["error"] is not None
+            timings["total"] = round((time.perf_counter() - started) * 1000, 2)
+        return result
+
+    def _generate(self, question: str, context: List[Dict]) -> str:
+        """Call the LLM under the Groq limiter, backing off when it reports a rate limit."""
+        limiter = self.limiters["groq"]
+        for attempt in range(self.max_llm_retries + 1):
+            with limiter:
+                response = self.llm.generate_response(question, context)
+            if not _is_rate_limited(response) or attempt == self.max_llm_retries:
+                return response
+            limiter.backoff(random.uniform(0.5, 1.0) * 2 ** (attempt + 1))
+        return response
+
+    def run_items(self, items: Iterable[Dict]) -> Iterator[Dict]:
+        """Answer items with bounded concurrency, yielding results as they complete."""
+        items = iter(items)
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while True:
+                # Embed the next block of questions in one call, then fan them out
+                block = [item for _, item in zip(range(self.embed_batch_size), items)]
+                if block:
+                    embeddings = self._embed_block(block)
+                    for item, embedding in zip(block, embeddings):
+                        in_flight.add(executor.submit(self.answer, item, embedding))
+
+                # Keep at most a couple of blocks in flight so memory stays bounded
+                while in_flight and (not block or len(in_flight) >= self.concurrency + self.embed_batch_size):
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                if not block and not in_flight:
+                    return
+
+    def _embed_block(self, block: List[Dict]) -> List[Optional[List[float]]]:
+        questions = [item.get("question") or item.get("query") or "" for item in block]
+        try:
+            return self.kb.embed_queries([self.guardrails.sanitize_input(q) for q in questions])
+        except Exception as e:
+            # Fall back to per-query embedding inside search_knowledge_base
+            print(f"Error embedding batch of {len(block)} questions: {e}")
+            return [None] * len(block)
+
+    def run(self, input_path: str, output_path: str) -> Dict:
+        """
+        Answer every question in ``input_path`` (JSONL with "id" and "question") and
+        append results to ``output_path``. Questions already answered or rejected by the
+        input guardrails there are skipped and other failures retried, so an interrupted run
+        can simply be restarted.
+        """
+        done_ids = self._completed_ids(output_path)
+        pending = (item for item in self._read_items(input_path) if item["id"] not in done_ids)
+
+        stats = {"answered": 0, "rejected": 0, "failed": 0, "skipped": len(done_ids)}
+        started = time.perf_counter()
+        with open(output_path, 'a') as out:
+            if out.tell() and not self._ends_with_newline(output_path):
+                # Terminate a line left truncated by a crash before appending
+                out.write("\n")
+            for result in self.run_items(pending):
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+                if not result["error"]:
+                    stats["answered"] += 1
+                else:
+                    stats["failed" if result["retryable"] else "rejected"] += 1
+        metrics.export()
+        stats["elapsed_s"] = round(time.perf_counter() - started, 2)
+        stats["throttled"] = {name: limiter.throttled for name, limiter in self.limiters.items()}
+        return stats
+
+    @staticmethod
+    def _read_items(input_path: str) -> Iterator[Dict]:
+        with open(input_path, 'r') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                item = json.loads(line)
+                item.setdefault("id", str(line_number))
+                item["id"] = str(item["id"])
+                yield item
+
+    @staticmethod
+    def _ends_with_newline(path: str) -> bool:
+        with open(path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    @staticmethod
+    def _completed_ids(output_path: str) -> set:
+        """
+        IDs with a final result in ``output_path``: answered, or rejected by the input
+        guardrails. Questions that failed transiently are retried on a rerun, their new
+        result appended after the failed one.
+        """
+        done = set()
+        if not os.path.exists(output_path):
+            return done
+        with open(output_path, 'r') as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                    error = result.get("error")
+                    # Results written before "retryable" existed: only input rejections are final
+                    retryable = result.get("retryable", bool(error) and not error.startswith("Invalid input"))
+                    if not error or not retryable:
+                        done.add(str(result["id"]))
+                except (json.JSONDecodeError, KeyError, AttributeError):
+                    # A crash can leave a truncated last line; that question is simply redone
+                    continue
+        return done
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of math questions.")
+    parser.add_argument("input", help="JSONL file with one {\"id\", \"question\"} object per line")
+    parser.add_argument("output", help="JSONL file results are appended to (answered and rejected ids are skipped, failed ones retried)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--embed-batch-size", type=int, default=BATCH_EMBED_SIZE)
+    parser.add_argument("--pinecone-concurrency", type=int, default=PINECONE_CONCURRENCY)
+    parser.add_argument("--tavily-concurrency", type=int, default=TAVILY_CONCURRENCY)
+    parser.add_argument("--groq-concurrency", type=int, default=GROQ_CONCURRENCY)
+    parser.add_argument("--groq-rpm", type=float, default=GROQ_REQUESTS_PER_MINUTE)
+    parser.add_argument("--tavily-rpm", type=float, default=TAVILY_REQUESTS_PER_MINUTE)
+    args = parser.parse_args(argv)
+
+    runner = BatchRunner(
+        concurrency=args.concurrency,
+        embed_batch_size=args.embed_batch_size,
+        pinecone_concurrency=args.pinecone_concurrency,
+        tavily_concurrency=args.tavily_concurrency,
+        groq_concurrency=args.groq_concurrency,
+        groq_requests_per_minute=args.groq_rpm,
+        tavily_requests_per_minute=args.tavily_rpm
+    )
+    stats = runner.run(args.input, args.output)
+    print(json.dumps(stats, indent=2))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
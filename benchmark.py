@@ -0,0 +1,482 @@
+#benchmark.py
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from vector_store import LocalVectorIndex
+from metrics import metrics, trace
+
+BENCHMARK_BASELINE_PATH = "benchmark_baseline.json"
+BENCHMARK_REPORT_PATH = "benchmark_report.json"
+
+class FaultInjector:
+    """Deterministic injected latency and errors for an offline stand-in."""
+    def __init__(self, name: str, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.name = name
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._rng = random.Random(f"{name}:{seed}")
+        self._lock = threading.Lock()
+
+    def apply(self, extra_latency: float = 0.0):
+        """Sleep for the configured latency, then raise if this call was chosen to fail."""
+        with self._lock:
+            delay = self.latency + extra_latency + self._rng.uniform(0, self.jitter)
+            fail = self._rng.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            raise RuntimeError(f"Injected {self.name} failure")
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            return self._rng.random() < self.error_rate
+
+class FakeEmbeddings:
+    """Deterministic stand-in for HuggingFaceEmbeddings: hash-seeded unit vectors."""
+    def __init__(self, dimension: int = 384, latency: float = 0.005, per_text_latency: float = 0.0005):
+        self.dimension = dimension
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return self._vector(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency + self.per_text_latency * len(texts))
+        return [self._vector(text) for text in texts]
+
+class FakePineconeIndex(LocalVectorIndex):
+    """In-memory stand-in for a Pinecone index with injected network latency and errors."""
+    def __init__(self, dimension: int = 384, latency: float = 0.02, jitter: float = 0.005,
+                 error_rate: float = 0.0, seed: int = 0):
+        super().__init__(tempfile.mkdtemp(prefix="fake_pinecone_"), dimension=dimension)
+        self.name = "fake-pinecone"
+        self.faults = FaultInjector("pinecone", latency, jitter, error_rate, seed)
+
+    def query(self, *args, **kwargs):
+        self.faults.apply()
+        return super().query(*args, **kwargs)
+
+    def upsert(self, vectors, **kwargs):
+        self.faults.apply()
+        return super().upsert(vectors, **kwargs)
+
+    def delete(self, ids=None, **kwargs):
+        self.faults.apply()
+        return super().delete(ids=ids, **kwargs)
+
+    def persist(self):
+        """A remote index persists writes itself."""
+        pass
+
+class FakeTavilyServer:
+    """Local HTTP server answering like api.tavily.com/search, for WebSearch(base_url=...)."""
+    def __init__(self, latency: float = 0.3, jitter: float = 0.05, error_rate: float = 0.0, seed: int = 0):
+        self.faults = FaultInjector("tavily", latency, jitter, 0.0, seed)
+        self.error_rate = error_rate
+        self.requests = 0
+        self._error_faults = FaultInjector("tavily-errors", error_rate=error_rate, seed=seed)
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/search"
+
+    def start(self) -> "FakeTavilyServer":
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                fake.requests += 1
+                fake.faults.apply()
+                if fake._error_faults.should_fail():
+                    status, body = 503, {"error": "injected failure"}
+                else:
+                    status, body = 200, fake._results(payload)
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    @staticmethod
+    def _results(payload: Dict) -> Dict:
+        query = payload.get("query", "")
+        results = []
+        for i in range(payload.get("max_results", 5)):
+            results.append({
+                "title": f"Worked example {i + 1}",
+                "content": f"Step-by-step discussion of {query} using standard algebraic identities (part {i + 1}).",
+                "url": f"https://math.stackexchange.com/questions/{abs(hash((query, i))) % 10**6}",
+                "score": round(0.9 - 0.1 * i, 2)
+            })
+        return {"answer": "", "results": results}
+
+class FakeGroqClient:
+    """Stand-in for the Groq client (chat.completions.create), streaming or not."""
+    def __init__(self, first_token_latency: float = 0.3, token_latency: float = 0.002,
+                 tokens: int = 150, error_rate: float = 0.0, seed: int = 0):
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.tokens = tokens
+        self.faults = FaultInjector("groq", 0.0, 0.0, error_rate, seed)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _answer_tokens(self, messages: List[Dict]) -> List[str]:
+        question = messages[-1]["content"].rsplit("Question:", 1)[-1].strip()
+        words = f"To answer {question} we work through it step by step and check each result.".split()
+        return [(words[i % len(words)] + " ") for i in range(self.tokens)]
+
+    def _create(self, model: str, messages: List[Dict], temperature: float = 0.1,
+                max_tokens: int = 1024, stream: bool = False, **kwargs):
+        tokens = self._answer_tokens(messages)
+        if not stream:
+            self.faults.apply(self.first_token_latency + self.token_latency * len(tokens))
+            message = SimpleNamespace(content="".join(tokens))
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+        self.faults.apply(self.first_token_latency)
+
+        def chunks():
+            for token in tokens:
+                time.sleep(self.token_latency)
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+        return chunks()
+
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(np.ceil(percentile / 100.0 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+def _summarize(values: List[float]) -> Dict:
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "p50": round(_percentile(ordered, 50), 3),
+        "p95": round(_percentile(ordered, 95), 3),
+        "p99": round(_percentile(ordered, 99), 3),
+        "mean": round(sum(ordered) / len(ordered), 3) if ordered else 0.0
+    }
+
+class Benchmark:
+    """
+    Runs end-to-end scenarios against offline stand-ins and reports p50/p95/p99
+    latency (ms) and throughput per scenario and per pipeline stage.
+    """
+    def __init__(self, args):
+        self.args = args
+        self.workdir = tempfile.mkdtemp(prefix="math_agent_bench_")
+        self.rng = random.Random(args.seed)
+        self.tavily = FakeTavilyServer(args.web_latency, args.web_latency / 5, args.error_rate, args.seed).start()
+        self.components = self._build_components()
+        self.kb_questions = [f"State and prove result {i} about roots of quadratic equations" for i in range(50)]
+        self.web_questions = [f"Explain the history behind classical problem {i} in number theory" for i in range(50)]
+
+    def close(self):
+        self.tavily.stop()
+
+    def _build_components(self) -> Dict:
+        from kb import MathKnowledgeBase
+        from router import Router
+        from web_search import WebSearch
+        from main import LLMIntegration
+        from guardrails import Guardrails
+        from cache import AnswerCache
+        from embeddings import EmbeddingService
+        from lexical import BM25Index
+
+        args = self.args
+        kb = MathKnowledgeBase(
+            embeddings=EmbeddingService(FakeEmbeddings(latency=args.embed_latency)),
+            index=FakePineconeIndex(latency=args.kb_latency, jitter=args.kb_latency / 5,
+                                    error_rate=args.error_rate, seed=args.seed),
+            manifest_path=os.path.join(self.workdir, "ingest_manifest.json"),
+            lexical_index=BM25Index(os.path.join(self.workdir, "lexical.json"))
+        )
+        web_search = WebSearch(base_url=self.tavily.url, cache_ttl=0, backoff_base=0.01)
+        web_search.api_key = "offline-benchmark"
+        return {
+            "kb": kb,
+            "router": Router(kb=kb, web_search=web_search),
+            "llm": LLMIntegration(client=FakeGroqClient(first_token_latency=args.llm_latency,
+                                                        error_rate=args.error_rate, seed=args.seed)),
+            "guardrails": Guardrails(),
+            "cache": AnswerCache(path=os.path.join(self.workdir, "answer_cache.sqlite"))
+        }
+
+    def _seed_kb(self):
+        """Index the KB questions verbatim so they route to the knowledge base."""
+        kb = self.components["kb"]
+        if kb.index.describe_index_stats()["total_vector_count"] >= len(self.kb_questions):
+            return
+        for question in self.kb_questions:
+            kb.add_to_knowledge_base(question, {"source": "benchmark", "page": 1})
+
+    def _questions(self, count: int) -> List[str]:
+        """Deterministic mix of KB-answerable and web-only questions."""
+        questions = []
+        for _ in range(count):
+            pool = self.kb_questions if self.rng.random() < self.args.kb_hit_ratio else self.web_questions
+            questions.append(self.rng.choice(pool))
+        return questions
+
+    def answer(self, query: str, use_cache: bool) -> Dict:
+        """Run one query through the same stages as app.py, collecting its spans."""
+        c = self.components
+        started = time.perf_counter()
+        source = "cache"
+        with trace("benchmark", collect=True) as current:
+            is_valid, _ = c["guardrails"].validate_input(query)
+            if not is_valid:
+                source = "rejected"
+            else:
+                query = c["guardrails"].sanitize_input(query)
+                cached, embedding = None, None
+                if use_cache:
+                    cached = c["cache"].get(query)
+                    if cached is None:
+                        embedding = c["kb"].embed_query(query)
+                        cached = c["cache"].get_similar(query, embedding)
+                if cached is None:
+                    source, context = c["router"].route_query(query, query_embedding=embedding)
+                    context, _ = c["guardrails"].filter_context(context)
+                    if c["guardrails"].validate_context(context)[0]:
+                        response = c["llm"].generate_response(query, context)
+                        if c["guardrails"].validate_output(response)[0] and use_cache and source != "error":
+                            c["cache"].put(query, source, context, response, query_embedding=embedding)
+        return {"latency_ms": (time.perf_counter() - started) * 1000, "source": source, "spans": current.spans}
+
+    def _report(self, results: List[Dict], elapsed: float) -> Dict:
+        stages: Dict[str, List[float]] = {}
+        sources: Dict[str, int] = {}
+        for result in results:
+            sources[result["source"]] = sources.get(result["source"], 0) + 1
+            for span in result["spans"]:
+                stages.setdefault(span["name"], []).append(span["duration_ms"])
+        return {
+            "requests": len(results),
+            "throughput_rps": round(len(results) / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": _summarize([r["latency_ms"] for r in results]),
+            "sources": sources,
+            "stages": {name: _summarize(values) for name, values in sorted(stages.items())}
+        }
+
+    def scenario_ingest(self) -> Dict:
+        """Ingest Data/*.pdf into a fresh fake index, then re-run to measure the incremental path."""
+        kb = self.components["kb"]
+        first = kb._initialize_knowledge_base(parse_workers=self.args.parse_workers)
+        second = kb._initialize_knowledge_base(parse_workers=self.args.parse_workers)
+        return {"initial": first, "incremental": second}
+
+    def scenario_single_query(self) -> Dict:
+        """Sequential requests without the answer cache."""
+        self._seed_kb()
+        questions = self._questions(self.args.requests)
+        started = time.perf_counter()
+        results = [self.answer(q, use_cache=False) for q in questions]
+        return self._report(results, time.perf_counter() - started)
+
+    def scenario_cache_mix(self) -> Dict:
+        """Sequential requests through the answer cache with roughly ``cache_hit_ratio`` repeats."""
+        self._seed_kb()
+        self.components["cache"].clear()
+        distinct = max(1, int(round(self.args.requests * (1 - self.args.cache_hit_ratio))))
+        pool = self._questions(distinct)
+        questions = pool + [self.rng.choice(pool) for _ in range(self.args.requests - distinct)]
+        self.rng.shuffle(questions)
+        started = time.perf_counter()
+        results = [self.answer(q, use_cache=True) for q in questions]
+        report = self._report(results, time.perf_counter() - started)
+        report["cache"] = self.components["cache"].get_stats()
+        return report
+
+    def scenario_concurrent(self) -> Dict:
+        """Requests from ``concurrency`` parallel clients without the answer cache."""
+        self._seed_kb()
+        questions = self._questions(self.args.requests)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as executor:
+            results = list(executor.map(lambda q: self.answer(q, use_cache=False), questions))
+        report = self._report(results, time.perf_counter() - started)
+        report["concurrency"] = self.args.concurrency
+        return report
+
+    def scenario_guardrails(self) -> Dict:
+        """Guardrails throughput in KB of text per second, per check."""
+        from guardrails import Guardrails
+
+        words = ("let x be a real root of the quadratic so the discriminant b^2 - 4ac is non-negative "
+                 "and by the theorem the sum of roots equals -b/a while their product equals c/a").split()
+        chunks = [" ".join(self.rng.choice(words) for _ in range(180)) for _ in range(200)]
+        context = [{"text": chunk} for chunk in chunks]
+        kilobytes = sum(len(chunk) for chunk in chunks) / 1024
+
+        def throughput(fn, min_seconds: float = 0.2) -> Dict:
+            rounds, started = 0, time.perf_counter()
+            while True:
+                fn()
+                rounds += 1
+                elapsed = time.perf_counter() - started
+                if elapsed >= min_seconds:
+                    break
+            return {"kb_per_s": round(kilobytes * rounds / elapsed, 1),
+                    "us_per_kb": round(elapsed / (kilobytes * rounds) * 1e6, 2)}
+
+        guardrails = Guardrails()
+        report = {
+            "per_pattern_scan": throughput(
+                lambda: [any(p.search(c) for p in guardrails.patterns) for c in chunks]),
+            "validate_output": throughput(lambda: [guardrails.validate_output(c) for c in chunks]),
+            "sanitize_input": throughput(lambda: [guardrails.sanitize_input(c) for c in chunks]),
+            "validate_context_cold": throughput(lambda: Guardrails().validate_context(context)),
+            "validate_context_cached": throughput(lambda: guardrails.validate_context(context)),
+            "validate_batch_cold": throughput(lambda: Guardrails().validate_batch(chunks)),
+        }
+        return {"text_kb": round(kilobytes, 1), "throughput": report}
+
+    def run(self, scenarios: List[str]) -> Dict:
+        report = {
+            "created": datetime.now().isoformat(),
+            "config": vars(self.args),
+            "scenarios": {}
+        }
+        for name in scenarios:
+            scenario = getattr(self, f"scenario_{name}", None)
+            if scenario is None:
+                raise ValueError(f"Unknown scenario '{name}'")
+            print(f"Running scenario '{name}'...")
+            metrics.reset()
+            report["scenarios"][name] = scenario()
+        return report
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """List regressions: p95 latency or throughput worse than the baseline by more than ``tolerance``."""
+    regressions = []
+    for name, result in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        for check, summary in result.get("throughput", {}).items():
+            base_check = base.get("throughput", {}).get(check)
+            if base_check and summary["kb_per_s"] < base_check["kb_per_s"] * (1 - tolerance):
+                regressions.append(f"{name}/{check}: {summary['kb_per_s']} KB/s "
+                                   f"vs baseline {base_check['kb_per_s']} KB/s")
+        if "latency_ms" not in result or "latency_ms" not in base:
+            continue
+        if result["latency_ms"]["p95"] > base["latency_ms"]["p95"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 latency {result['latency_ms']['p95']}ms "
+                               f"vs baseline {base['latency_ms']['p95']}ms")
+        if result["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {result['throughput_rps']} rps "
+                               f"vs baseline {base['throughput_rps']} rps")
+        for stage, summary in result.get("stages", {}).items():
+            base_stage = base.get("stages", {}).get(stage)
+            if base_stage and summary["p95"] > base_stage["p95"] * (1 + tolerance) and summary["p95"] > 1.0:
+                regressions.append(f"{name}/{stage}: p95 {summary['p95']}ms vs baseline {base_stage['p95']}ms")
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmarks for the math agent.")
+    parser.add_argument("--scenarios", default="ingest,single_query,cache_mix,concurrent,guardrails",
+                        help="Comma-separated scenarios: ingest, single_query, cache_mix, concurrent, guardrails")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--kb-hit-ratio", type=float, default=0.5)
+    parser.add_argument("--cache-hit-ratio", type=float, default=0.7)
+    parser.add_argument("--embed-latency", type=float, default=0.005)
+    parser.add_argument("--kb-latency", type=float, default=0.03, help="Injected Pinecone latency (s)")
+    parser.add_argument("--web-latency", type=float, default=0.4, help="Injected Tavily latency (s)")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Injected Groq time to first token (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Injected error rate for every stand-in")
+    parser.add_argument("--parse-workers", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=BENCHMARK_REPORT_PATH,
+                        help=f"Where to write the JSON report (use {BENCHMARK_BASELINE_PATH} to record a baseline)")
+    parser.add_argument("--compare", help="Baseline JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args(argv)
+
+    # Load the baseline before running, so a report written over it can never be compared with itself
+    baseline = None
+    if args.compare:
+        if os.path.abspath(args.compare) == os.path.abspath(args.output):
+            parser.error("--output must differ from --compare, or the baseline would be overwritten")
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+
+    benchmark = Benchmark(args)
+    try:
+        report = benchmark.run([s.strip() for s in args.scenarios.split(",") if s.strip()])
+    finally:
+        benchmark.close()
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote benchmark report to {args.output}")
+
+    for name, result in report["scenarios"].items():
+        if "latency_ms" in result:
+            latency = result["latency_ms"]
+            print(f"{name:>14}: p50 {latency['p50']}ms  p95 {latency['p95']}ms  p99 {latency['p99']}ms  "
+                  f"{result['throughput_rps']} req/s")
+        for check, summary in result.get("throughput", {}).items():
+            print(f"{name + '/' + check:>40}: {summary['kb_per_s']} KB/s  {summary['us_per_kb']} us/KB")
+
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,288 @@
+#cache.py
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import metrics
+
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", ".answer_cache.sqlite")
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 7 * 24 * 3600))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 2048))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", 0.95))
+
+_OPERATOR_SPACING = re.compile(r"\s*([=+\-*/^(),<>])\s*")
+_NUMBERS = re.compile(r"\d+(?:\.\d+)?")
+# Trailing "?" and "." are punctuation; "!" only when it does not follow an operand (a digit, ")" or a
+# single-letter variable), since "5!" and "(x+1)!" are factorials
+_TRAILING_PUNCTUATION = re.compile(r"(?:[ ?.]|(?<![0-9)!])(?<!\b[a-z])!+)+$")
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a (sanitized) query for exact-match caching.
+    Case, repeated whitespace, spacing around operators and trailing punctuation are ignored,
+    but a trailing factorial is kept, so "what is 5!" and "what is 5" stay different.
+    """
+    normalized = " ".join(query.lower().split())
+    normalized = _OPERATOR_SPACING.sub(r"\1", normalized)
+    return _TRAILING_PUNCTUATION.sub("", normalized)
+
+class TTLCache:
+    """Thread-safe LRU cache with per-entry expiry."""
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def keys(self) -> List:
+        with self._lock:
+            return list(self._data.keys())
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+class AnswerCache:
+    """
+    Two-level answer cache in front of Router.route_query and LLMIntegration.generate_response.
+
+    Level 1 is an exact match on the normalized query; level 2 is an approximate match on the
+    query embedding above a cosine threshold. Entries (source, context, answer) live in an
+    in-memory LRU with TTL backed by a SQLite tier that survives restarts.
+    """
+    def __init__(self,
+                 path: Optional[str] = ANSWER_CACHE_PATH,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+                 ttl: float = ANSWER_CACHE_TTL,
+                 similarity_threshold: float = ANSWER_CACHE_SIMILARITY):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+
+        self._memory = TTLCache(max_entries=max_entries, ttl=ttl)
+        self._lock = threading.Lock()
+        self._embeddings: Dict[str, np.ndarray] = {}
+        self._matrix = None
+        self._matrix_keys: List[str] = []
+
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "key TEXT PRIMARY KEY, source TEXT, context TEXT, answer TEXT, "
+                "embedding BLOB, created_at REAL, last_access REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS answers_last_access ON answers(last_access)")
+            self._db.commit()
+            self._warm_from_disk()
+
+    def get(self, query: str) -> Optional[Dict]:
+        """Exact-match lookup on the normalized query."""
+        key = normalize_query(query)
+        entry = self._memory.get(key)
+        if entry is None:
+            entry = self._load_from_disk(key)
+        if entry is None:
+            return None
+        with self._lock:
+            self.stats["exact_hits"] += 1
+        metrics.inc("answer_cache_lookups", result="exact_hit")
+        return entry
+
+    def get_similar(self, query: str, query_embedding: List[float]) -> Optional[Dict]:
+        """
+        Approximate-match lookup on the query embedding.
+        Hits must also mention the same numbers as the query, so "x^2+5x+6" never
+        answers "x^2+5x+7" however close their embeddings are.
+        """
+        with self._lock:
+            matrix, keys = self._get_matrix()
+        if matrix is None or query_embedding is None:
+            self._record_miss()
+            return None
+
+        vector = self._normalize(query_embedding)
+        scores = matrix @ vector
+        signature = _NUMBERS.findall(normalize_query(query))
+        for row in np.argsort(-scores)[:5]:
+            if scores[row] < self.similarity_threshold:
+                break
+            entry = self._memory.get(keys[row])
+            if entry is None or _NUMBERS.findall(keys[row]) != signature:
+                continue
+            with self._lock:
+                self.stats["semantic_hits"] += 1
+            metrics.inc("answer_cache_lookups", result="semantic_hit")
+            return {**entry, "similarity": float(scores[row])}
+
+        self._record_miss()
+        return None
+
+    def put(self, query: str, source: str, context: List[Dict], answer: str,
+            query_embedding: Optional[List[float]] = None):
+        """Store the routed source, context and final answer for a query."""
+        key = normalize_query(query)
+        entry = {"query": key, "source": source, "context": context, "answer": answer}
+        self._memory.set(key, entry)
+
+        embedding = None
+        if query_embedding is not None:
+            embedding = self._normalize(query_embedding)
+        with self._lock:
+            self._prune_embeddings()
+            if embedding is not None:
+                self._embeddings[key] = embedding
+            self._matrix = None
+            self.stats["stores"] += 1
+
+        if self._db is not None:
+            now = time.time()
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, source, json.dumps(context), answer,
+                     embedding.tobytes() if embedding is not None else None, now, now)
+                )
+                self._evict_disk(now)
+                self._db.commit()
+
+    def get_stats(self) -> Dict:
+        """Hit/miss counters and current size."""
+        with self._lock:
+            stats = dict(self.stats)
+        hits = stats["exact_hits"] + stats["semantic_hits"]
+        lookups = hits + stats["misses"]
+        stats["entries"] = len(self._memory)
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        self._memory.clear()
+        with self._lock:
+            self._embeddings.clear()
+            self._matrix = None
+            if self._db is not None:
+                self._db.execute("DELETE FROM answers")
+                self._db.commit()
+
+    def _record_miss(self):
+        with self._lock:
+            self.stats["misses"] += 1
+        metrics.inc("answer_cache_lookups", result="miss")
+
+    def _get_matrix(self):
+        """Stack cached embeddings into one matrix, rebuilt lazily after writes."""
+        if self._matrix is None and self._embeddings:
+            self._matrix_keys = list(self._embeddings.keys())
+            self._matrix = np.vstack([self._embeddings[k] for k in self._matrix_keys])
+        return self._matrix, self._matrix_keys
+
+    def _prune_embeddings(self):
+        """Drop embeddings whose entries were evicted from the LRU tier."""
+        if len(self._embeddings) < self.max_entries:
+            return
+        live = set(self._memory.keys())
+        for key in [k for k in self._embeddings if k not in live]:
+            del self._embeddings[key]
+
+    def _load_from_disk(self, key: str) -> Optional[Dict]:
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT source, context, answer, embedding, created_at FROM answers WHERE key = ?",
+                (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        source, context, answer, embedding, created_at = row
+        if created_at + self.ttl < time.time():
+            return None
+
+        entry = {"query": key, "source": source, "context": json.loads(context), "answer": answer}
+        self._memory.set(key, entry, ttl=created_at + self.ttl - time.time())
+        with self._lock:
+            if embedding is not None:
+                self._embeddings[key] = np.frombuffer(embedding, dtype=np.float32)
+                self._matrix = None
+            self._db.execute("UPDATE answers SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self.stats["disk_hits"] += 1
+        return entry
+
+    def _warm_from_disk(self):
+        """Load the most recently used, unexpired entries into memory."""
+        cutoff = time.time() - self.ttl
+        rows = self._db.execute(
+            "SELECT key, source, context, answer, embedding, created_at FROM answers "
+            "WHERE created_at >= ? ORDER BY last_access DESC LIMIT ?",
+            (cutoff, self.max_entries)
+        ).fetchall()
+        now = time.time()
+        for key, source, context, answer, embedding, created_at in reversed(rows):
+            entry = {"query": key, "source": source, "context": json.loads(context), "answer": answer}
+            self._memory.set(key, entry, ttl=created_at + self.ttl - now)
+            if embedding is not None:
+                self._embeddings[key] = np.frombuffer(embedding, dtype=np.float32)
+
+    def _evict_disk(self, now: float):
+        """Bound the disk tier by TTL and size, dropping the least recently used rows."""
+        self._db.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl,))
+        self._db.execute(
+            "DELETE FROM answers WHERE key NOT IN "
+            "(SELECT key FROM answers ORDER BY last_access DESC LIMIT ?)",
+            (self.max_entries * 4,)
+        )
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
@@ -0,0 +1,193 @@
+#chunking.py
+import os
+import re
+import sys
+import glob
+from typing import Dict, List
+
+CHUNK_MAX_CHARS = int(os.getenv("CHUNK_MAX_CHARS", 1200))
+CHUNK_MIN_CHARS = int(os.getenv("CHUNK_MIN_CHARS", 200))
+# Only a chunk that continues a block split mid-way repeats (at most) this much of the previous one
+CHUNK_OVERLAP_CHARS = int(os.getenv("CHUNK_OVERLAP_CHARS", 150))
+
+# Lines opening a theorem-like block; proofs and solutions stay with the statement before them
+_BLOCK_START = re.compile(
+    r"^(theorem|lemma|proposition|corollary|definition|example|exercise|problem|remark|note|"
+    r"proof|solution|chapter|section|\d+(\.\d+)*\s+[A-Z])\b",
+    re.IGNORECASE
+)
+_CONTINUATION_START = re.compile(r"^(proof|solution)\b", re.IGNORECASE)
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z(])")
+_MATH_CHARS = set("=+-*/^<>()[]{}|≤≥≠≈±×÷∑∏∫√∞∂∆∇πθαβγδελμσφω")
+_WORD = re.compile(r"[A-Za-z]{3,}")
+_RELATIONS = ("=", "≤", "≥", "≠", "≈", "<", ">")
+
+def is_equation(line: str) -> bool:
+    """Heuristic for a display equation line: mostly symbols and digits, few words."""
+    line = line.strip()
+    if not line:
+        return False
+    mathy = sum(1 for c in line if c in _MATH_CHARS or c.isdigit())
+    words = len(_WORD.findall(line))
+    if any(r in line for r in _RELATIONS) and words <= 3:
+        return True
+    return mathy / len(line) > 0.35 and words <= 2
+
+class _Unit:
+    """Smallest piece the chunker moves around: a sentence or a whole equation line."""
+    __slots__ = ("text", "block_start", "glue_next")
+
+    def __init__(self, text: str, block_start: bool = False, glue_next: bool = False):
+        self.text = text
+        self.block_start = block_start
+        self.glue_next = glue_next
+
+class MathChunker:
+    """
+    Chunker for math text that never splits an equation line, keeps theorem/proof/example
+    blocks together where they fit, and breaks between blocks rather than mid-sentence.
+
+    Chunks are variable-size, up to ``max_chars`` (an equation glued to its lead-in may
+    push a chunk somewhat past it). Only chunks that continue a block split mid-way repeat
+    the previous chunk's last sentence (at most ``overlap_chars``), instead of a fixed
+    overlap on every chunk. Sizes of emitted chunks are collected for ``size_report``.
+    Drop-in for the ``split_documents`` interface of LangChain text splitters.
+    """
+    def __init__(self,
+                 max_chars: int = CHUNK_MAX_CHARS,
+                 min_chars: int = CHUNK_MIN_CHARS,
+                 overlap_chars: int = CHUNK_OVERLAP_CHARS):
+        self.max_chars = max_chars
+        self.min_chars = min_chars
+        self.overlap_chars = overlap_chars
+        self.sizes: List[int] = []
+
+    @property
+    def fingerprint(self) -> str:
+        """Identifies the chunking settings in the ingestion manifest."""
+        return f"math-{self.max_chars}-{self.min_chars}-{self.overlap_chars}"
+
+    def split_documents(self, documents) -> List:
+        from langchain.schema import Document
+
+        chunks = []
+        for doc in documents:
+            for text in self.split_text(doc.page_content):
+                chunks.append(Document(page_content=text, metadata=dict(doc.metadata)))
+        return chunks
+
+    def split_text(self, text: str) -> List[str]:
+        chunks = self._pack(self._units(text))
+        self.sizes.extend(len(chunk) for chunk in chunks)
+        return chunks
+
+    def size_report(self) -> Dict:
+        return size_report(self.sizes)
+
+    def _units(self, text: str) -> List[_Unit]:
+        """Turn page text into sentences and equation lines, marking block starts."""
+        units: List[_Unit] = []
+        prose: List[str] = []
+        paragraph_start = True
+
+        def flush_prose():
+            nonlocal paragraph_start
+            if not prose:
+                return
+            joined = " ".join(prose)
+            for i, sentence in enumerate(s for s in _SENTENCE_END.split(joined) if s.strip()):
+                units.append(_Unit(sentence.strip(), block_start=paragraph_start and i == 0))
+            prose.clear()
+            paragraph_start = False
+
+        for raw in text.splitlines():
+            line = raw.strip()
+            if not line:
+                # A blank line ends the paragraph
+                flush_prose()
+                paragraph_start = True
+                continue
+            if _BLOCK_START.match(line):
+                flush_prose()
+                paragraph_start = not _CONTINUATION_START.match(line)
+            if is_equation(line):
+                flush_prose()
+                if units:
+                    # Keep an equation with the sentence introducing it
+                    units[-1].glue_next = True
+                units.append(_Unit(line, block_start=paragraph_start))
+                paragraph_start = False
+                continue
+            if prose and prose[-1].endswith("-") and line[:1].islower():
+                # Re-join words hyphenated across lines
+                prose[-1] = prose[-1][:-1] + line
+            else:
+                prose.append(line)
+        flush_prose()
+        return units
+
+    def _pack(self, units: List[_Unit]) -> List[str]:
+        chunks: List[str] = []
+        current: List[_Unit] = []
+        size = 0
+
+        for i, unit in enumerate(units):
+            glued = bool(current) and current[-1].glue_next
+            fits = size + len(unit.text) + 1 <= self.max_chars
+            # Prefer breaking between blocks once the chunk has some substance
+            block_break = unit.block_start and size >= self.min_chars and size + len(unit.text) > self.max_chars * 0.6
+            overflow = not fits and not (glued and size + len(unit.text) <= self.max_chars * 1.5)
+            if current and (block_break or overflow):
+                chunks.append(" ".join(u.text for u in current))
+                carry = []
+                if not unit.block_start and self.overlap_chars:
+                    # Mid-block split: repeat the last sentence so the continuation has context
+                    last = current[-1]
+                    if len(last.text) <= self.overlap_chars and not is_equation(last.text):
+                        carry = [last]
+                current = carry
+                size = sum(len(u.text) + 1 for u in current)
+            current.append(unit)
+            size += len(unit.text) + 1
+
+        if current:
+            text = " ".join(u.text for u in current)
+            if chunks and len(text) < self.min_chars and len(chunks[-1]) + len(text) < self.max_chars * 1.25:
+                # Fold a short tail into the previous chunk rather than indexing a fragment
+                chunks[-1] = chunks[-1] + " " + text
+            else:
+                chunks.append(text)
+        return [chunk for chunk in chunks if chunk.strip()]
+
+def size_report(sizes: List[int]) -> Dict:
+    """Chunk count and size distribution in characters."""
+    if not sizes:
+        return {"chunks": 0}
+    ordered = sorted(sizes)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    return {"chunks": len(ordered), "total_chars": sum(ordered), "min": ordered[0],
+            "p50": pct(50), "p90": pct(90), "max": ordered[-1],
+            "mean": round(sum(ordered) / len(ordered), 1)}
+
+def main(argv: List[str]):
+    """Compare chunk count and sizes of the math-aware and recursive chunkers on some PDFs."""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from ingest import count_pdf_pages, parse_pdf_pages
+
+    pdf_files = argv or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Data", "*.pdf")))
+    recursive = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len,
+                                               separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""])
+    math_chunker = MathChunker()
+    recursive_sizes = []
+    for pdf_path in pdf_files:
+        for _, text in parse_pdf_pages(pdf_path, 0, count_pdf_pages(pdf_path)):
+            recursive_sizes.extend(len(chunk) for chunk in recursive.split_text(text))
+            math_chunker.split_text(text)
+    print(f"recursive-1000-200:   {size_report(recursive_sizes)}")
+    print(f"{math_chunker.fingerprint}: {math_chunker.size_report()}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
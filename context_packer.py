@@ -0,0 +1,129 @@
+#context_packer.py
+import os
+import re
+from typing import Dict, List, Tuple
+
+from metrics import metrics
+
+# Prompt tokens allowed for retrieved context (llama3-70b-8192 has an 8192-token window,
+# shared with the system prompt, the question and up to 1024 generated tokens)
+LLM_CONTEXT_BUDGET = int(os.getenv("LLM_CONTEXT_BUDGET", 3000))
+# Chunks whose word shingles overlap at least this much are treated as duplicates
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", 0.8))
+# Truncating a chunk is only worth it if at least this many tokens of it fit
+CONTEXT_MIN_TRUNCATED_TOKENS = 80
+
+metrics.describe("llm_context_tokens", "Estimated prompt tokens of packed context",
+                 buckets=(250, 500, 1000, 2000, 3000, 4000, 6000, 8000))
+metrics.describe("llm_context_items", "Context items by packing outcome")
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENCODING = None
+
+_WORD = re.compile(r"\w+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken if installed, else a conservative ~3 characters per token."""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return len(text) // 3 + 1
+
+def _shingles(text: str, size: int = 5) -> set:
+    words = _WORD.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+class ContextPacker:
+    """
+    Turns retrieved context into the prompt's context block under a token budget.
+
+    Items are ranked by score, near-duplicates (word-shingle Jaccard at or above
+    ``dedup_threshold``) are dropped, and items are added whole until the budget runs
+    out; the first item that does not fit is cut at a sentence boundary if enough of
+    it fits. Outcomes are counted in ``llm_context_items``.
+    """
+    def __init__(self, budget_tokens: int = LLM_CONTEXT_BUDGET, dedup_threshold: float = CONTEXT_DEDUP_THRESHOLD):
+        self.budget_tokens = budget_tokens
+        self.dedup_threshold = dedup_threshold
+
+    def pack(self, context: List[Dict]) -> Tuple[str, Dict]:
+        """Return the formatted context block and a summary of what was packed."""
+        ranked = sorted(context, key=lambda item: item.get("score") or 0.0, reverse=True)
+        stats = {"packed": 0, "duplicate": 0, "truncated": 0, "dropped": 0, "tokens": 0}
+
+        kept_shingles: List[set] = []
+        blocks: List[str] = []
+        remaining = self.budget_tokens
+        for item in ranked:
+            text = item.get("text", "").strip()
+            shingles = _shingles(text)
+            if any(self._similar(shingles, other) for other in kept_shingles):
+                stats["duplicate"] += 1
+                continue
+
+            header = self._header(len(blocks) + 1, item)
+            tokens = count_tokens(header) + count_tokens(text)
+            if tokens > remaining:
+                text = self._truncate(text, remaining - count_tokens(header))
+                if not text:
+                    stats["dropped"] += 1
+                    continue
+                stats["truncated"] += 1
+                tokens = count_tokens(header) + count_tokens(text)
+            else:
+                stats["packed"] += 1
+
+            blocks.append(f"{header}{text}")
+            kept_shingles.append(shingles)
+            remaining -= tokens
+            stats["tokens"] += tokens
+
+        for outcome in ("packed", "duplicate", "truncated", "dropped"):
+            if stats[outcome]:
+                metrics.inc("llm_context_items", stats[outcome], outcome=outcome)
+        metrics.observe("llm_context_tokens", stats["tokens"])
+        return "\n\n".join(blocks), stats
+
+    def _similar(self, a: set, b: set) -> bool:
+        if not a or not b:
+            return False
+        return len(a & b) / len(a | b) >= self.dedup_threshold
+
+    @staticmethod
+    def _header(number: int, item: Dict) -> str:
+        """One compact line of provenance instead of separate Source/Page/URL lines."""
+        where = []
+        if item.get("source"):
+            where.append(str(item["source"]))
+        if item.get("page") not in (None, ""):
+            where.append(f"page {item['page']}")
+        if item.get("url"):
+            where.append(item["url"])
+        return f"Context {number}" + (f" ({', '.join(where)})" if where else "") + ":\n"
+
+    @staticmethod
+    def _truncate(text: str, budget: int) -> str:
+        """Longest run of whole sentences from the start of ``text`` within ``budget`` tokens."""
+        if budget < CONTEXT_MIN_TRUNCATED_TOKENS:
+            return ""
+        kept, used = [], 0
+        for sentence in _SENTENCE_END.split(text):
+            cost = count_tokens(sentence) + 1
+            if used + cost > budget:
+                break
+            kept.append(sentence)
+            used += cost
+        if not kept:
+            # One long run-on "sentence" (e.g. an equation dump): cut at a word boundary, starting
+            # from ~4 characters per token and shrinking until the tokenizer agrees it fits
+            cut = text[:budget * 4].rsplit(" ", 1)[0]
+            while cut and count_tokens(cut) > budget:
+                shorter = min(len(cut) - 1, len(cut) * budget // count_tokens(cut))
+                cut = cut[:shorter].rsplit(" ", 1)[0]
+            return cut
+        return " ".join(kept)
@@ -0,0 +1,275 @@
+#embeddings.py
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from metrics import metrics
+from cache import TTLCache, normalize_query
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Inference backend for the embedder: "torch", "onnx" (fp32) or "onnx-int8" (quantized, CPU)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_INT8_FILE = os.getenv("EMBEDDING_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+# Start loading the model in a background thread as soon as the app starts
+EMBEDDING_WARMUP = os.getenv("EMBEDDING_WARMUP", "true").lower() in ("1", "true", "yes")
+
+# Query embedding service: requests arriving within the window are embedded in one batch
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", 5))
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", 32))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 4096))
+EMBEDDING_CACHE_DTYPE = os.getenv("EMBEDDING_CACHE_DTYPE", "float16")  # float16 or float32
+
+metrics.describe("embedding_model_load_seconds", "Time to load the embedding model, by backend")
+metrics.describe("embedding_batch_size", "Queries embedded per batched forward pass",
+                 buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+metrics.describe("embedding_queue_wait_seconds", "Time a query waited for its batch to start")
+metrics.describe("embedding_cache_lookups", "Query embedding cache lookups by result")
+
+_IMPORTED_AT = time.time()
+
+_models: Dict = {}
+_lock = threading.Lock()
+_warmup_lock = threading.Lock()
+_warmup_thread: Optional[threading.Thread] = None
+_report: Dict = {}
+
+def _model_kwargs(backend: str) -> Dict:
+    """SentenceTransformer keyword arguments for an inference backend."""
+    if backend == "onnx":
+        return {"device": "cpu", "backend": "onnx"}
+    if backend == "onnx-int8":
+        return {"device": "cpu", "backend": "onnx", "model_kwargs": {"file_name": EMBEDDING_ONNX_INT8_FILE}}
+    return {}
+
+def _load(model_name: str, backend: str):
+    # Imported here: pulling in sentence-transformers/torch is a large part of cold start
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    started = time.perf_counter()
+    try:
+        model = HuggingFaceEmbeddings(model_name=model_name, model_kwargs=_model_kwargs(backend))
+    except Exception as e:
+        if backend == "torch":
+            raise
+        print(f"Error loading {backend} embedding backend, falling back to torch: {e}")
+        backend = "torch"
+        model = HuggingFaceEmbeddings(model_name=model_name)
+    load_s = time.perf_counter() - started
+    metrics.observe("embedding_model_load_seconds", load_s, backend=backend)
+    _report.update({
+        "model": model_name,
+        "backend": backend,
+        "model_load_s": round(load_s, 3),
+        "ready_since_import_s": round(time.time() - _IMPORTED_AT, 3),
+    })
+    return model
+
+def get_embeddings(model_name: str = EMBEDDING_MODEL_NAME, backend: str = EMBEDDING_BACKEND):
+    """
+    Return the process-wide embedding model, loading it on first use.
+    Every MathKnowledgeBase (and so every Router) in the process shares it.
+    """
+    key = (model_name, backend)
+    model = _models.get(key)
+    if model is None:
+        with _lock:
+            model = _models.get(key)
+            if model is None:
+                model = _models[key] = _load(model_name, backend)
+    return model
+
+def warm_up(model_name: str = EMBEDDING_MODEL_NAME, backend: str = EMBEDDING_BACKEND) -> threading.Thread:
+    """
+    Load the model and run one embedding in a background thread, so the first real
+    query does not pay for it. Safe to call repeatedly; returns the warm-up thread.
+    """
+    global _warmup_thread
+
+    def run():
+        try:
+            model = get_embeddings(model_name, backend)
+            started = time.perf_counter()
+            model.embed_query("warm up")
+            _report["first_embed_s"] = round(time.perf_counter() - started, 3)
+        except Exception as e:
+            print(f"Error warming up embedding model: {e}")
+
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=run, name="embedding-warmup", daemon=True)
+            _warmup_thread.start()
+        return _warmup_thread
+
+def startup_report() -> Dict:
+    """Timings of the model load and first embedding in this process."""
+    return dict(_report, warm=bool(_models))
+
+class LazyEmbeddings:
+    """
+    Embeddings interface (embed_query/embed_documents) backed by the shared model,
+    which is only loaded when the first text is embedded.
+    """
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, backend: str = EMBEDDING_BACKEND):
+        self.model_name = model_name
+        self.backend = backend
+
+    @property
+    def model(self):
+        return get_embeddings(self.model_name, self.backend)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.model.embed_query(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.model.embed_documents(texts)
+
+class EmbeddingService:
+    """
+    Query embedder that merges concurrent requests into batched forward passes.
+
+    ``submit`` returns a Future; a worker thread collects requests arriving within
+    ``batch_window`` seconds (up to ``max_batch_size``) and embeds them together.
+    An LRU cache of normalized query -> vector, stored as compact ``cache_dtype``
+    arrays, sits in front. Exposes the same embed_query/embed_documents interface.
+    """
+    def __init__(self,
+                 embeddings=None,
+                 batch_window: float = EMBEDDING_BATCH_WINDOW_MS / 1000,
+                 max_batch_size: int = EMBEDDING_MAX_BATCH,
+                 cache_size: int = EMBEDDING_CACHE_SIZE,
+                 cache_dtype: str = EMBEDDING_CACHE_DTYPE):
+        self.embeddings = embeddings if embeddings is not None else LazyEmbeddings()
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.cache_dtype = np.dtype(cache_dtype)
+        self._cache = TTLCache(max_entries=cache_size, ttl=float("inf")) if cache_size else None
+        self._queue: "queue.Queue" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, text: str) -> Future:
+        """Queue a query for embedding; the Future resolves to its vector."""
+        future = Future()
+        vector = self._cached(text)
+        if vector is not None:
+            future.set_result(vector)
+            return future
+        self._ensure_worker()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of queries in one pass, using and filling the cache."""
+        vectors = [self._cached(text) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            embedded = self._embed([texts[i] for i in missing])
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Documents bypass the query cache and the batching window."""
+        return self.embeddings.embed_documents(texts)
+
+    def close(self):
+        """Stop the worker thread after it drains queued requests."""
+        with self._lock:
+            if self._worker is not None:
+                self._queue.put(None)
+                self._worker.join()
+                self._worker = None
+
+    def _cached(self, text: str) -> Optional[List[float]]:
+        if self._cache is None:
+            return None
+        vector = self._cache.get(normalize_query(text))
+        metrics.inc("embedding_cache_lookups", result="miss" if vector is None else "hit")
+        return None if vector is None else vector.astype(np.float32).tolist()
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        """One forward pass over the distinct texts; results are cached."""
+        keys = [normalize_query(text) for text in texts]
+        unique = list(dict.fromkeys(keys))
+        first_text = {}
+        for key, text in zip(keys, texts):
+            first_text.setdefault(key, text)
+        metrics.observe("embedding_batch_size", len(unique))
+        vectors = dict(zip(unique, self.embeddings.embed_documents([first_text[k] for k in unique])))
+        if self._cache is not None:
+            for key, vector in vectors.items():
+                self._cache.set(key, np.asarray(vector, dtype=self.cache_dtype))
+        return [vectors[key] for key in keys]
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.perf_counter() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+
+            started = time.perf_counter()
+            for _, _, queued_at in batch:
+                metrics.observe("embedding_queue_wait_seconds", started - queued_at)
+            try:
+                vectors = self._embed([text for text, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+_service: Optional[EmbeddingService] = None
+
+def get_embedding_service() -> EmbeddingService:
+    """Process-wide query embedding service over the shared model."""
+    global _service
+    if _service is None:
+        with _lock:
+            if _service is None:
+                _service = EmbeddingService()
+    return _service
+
+def main():
+    """Print how long this process takes to get to its first embedding."""
+    embeddings = LazyEmbeddings()
+    first = time.perf_counter()
+    embeddings.embed_query("What is the derivative of x^2?")
+    report = startup_report()
+    report["first_query_s"] = round(time.perf_counter() - first, 3)
+    started = time.perf_counter()
+    embeddings.embed_query("Solve x^2 - 5x + 6 = 0")
+    report["warm_query_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    for name, value in report.items():
+        print(f"{name:>28}: {value}")
+
+if __name__ == "__main__":
+    main()
@@ -2,37 +2,31 @@ import dspy
 from typing import Dict, List, Optional
 import json
 from datetime import datetime
-import os
+from feedback_store import FeedbackStore
 
 class FeedbackCollector:
-    def __init__(self, feedback_file: str = "feedback_data.json"):
+    def __init__(self, feedback_file: str = "feedback_data.json", store: Optional[FeedbackStore] = None):
+        """
+        Args:
+            feedback_file (str): Legacy JSON feedback file, imported into the store once
+            store (Optional[FeedbackStore]): Feedback store to use instead of the default SQLite one
+        """
         self.feedback_file = feedback_file
-        self.feedback_data = self._load_feedback()
-        
-    def _load_feedback(self) -> List[Dict]:
-        """Load existing feedback data from file."""
-        if os.path.exists(self.feedback_file):
-            try:
-                with open(self.feedback_file, 'r') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                return []
-        return []
+        self.store = store if store is not None else FeedbackStore()
+        self.store.import_json(feedback_file)
         
-    def _save_feedback(self):
-        """Save feedback data to file."""
-        with open(self.feedback_file, 'w') as f:
-            json.dump(self.feedback_data, f, indent=2)
-            
     def collect_feedback(self, 
                         query: str,
                         response: str,
                         context: List[Dict],
                         source: str,
                         is_helpful: bool,
-                        user_comment: Optional[str] = None):
+                        user_comment: Optional[str] = None,
+                        route: Optional[Dict] = None):
         """
         Collect feedback for a query-response pair.
+        ``route`` is the routing decision behind the answer (Router.last_route()), used by
+        the tuning job to learn thresholds and re-ranking.
         """
         # Format context for feedback storage
         formatted_context = []
@@ -53,37 +47,30 @@ class FeedbackCollector:
             "context": formatted_context,
             "source": source,
             "is_helpful": is_helpful,
-            "user_comment": user_comment
+            "user_comment": user_comment,
+            "route": route
         }
         
-        self.feedback_data.append(feedback_entry)
-        self._save_feedback()
+        self.store.append(feedback_entry)
         
     def analyze_feedback(self) -> Dict:
         """
         Analyze collected feedback to identify patterns and areas for improvement.
+        Reads the store's running aggregates, so it costs the same however much feedback exists.
         
         Returns:
             Dict: Analysis results
         """
-        if not self.feedback_data:
+        rows = self.store.aggregates(window="all")
+        total_feedback = sum(row["total"] for row in rows)
+        if not total_feedback:
             return {"error": "No feedback data available"}
             
-        total_feedback = len(self.feedback_data)
-        helpful_count = sum(1 for entry in self.feedback_data if entry["is_helpful"])
+        helpful_count = sum(row["helpful"] for row in rows)
         
-        # Calculate source distribution
-        source_distribution = {}
-        for entry in self.feedback_data:
-            source = entry["source"]
-            source_distribution[source] = source_distribution.get(source, 0) + 1
-            
-        # Calculate average helpfulness by source
-        source_helpfulness = {}
-        for source in source_distribution:
-            source_entries = [entry for entry in self.feedback_data if entry["source"] == source]
-            helpful_count = sum(1 for entry in source_entries if entry["is_helpful"])
-            source_helpfulness[source] = helpful_count / len(source_entries)
+        # Source distribution and average helpfulness by source
+        source_distribution = {row["source"]: row["total"] for row in rows}
+        source_helpfulness = {row["source"]: row["helpful"] / row["total"] for row in rows}
             
         return {
             "total_feedback": total_feedback,
@@ -91,15 +78,32 @@ class FeedbackCollector:
             "source_distribution": source_distribution,
             "source_helpfulness": source_helpfulness
         }
+    
+    def get_rollups(self, window: str = "day", since: Optional[str] = None) -> List[Dict]:
+        """
+        Feedback totals and helpfulness rate per time bucket and source, for dashboards.
+        
+        Args:
+            window (str): "day" or "hour" buckets (or "all")
+            since (Optional[str]): ISO timestamp of the earliest bucket to include
+        """
+        rollups = self.store.aggregates(window=window, since=since)
+        for row in rollups:
+            row["helpfulness_rate"] = row["helpful"] / row["total"]
+        return rollups
         
-    def get_improvement_suggestions(self) -> List[str]:
+    def get_improvement_suggestions(self, analysis: Optional[Dict] = None) -> List[str]:
         """
         Generate suggestions for improvement based on feedback analysis.
         
+        Args:
+            analysis (Optional[Dict]): Result of analyze_feedback, computed if not given
+            
         Returns:
             List[str]: List of improvement suggestions
         """
-        analysis = self.analyze_feedback()
+        if analysis is None:
+            analysis = self.analyze_feedback()
         suggestions = []
         
         # Check overall helpfulness
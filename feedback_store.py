@@ -0,0 +1,269 @@
+#feedback_store.py
+import os
+import json
+import time
+import atexit
+import sqlite3
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Union
+
+FEEDBACK_DB_PATH = os.getenv("FEEDBACK_DB_PATH", ".feedback.sqlite")
+# Entries are buffered and written together once this many are pending or the interval has passed
+FEEDBACK_BATCH_SIZE = int(os.getenv("FEEDBACK_BATCH_SIZE", 1))
+FEEDBACK_FLUSH_INTERVAL = float(os.getenv("FEEDBACK_FLUSH_INTERVAL", 1.0))
+# SQLite fsync policy: "full" (fsync every commit), "normal" (fsync at WAL checkpoints) or "off"
+FEEDBACK_SYNC = os.getenv("FEEDBACK_SYNC", "normal").lower()
+
+_COLUMNS = ("timestamp", "query", "response", "context", "source", "is_helpful", "user_comment", "route")
+_INSERT = f"INSERT INTO feedback ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})"
+# Rollup windows: "all" has a single bucket, the others bucket by a prefix of the ISO timestamp
+WINDOWS = {"all": 0, "day": 10, "hour": 13}
+
+class FeedbackStore:
+    """
+    Append-only SQLite store for feedback entries.
+
+    Appends cost O(1) regardless of how many entries exist: each is one INSERT into a
+    WAL-mode database, batched per ``batch_size`` entries / ``flush_interval`` seconds,
+    with the fsync policy set by ``sync``. SQLite's file locks (with a busy timeout) make
+    it safe for several Streamlit processes to write at once. Reads stream rows in pages
+    and can filter on the indexed source and timestamp columns.
+
+    Running totals (entries and helpful entries per source, overall and per day/hour) are
+    kept in an ``aggregates`` table updated in the same transaction as each write, so
+    analytics read a handful of rows instead of scanning the feedback.
+    """
+    def __init__(self,
+                 path: str = FEEDBACK_DB_PATH,
+                 batch_size: int = FEEDBACK_BATCH_SIZE,
+                 flush_interval: float = FEEDBACK_FLUSH_INTERVAL,
+                 sync: str = FEEDBACK_SYNC):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._pending: List[tuple] = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(f"PRAGMA synchronous={sync if sync in ('full', 'normal', 'off') else 'normal'}")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS feedback ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT, query TEXT, response TEXT, "
+            "context TEXT, source TEXT, is_helpful INTEGER, user_comment TEXT, route TEXT)"
+        )
+        if "route" not in [row[1] for row in self._db.execute("PRAGMA table_info(feedback)")]:
+            try:
+                self._db.execute("ALTER TABLE feedback ADD COLUMN route TEXT")
+            except sqlite3.OperationalError:
+                pass  # Another process added it first
+        self._db.execute("CREATE INDEX IF NOT EXISTS feedback_source ON feedback(source, timestamp)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS feedback_timestamp ON feedback(timestamp)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS aggregates ("
+            "window TEXT, bucket TEXT, source TEXT, total INTEGER, helpful INTEGER, "
+            "PRIMARY KEY (window, bucket, source))"
+        )
+        self._db.commit()
+        self._ensure_aggregates()
+        atexit.register(self.flush)
+
+    def append(self, entry: Dict):
+        """
+        Queue one entry. The batch is written when it fills or, on a later append, once the
+        flush interval has passed; reads and process exit flush whatever is left.
+        """
+        row = self._row(entry)
+        with self._lock:
+            self._pending.append(row)
+            if len(self._pending) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush_locked()
+
+    def flush(self):
+        """Write any buffered entries in one transaction."""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        with self._db:
+            self._db.executemany(_INSERT, self._pending)
+            self._add_to_aggregates(self._pending)
+        self._pending.clear()
+
+    def iter_entries(self,
+                     source: Optional[str] = None,
+                     since: Optional[Union[str, datetime]] = None,
+                     until: Optional[Union[str, datetime]] = None,
+                     page_size: int = 500) -> Iterator[Dict]:
+        """Stream entries oldest first, optionally only one source and/or a time range."""
+        self.flush()
+        where, params = self._filters(source, since, until)
+        last_id = 0
+        while True:
+            # Keyset pagination: each page is an index range scan, and no cursor stays open between pages
+            with self._lock:
+                rows = self._db.execute(
+                    f"SELECT id, {', '.join(_COLUMNS)} FROM feedback WHERE id > ?{where} ORDER BY id LIMIT ?",
+                    [last_id, *params, page_size]
+                ).fetchall()
+            for row in rows:
+                yield self._entry(row)
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1][0]
+
+    def count(self,
+              source: Optional[str] = None,
+              since: Optional[Union[str, datetime]] = None,
+              until: Optional[Union[str, datetime]] = None) -> int:
+        self.flush()
+        where, params = self._filters(source, since, until)
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM feedback WHERE 1 = 1{where}", params).fetchone()[0]
+
+    def import_json(self, json_path: str) -> int:
+        """
+        One-time migration of a legacy feedback JSON file (a list of entries).
+        Returns the number of entries imported; an already imported file is skipped.
+        """
+        if not os.path.exists(json_path):
+            return 0
+        key = f"imported:{os.path.abspath(json_path)}"
+        try:
+            with open(json_path, 'r') as f:
+                entries = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Ignoring unreadable feedback file {json_path}: {e}")
+            return 0
+        with self._lock:
+            self._flush_locked()
+            # Take the write lock first so two processes starting together import the file once
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if self._db.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone():
+                    self._db.rollback()
+                    return 0
+                rows = [self._row(entry) for entry in entries]
+                self._db.executemany(_INSERT, rows)
+                self._add_to_aggregates(rows)
+                self._db.execute("INSERT INTO meta VALUES (?, ?)", (key, datetime.now().isoformat()))
+                self._db.commit()
+            except Exception:
+                self._db.rollback()
+                raise
+        return len(entries)
+
+    def aggregates(self,
+                   window: str = "all",
+                   since: Optional[Union[str, datetime]] = None,
+                   source: Optional[str] = None) -> List[Dict]:
+        """
+        Precomputed rollups as {bucket, source, total, helpful} rows, oldest bucket first.
+        ``window`` is "all", "day" or "hour"; ``since`` keeps buckets from that time on.
+        """
+        if window not in WINDOWS:
+            raise ValueError(f"Unknown aggregate window '{window}', expected one of {list(WINDOWS)}")
+        self.flush()
+        query = "SELECT bucket, source, total, helpful FROM aggregates WHERE window = ?"
+        params: List = [window]
+        if since is not None:
+            since = since.isoformat() if isinstance(since, datetime) else since
+            query += " AND bucket >= ?"
+            params.append(since[:WINDOWS[window]])
+        if source is not None:
+            query += " AND source = ?"
+            params.append(source)
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY bucket, source", params).fetchall()
+        return [{"bucket": bucket, "source": source, "total": total, "helpful": helpful}
+                for bucket, source, total, helpful in rows]
+
+    def _add_to_aggregates(self, rows: List[tuple]):
+        """Fold rows into the running totals; runs inside the caller's transaction."""
+        totals, helpful = Counter(), Counter()
+        for row in rows:
+            timestamp, source, is_helpful = row[0], row[4], row[5]
+            for window, length in WINDOWS.items():
+                key = (window, timestamp[:length], source)
+                totals[key] += 1
+                helpful[key] += is_helpful
+        self._db.executemany(
+            "INSERT INTO aggregates VALUES (?, ?, ?, ?, ?) ON CONFLICT (window, bucket, source) "
+            "DO UPDATE SET total = total + excluded.total, helpful = helpful + excluded.helpful",
+            [(*key, total, helpful[key]) for key, total in totals.items()]
+        )
+
+    def _ensure_aggregates(self):
+        """Build the aggregates once from existing feedback (stores created before they existed)."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if not self._db.execute("SELECT 1 FROM meta WHERE key = 'aggregates'").fetchone():
+                    self._db.execute("DELETE FROM aggregates")
+                    cursor = self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM feedback")
+                    while True:
+                        rows = cursor.fetchmany(5000)
+                        if not rows:
+                            break
+                        self._add_to_aggregates(rows)
+                    self._db.execute("INSERT INTO meta VALUES ('aggregates', ?)", (datetime.now().isoformat(),))
+                self._db.commit()
+            except Exception:
+                self._db.rollback()
+                raise
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.flush)
+        self._db.close()
+
+    @staticmethod
+    def _row(entry: Dict) -> tuple:
+        return (
+            entry.get("timestamp") or datetime.now().isoformat(),
+            entry.get("query", ""),
+            entry.get("response", ""),
+            json.dumps(entry.get("context", [])),
+            entry.get("source", ""),
+            1 if entry.get("is_helpful") else 0,
+            entry.get("user_comment"),
+            json.dumps(entry["route"]) if entry.get("route") else None,
+        )
+
+    @staticmethod
+    def _filters(source, since, until):
+        where, params = "", []
+        if source is not None:
+            where += " AND source = ?"
+            params.append(source)
+        if since is not None:
+            where += " AND timestamp >= ?"
+            params.append(since.isoformat() if isinstance(since, datetime) else since)
+        if until is not None:
+            where += " AND timestamp < ?"
+            params.append(until.isoformat() if isinstance(until, datetime) else until)
+        return where, params
+
+    @staticmethod
+    def _entry(row) -> Dict:
+        _, timestamp, query, response, context, source, is_helpful, user_comment, route = row
+        return {
+            "timestamp": timestamp,
+            "query": query,
+            "response": response,
+            "context": json.loads(context) if context else [],
+            "source": source,
+            "is_helpful": bool(is_helpful),
+            "user_comment": user_comment,
+            "route": json.loads(route) if route else None
+        }
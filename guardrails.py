@@ -1,68 +1,193 @@
 #guardrails.py
+import os
 import re
-from typing import Tuple, List
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Tuple, List, Optional, Iterable, Iterator, AsyncIterable, AsyncIterator, Union
 import json
+from metrics import metrics, timed
+from cache import TTLCache
+
+# Characters of a streamed response held back until it is certain no harmful pattern
+# can still complete across them; must exceed the longest pattern match
+STREAM_HOLDBACK = 32
+MAX_OUTPUT_LENGTH = 5000
+CONTEXT_CHECK_CACHE_SIZE = 4096
+# Batches at least this large are checked in a process pool (the regex engine holds the GIL)
+GUARDRAILS_BATCH_WORKERS = int(os.getenv("GUARDRAILS_BATCH_WORKERS", min(4, os.cpu_count() or 1)))
+GUARDRAILS_PARALLEL_MIN_ITEMS = int(os.getenv("GUARDRAILS_PARALLEL_MIN_ITEMS", 256))
+
+# Message prefix, minimum and maximum length per kind of text
+_LIMITS = {
+    "input": ("Query", 3, 1000),
+    "output": ("Response", 10, MAX_OUTPUT_LENGTH),
+}
+
+metrics.describe("guardrails_violations", "Harmful-content matches by category")
+metrics.describe("guardrails_dropped_chunks", "Context chunks dropped by filter_context")
+
+_pool = None
+_pool_lock = threading.Lock()
+_worker_guardrails = None
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers)
+        return _pool
+
+def _check_texts(texts: List[str], kind: str) -> List[Dict]:
+    """Process-pool entry point: verdicts for a slice of a batch."""
+    global _worker_guardrails
+    if _worker_guardrails is None:
+        _worker_guardrails = Guardrails()
+    return [_worker_guardrails._verdict(text, kind) for text in texts]
 
 class Guardrails:
     def __init__(self):
-        # Define patterns for potentially harmful content
-        self.harmful_patterns = [
-            r"(?i)(password|api key|secret|token)",
-            r"(?i)(hack|exploit|vulnerability)",
-            r"(?i)(illegal|unlawful|criminal)",
-            r"(?i)(porn|adult|nsfw)",
-            r"(?i)(hate|racist|sexist)",
-        ]
-        
+        # Define patterns for potentially harmful content, by category
+        self.harmful_categories = {
+            "credentials": r"password|api key|secret|token",
+            "hacking": r"hack|exploit|vulnerability",
+            "illegal": r"illegal|unlawful|criminal",
+            "adult": r"porn|adult|nsfw",
+            "hate": r"hate|racist|sexist",
+        }
+        self.harmful_patterns = [f"(?i)({pattern})" for pattern in self.harmful_categories.values()]
+
         # Compile patterns
         self.patterns = [re.compile(pattern) for pattern in self.harmful_patterns]
-        
+
+        # All categories as one alternation of named groups, so each check is a single
+        # pass over the text and the matching group names the category
+        alternation = "|".join(f"(?P<{name}>{pattern})" for name, pattern in self.harmful_categories.items())
+        self.matcher = re.compile(alternation, re.IGNORECASE)
+
+        # Faster variant run on lowercased text: case-sensitive matching plus a lookahead on
+        # the possible first characters lets the scan skip most positions without trying
+        # every branch (the category patterns are lowercase literals)
+        first_chars = sorted({word[0] for pattern in self.harmful_categories.values()
+                              for word in pattern.split("|")})
+        self._lower_matcher = re.compile(f"(?=[{re.escape(''.join(first_chars))}])(?:{alternation})")
+
+        # Verdicts for context chunks by content hash; the same chunks come back often
+        self._context_checks = TTLCache(max_entries=CONTEXT_CHECK_CACHE_SIZE, ttl=float("inf"))
+
+    def _scan(self, text: str):
+        """Return (matcher, text) to scan; offsets in the scanned text match ``text``."""
+        lowered = text.lower()
+        if len(lowered) == len(text):
+            return self._lower_matcher, lowered
+        # Some characters change length when lowercased, which would shift offsets
+        return self.matcher, text
+
+    def find_harmful(self, text: str) -> Optional[str]:
+        """Return the category of the first harmful match in ``text``, or None."""
+        matcher, scanned = self._scan(text)
+        match = matcher.search(scanned)
+        if match is None:
+            return None
+        metrics.inc("guardrails_violations", category=match.lastgroup)
+        return match.lastgroup
+
+    def match_categories(self, text: str) -> List[str]:
+        """All harmful categories present in ``text``, in order of first appearance."""
+        matcher, scanned = self._scan(text)
+        categories = []
+        for match in matcher.finditer(scanned):
+            if match.lastgroup not in categories:
+                categories.append(match.lastgroup)
+        return categories
+
+    @timed("guardrails_input")
     def validate_input(self, query: str) -> Tuple[bool, str]:
         """
         Validate user input for safety and appropriateness.
          """
-        # Check for empty or too short queries
-        if not query or len(query.strip()) < 3:
-            return False, "Query is too short"
-            
-        # Check for harmful patterns
-        for pattern in self.patterns:
-            if pattern.search(query):
-                return False, "Query contains potentially harmful content"
-                
-        # Check for maximum length
-        if len(query) > 1000:
-            return False, "Query is too long"
-            
-        return True, ""
+        return self._check(query, "input")
         
+    @timed("guardrails_output")
     def validate_output(self, response: str) -> Tuple[bool, str]:
         """
         Validate LLM output for safety and appropriateness.
         """
-        # Check for empty responses
-        if not response or len(response.strip()) < 10:
-            return False, "Response is too short"
+        return self._check(response, "output")
+
+    def _check(self, text: str, kind: str) -> Tuple[bool, str]:
+        label, min_length, max_length = _LIMITS[kind]
+
+        # Check for empty or too short text
+        if not text or len(text.strip()) < min_length:
+            return False, f"{label} is too short"
             
         # Check for harmful patterns
-        for pattern in self.patterns:
-            if pattern.search(response):
-                return False, "Response contains potentially harmful content"
+        if self.find_harmful(text):
+            return False, f"{label} contains potentially harmful content"
                 
         # Check for maximum length
-        if len(response) > 5000:
-            return False, "Response is too long"
+        if len(text) > max_length:
+            return False, f"{label} is too long"
             
         return True, ""
-        
+
+    def _verdict(self, text: str, kind: str) -> Dict:
+        if not isinstance(text, str):
+            return {"is_valid": False, "error": "Invalid text", "categories": []}
+        is_valid, error = self._check(text, kind)
+        categories = self.match_categories(text) if error.endswith("harmful content") else []
+        return {"is_valid": is_valid, "error": error, "categories": categories}
+
+    def validate_batch(self, texts: List[str], kind: str = "output") -> List[Dict]:
+        """
+        Validate many texts in one call, with the checks of validate_input (kind="input")
+        or validate_output (kind="output"). Returns one {"is_valid", "error", "categories"}
+        verdict per text, in order. Output verdicts are cached by content hash, and large
+        batches are split across a process pool.
+        """
+        verdicts: List[Optional[Dict]] = [None] * len(texts)
+        keys = [None] * len(texts)
+        pending = []
+        for i, text in enumerate(texts):
+            if kind == "output" and isinstance(text, str):
+                keys[i] = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+                verdicts[i] = self._context_checks.get(keys[i])
+            if verdicts[i] is None:
+                pending.append(i)
+
+        pending_texts = [texts[i] for i in pending]
+        workers = GUARDRAILS_BATCH_WORKERS
+        if workers > 1 and len(pending) >= GUARDRAILS_PARALLEL_MIN_ITEMS:
+            size = -(-len(pending_texts) // (workers * 2))
+            slices = [pending_texts[i:i + size] for i in range(0, len(pending_texts), size)]
+            results = [v for part in _get_pool(workers).map(_check_texts, slices, [kind] * len(slices))
+                       for v in part]
+            for verdict in results:
+                if verdict["categories"]:
+                    metrics.inc("guardrails_violations", category=verdict["categories"][0])
+        else:
+            results = [self._verdict(text, kind) for text in pending_texts]
+
+        for i, verdict in zip(pending, results):
+            verdicts[i] = verdict
+            if keys[i] is not None:
+                self._context_checks.set(keys[i], verdict)
+        return verdicts
+
+    @timed("guardrails_sanitize")
     def sanitize_input(self, query: str) -> str:
         # Remove any matches of harmful patterns
-        sanitized = query
-        for pattern in self.patterns:
-            sanitized = pattern.sub("[REDACTED]", sanitized)
-            
-        return sanitized
+        matcher, scanned = self._scan(query)
+        parts, last = [], 0
+        for match in matcher.finditer(scanned):
+            parts.append(query[last:match.start()])
+            parts.append("[REDACTED]")
+            last = match.end()
+        parts.append(query[last:])
+        return "".join(parts)
         
+    @timed("guardrails_context")
     def validate_context(self, context: List[dict]) -> Tuple[bool, str]:
         if not context:
             return False, "No context retrieved"
@@ -75,9 +200,120 @@ class Guardrails:
             if "text" not in item:
                 return False, "Missing text in context"
                 
-            # Validate text content
-            is_valid, error = self.validate_output(item["text"])
-            if not is_valid:
-                return False, f"Invalid context content: {error}"
+        # Validate text content
+        for verdict in self.validate_batch([item["text"] for item in context]):
+            if not verdict["is_valid"]:
+                return False, f"Invalid context content: {verdict['error']}"
                 
-        return True, "" 
\ No newline at end of file
+        return True, ""
+
+    def filter_context(self, context: List[dict]) -> Tuple[List[dict], List[dict]]:
+        """
+        Split context into (kept, dropped) so a request can go on with the chunks that
+        pass the output checks instead of failing on one bad chunk.
+        """
+        texts = [item.get("text") if isinstance(item, dict) else None for item in context or []]
+        kept, dropped = [], []
+        for item, verdict in zip(context or [], self.validate_batch(texts)):
+            (kept if verdict["is_valid"] else dropped).append(item)
+        if dropped:
+            metrics.inc("guardrails_dropped_chunks", len(dropped))
+        return kept, dropped
+
+    def guard_stream(self, chunks: Union[Iterable[str], AsyncIterable[str]]) -> "GuardedStream":
+        """
+        Wrap a streamed response so it passes the same output checks as validate_output.
+        Iterate the result (sync or async) to get safe text; it stops early on a violation.
+        """
+        return GuardedStream(self, chunks)
+
+class GuardedStream:
+    """
+    Streamed response filtered through Guardrails' output checks.
+
+    Harmful-pattern and length checks run incrementally on the text seen so far, and the
+    last STREAM_HOLDBACK characters are held back until the next chunk (or the end of the
+    stream) proves no pattern completes across them. After iteration, ``text`` holds the
+    emitted response and ``is_valid``/``error`` mirror validate_output's result; an
+    exception from the stream itself also leaves ``is_valid`` False.
+    """
+    def __init__(self, guardrails: Guardrails, chunks):
+        self.guardrails = guardrails
+        self.chunks = chunks
+        self.text = ""
+        self.is_valid = True
+        self.error = ""
+        self._buffer = ""
+        self._emitted = 0
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            for chunk in self.chunks:
+                safe = self._feed(chunk)
+                if safe:
+                    yield safe
+                if not self.is_valid:
+                    return
+        except Exception as e:
+            # A failed source (e.g. the LLM provider) fails the stream instead of the caller
+            self._fail(str(e))
+            return
+        finally:
+            # Stopping early (a violation, or the reader going away) releases the source stream
+            close = getattr(self.chunks, "close", None)
+            if close is not None:
+                close()
+        tail = self._finish()
+        if tail:
+            yield tail
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        try:
+            async for chunk in self.chunks:
+                safe = self._feed(chunk)
+                if safe:
+                    yield safe
+                if not self.is_valid:
+                    return
+        except Exception as e:
+            self._fail(str(e))
+            return
+        tail = self._finish()
+        if tail:
+            yield tail
+
+    def _feed(self, chunk: str) -> str:
+        """Add a chunk and return the text that is now safe to emit."""
+        if not self.is_valid or not chunk:
+            return ""
+        self._buffer += chunk
+
+        # Only the unemitted text plus one holdback window can contain a new match
+        window = self._buffer[max(0, self._emitted - STREAM_HOLDBACK):]
+        if self.guardrails.find_harmful(window):
+            self._fail("Response contains potentially harmful content")
+            return ""
+        if len(self._buffer) > MAX_OUTPUT_LENGTH:
+            self._fail("Response is too long")
+            return ""
+
+        safe_until = max(self._emitted, len(self._buffer) - STREAM_HOLDBACK)
+        safe = self._buffer[self._emitted:safe_until]
+        self._emitted = safe_until
+        self.text += safe
+        return safe
+
+    def _finish(self) -> str:
+        """Flush the held-back tail and run the full output validation."""
+        if not self.is_valid:
+            return ""
+        tail = self._buffer[self._emitted:]
+        self._emitted = len(self._buffer)
+        self.text += tail
+        self.is_valid, self.error = self.guardrails.validate_output(self._buffer)
+        return tail if self.is_valid else ""
+
+    def _fail(self, error: str):
+        self.is_valid = False
+        self.error = error
+
@@ -0,0 +1,418 @@
+#ingest.py
+import os
+import json
+import time
+import queue
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+MANIFEST_VERSION = 1
+
+# Concurrency and batching for each pipeline stage
+INGEST_PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", os.cpu_count() or 1))
+INGEST_PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", 16))
+INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", 256))
+INGEST_EMBED_WORKERS = int(os.getenv("INGEST_EMBED_WORKERS", 1))
+INGEST_UPSERT_BATCH_SIZE = int(os.getenv("INGEST_UPSERT_BATCH_SIZE", 100))
+INGEST_UPSERT_WORKERS = int(os.getenv("INGEST_UPSERT_WORKERS", 4))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 4))
+
+_DONE = object()
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """Hash a file's bytes without reading it into memory at once."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def chunk_id(source: str, text: str) -> str:
+    """Deterministic vector ID derived from a chunk's source and content."""
+    return "doc_" + hashlib.sha256(f"{source}\0{text}".encode("utf-8")).hexdigest()[:32]
+
+class IngestionManifest:
+    """
+    Record of what has been ingested into one index: per file the file hash, page hashes
+    and chunk hashes. Lets a re-run embed and upsert only new or changed chunks and
+    delete the stale ones.
+
+    Layout::
+
+        {"version": 1, "index": "...", "chunker": "...", "metadata": "...",
+         "files": {"MATHEMATICS.pdf": {"file_hash": "...",
+                                       "pages": {"1": "<page hash>", ...},
+                                       "chunks": {"doc_<id>": {"hash": "...", "page": 1}, ...}}}}
+    """
+    def __init__(self, path: str, index_name: str, chunker: str, metadata: str = ""):
+        self.path = path
+        self.index_name = index_name
+        self.chunker = chunker
+        self.metadata = metadata
+        self.files: Dict[str, Dict] = {}
+        self.chunker_changed = False
+        self.metadata_changed = False
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Ignoring unreadable ingestion manifest {self.path}: {e}")
+            return
+
+        # A manifest written for another index says nothing about this one
+        if data.get("version") != MANIFEST_VERSION or data.get("index") != self.index_name:
+            return
+        self.files = data.get("files", {})
+        # Page hashes are only reusable if pages were chunked the same way
+        self.chunker_changed = data.get("chunker") != self.chunker
+        # Chunks indexed with older metadata are upserted again (same IDs) to re-tag them
+        self.metadata_changed = data.get("metadata", "") != self.metadata
+
+    def get_file(self, source: str) -> Optional[Dict]:
+        return self.files.get(source)
+
+    def set_file(self, source: str, file_hash: str, pages: Dict[str, str], chunks: Dict[str, Dict]):
+        self.files[source] = {"file_hash": file_hash, "pages": pages, "chunks": chunks}
+
+    def remove_file(self, source: str) -> Dict[str, Dict]:
+        """Forget a file, returning the chunks that were indexed for it."""
+        return self.files.pop(source, {}).get("chunks", {})
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path + ".tmp", 'w') as f:
+            json.dump({
+                "version": MANIFEST_VERSION,
+                "index": self.index_name,
+                "chunker": self.chunker,
+                "metadata": self.metadata,
+                "files": self.files
+            }, f)
+        os.replace(self.path + ".tmp", self.path)
+
+def parse_pdf_pages(pdf_path: str, start: int, stop: int) -> List[Tuple[int, str]]:
+    """Extract the text of pages [start, stop) as (1-based page, text). Runs in a worker process."""
+    from pypdf import PdfReader
+    reader = PdfReader(pdf_path)
+    stop = min(stop, len(reader.pages))
+    return [(page + 1, reader.pages[page].extract_text() or "") for page in range(start, stop)]
+
+def count_pdf_pages(pdf_path: str) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(pdf_path).pages)
+
+class IngestionPipeline:
+    """
+    Streaming load -> chunk -> embed -> upsert pipeline with overlapping stages.
+
+    PDF pages are parsed in a process pool, chunked lazily by a generator, embedded in
+    large batches on worker threads and upserted concurrently. Stages are connected by
+    bounded queues, so memory stays flat regardless of corpus size. Only chunks missing
+    from the ingestion manifest are embedded; stale chunks are deleted at the end.
+    """
+    def __init__(self,
+                 index,
+                 embeddings,
+                 text_splitter,
+                 manifest: IngestionManifest,
+                 parse_workers: int = INGEST_PARSE_WORKERS,
+                 pages_per_task: int = INGEST_PAGES_PER_TASK,
+                 embed_batch_size: int = INGEST_EMBED_BATCH_SIZE,
+                 embed_workers: int = INGEST_EMBED_WORKERS,
+                 upsert_batch_size: int = INGEST_UPSERT_BATCH_SIZE,
+                 upsert_workers: int = INGEST_UPSERT_WORKERS,
+                 queue_size: int = INGEST_QUEUE_SIZE,
+                 lexical=None,
+                 chunk_metadata=None):
+        """
+        Args:
+            index: Pinecone index or LocalVectorIndex
+            embeddings: Object with an ``embed_documents`` method
+            text_splitter: Object with a ``split_documents`` method
+            manifest (IngestionManifest): Record of previously ingested chunks
+            parse_workers (int): Processes parsing PDF pages (0 parses in-process)
+            pages_per_task (int): Pages handed to a parse worker at a time
+            embed_batch_size (int): Chunks per embedding call
+            embed_workers (int): Threads running embedding batches
+            upsert_batch_size (int): Vectors per upsert call
+            upsert_workers (int): Concurrent upsert calls
+            queue_size (int): Batches buffered between the chunk and embed stages
+            lexical (Optional[BM25Index]): Lexical index kept in step with the vectors
+            chunk_metadata (Optional[Callable]): ``(source, text) -> Dict`` of extra metadata per chunk
+        """
+        self.index = index
+        self.embeddings = embeddings
+        self.text_splitter = text_splitter
+        self.manifest = manifest
+        self.parse_workers = parse_workers
+        self.pages_per_task = pages_per_task
+        self.embed_batch_size = embed_batch_size
+        self.embed_workers = max(1, embed_workers)
+        self.upsert_batch_size = upsert_batch_size
+        self.upsert_workers = max(1, upsert_workers)
+        self.queue_size = queue_size
+        self.lexical = lexical
+        self.chunk_metadata = chunk_metadata
+
+        self._errors: List[Exception] = []
+        self._lock = threading.Lock()
+        self._counts = {"pages": 0, "chunks": 0, "vectors": 0}
+
+    def run(self, pdf_files: List[str]) -> Dict:
+        """
+        Ingest the given PDFs and return counts and throughput.
+
+        Returns:
+            Dict: skipped/added/removed chunk counts, pages/chunks/vectors processed,
+            elapsed seconds and pages_per_s, chunks_per_s, vectors_per_s
+        """
+        started = time.perf_counter()
+        self._errors = []
+        self._counts = {"pages": 0, "chunks": 0, "vectors": 0}
+        report = {"skipped": 0, "added": 0, "removed": 0}
+        updated_files = {}
+        stale_ids = set()
+
+        embed_queue = queue.Queue(maxsize=self.queue_size)
+        upsert_pool = ThreadPoolExecutor(max_workers=self.upsert_workers)
+        upsert_slots = threading.BoundedSemaphore(self.upsert_workers * 2)
+        embed_threads = [
+            threading.Thread(target=self._embed_worker, args=(embed_queue, upsert_pool, upsert_slots), daemon=True)
+            for _ in range(self.embed_workers)
+        ]
+        for thread in embed_threads:
+            thread.start()
+
+        try:
+            batch = []
+            for item in self._iter_new_chunks(pdf_files, report, updated_files, stale_ids):
+                batch.append(item)
+                if len(batch) >= self.embed_batch_size:
+                    self._put(embed_queue, batch)
+                    batch = []
+            if batch:
+                self._put(embed_queue, batch)
+        finally:
+            for _ in embed_threads:
+                embed_queue.put(_DONE)
+            for thread in embed_threads:
+                thread.join()
+            upsert_pool.shutdown(wait=True)
+
+        if self._errors:
+            raise self._errors[0]
+
+        # Files removed from the DATA folder take their chunks with them
+        current_sources = {os.path.basename(path) for path in pdf_files}
+        for source in [s for s in self.manifest.files if s not in current_sources]:
+            stale_ids.update(self.manifest.remove_file(source))
+        if stale_ids:
+            print(f"Removing {len(stale_ids)} stale chunks...")
+            stale = sorted(stale_ids)
+            for i in range(0, len(stale), 1000):
+                self.index.delete(ids=stale[i:i+1000])
+            if self.lexical is not None:
+                self.lexical.remove(stale)
+
+        # Only record files once their chunks are safely in the index
+        for source, (file_hash, pages, chunks) in updated_files.items():
+            self.manifest.set_file(source, file_hash, pages, chunks)
+        self.manifest.save()
+
+        elapsed = time.perf_counter() - started
+        report["added"] = self._counts["vectors"]
+        report["removed"] = len(stale_ids)
+        report.update(self._counts)
+        report["elapsed_s"] = round(elapsed, 3)
+        for name in ("pages", "chunks", "vectors"):
+            report[f"{name}_per_s"] = round(self._counts[name] / elapsed, 2) if elapsed else 0.0
+        return report
+
+    def _iter_pages(self, pdf_files: List[str]) -> Iterator[Tuple[str, str, Optional[List[Tuple[int, str]]]]]:
+        """
+        Yield (pdf_path, file_hash, pages) in file and page order as parsing completes.
+        ``pages`` is None once a file is exhausted, and unchanged files are not parsed.
+        """
+        tasks = deque()
+        executor = ProcessPoolExecutor(max_workers=self.parse_workers) if self.parse_workers > 0 else None
+        max_in_flight = max(1, self.parse_workers) * 2
+
+        def drain(limit):
+            while len(tasks) > limit:
+                pdf_path, file_hash, future = tasks.popleft()
+                if future is None:
+                    yield pdf_path, file_hash, None
+                    continue
+                try:
+                    yield pdf_path, file_hash, future.result()
+                except Exception as e:
+                    # Hand the failure downstream so the file keeps its previous manifest entry
+                    yield pdf_path, file_hash, e
+
+        try:
+            for pdf_path in pdf_files:
+                source = os.path.basename(pdf_path)
+                try:
+                    file_hash = file_sha256(pdf_path)
+                    previous = self.manifest.get_file(source)
+                    if (previous and not self.manifest.chunker_changed and not self.manifest.metadata_changed
+                            and previous.get("file_hash") == file_hash):
+                        tasks.append((pdf_path, file_hash, None))
+                        continue
+                    page_count = count_pdf_pages(pdf_path)
+                except Exception as e:
+                    print(f"Error processing PDF file {pdf_path}: {e}")
+                    continue
+
+                for start in range(0, page_count, self.pages_per_task):
+                    stop = start + self.pages_per_task
+                    if executor is not None:
+                        future = executor.submit(parse_pdf_pages, pdf_path, start, stop)
+                    else:
+                        future = _ImmediateResult(parse_pdf_pages, pdf_path, start, stop)
+                    tasks.append((pdf_path, file_hash, future))
+                    yield from drain(max_in_flight)
+                tasks.append((pdf_path, file_hash, None))
+            yield from drain(0)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def _iter_new_chunks(self, pdf_files, report, updated_files, stale_ids):
+        """Chunk pages as they arrive and yield (chunk_id, chunk) for chunks not yet indexed."""
+        from langchain.schema import Document
+
+        state = None
+        for pdf_path, file_hash, pages in self._iter_pages(pdf_files):
+            source = os.path.basename(pdf_path)
+            if state is None or state["source"] != source:
+                previous = self.manifest.get_file(source) or {"pages": {}, "chunks": {}}
+                by_page = {}
+                for cid, info in previous["chunks"].items():
+                    by_page.setdefault(info["page"], {})[cid] = info
+                state = {"source": source, "previous": previous, "by_page": by_page,
+                         "pages": {}, "chunks": {}, "parsed": False, "failed": False}
+
+            previous = state["previous"]
+            if isinstance(pages, Exception):
+                if not state["failed"]:
+                    print(f"Error processing PDF file {pdf_path}: {pages}")
+                state["failed"] = True
+                continue
+
+            if pages is None:
+                if state["failed"]:
+                    print(f"Keeping previously indexed chunks for {source}")
+                elif not state["parsed"] and previous.get("file_hash") == file_hash and not self.manifest.metadata_changed:
+                    report["skipped"] += len(previous["chunks"])
+                    print(f"Skipped unchanged {source} ({len(previous['chunks'])} chunks)")
+                else:
+                    chunks = state["chunks"]
+                    stale_ids.update(cid for cid in previous["chunks"] if cid not in chunks)
+                    if not self.manifest.metadata_changed:
+                        report["skipped"] += sum(1 for cid, info in chunks.items()
+                                                 if previous["chunks"].get(cid, {}).get("page") == info["page"])
+                    updated_files[source] = (file_hash, state["pages"], chunks)
+                    print(f"Processed {len(chunks)} chunks from {source}")
+                state = None
+                continue
+
+            state["parsed"] = True
+            for page, text in pages:
+                self._count("pages", 1)
+                page_hash = content_hash(text)
+                state["pages"][str(page)] = page_hash
+
+                # Unchanged page: keep its chunks without re-chunking
+                if (not self.manifest.chunker_changed and not self.manifest.metadata_changed
+                        and previous["pages"].get(str(page)) == page_hash):
+                    for cid, info in state["by_page"].get(page, {}).items():
+                        state["chunks"].setdefault(cid, info)
+                    continue
+
+                doc = Document(page_content=text, metadata={"source": source, "page": page})
+                for chunk in self.text_splitter.split_documents([doc]):
+                    self._count("chunks", 1)
+                    cid = chunk_id(source, chunk.page_content)
+                    if cid in state["chunks"]:
+                        continue
+                    state["chunks"][cid] = {"hash": content_hash(chunk.page_content), "page": page}
+                    # IDs ignore the page, so a chunk that moved to another page is upserted
+                    # again (same ID) to correct its page metadata
+                    known = previous["chunks"].get(cid)
+                    if known is None or known["page"] != page or self.manifest.metadata_changed:
+                        if self.chunk_metadata is not None:
+                            chunk.metadata.update(self.chunk_metadata(source, chunk.page_content))
+                        yield cid, chunk
+
+    def _embed_worker(self, embed_queue, upsert_pool, upsert_slots):
+        """Embed batches from the queue and hand vectors to the upsert pool."""
+        while True:
+            batch = embed_queue.get()
+            if batch is _DONE:
+                return
+            if self._errors:
+                continue
+            try:
+                texts = [chunk.page_content for _, chunk in batch]
+                embeddings = self.embeddings.embed_documents(texts)
+                vectors = [
+                    {"id": cid, "values": embedding, "metadata": {**chunk.metadata, "text": chunk.page_content}}
+                    for (cid, chunk), embedding in zip(batch, embeddings)
+                ]
+                for i in range(0, len(vectors), self.upsert_batch_size):
+                    upsert_slots.acquire()
+                    future = upsert_pool.submit(self._upsert, vectors[i:i+self.upsert_batch_size])
+                    future.add_done_callback(lambda _: upsert_slots.release())
+            except Exception as e:
+                self._fail(e)
+
+    def _upsert(self, vectors):
+        try:
+            self.index.upsert(vectors=vectors)
+            if self.lexical is not None:
+                self.lexical.add_many((vector["id"], vector["metadata"]) for vector in vectors)
+            self._count("vectors", len(vectors))
+        except Exception as e:
+            self._fail(e)
+
+    def _put(self, embed_queue, batch):
+        """Block until the embed stage has room, giving up if a later stage failed."""
+        while True:
+            if self._errors:
+                raise self._errors[0]
+            try:
+                embed_queue.put(batch, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _count(self, name, amount):
+        with self._lock:
+            self._counts[name] += amount
+
+    def _fail(self, error):
+        with self._lock:
+            self._errors.append(error)
+
+class _ImmediateResult:
+    """Future-like wrapper that runs the call in-process when parse_workers is 0."""
+    def __init__(self, fn, *args):
+        self._fn = fn
+        self._args = args
+
+    def result(self):
+        return self._fn(*self._args)
@@ -3,27 +3,137 @@ import os
 import glob
 import uuid
 from dotenv import load_dotenv
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 import pinecone
+from vector_store import LocalVectorIndex
+from ingest import IngestionManifest, IngestionPipeline, chunk_id
+from lexical import BM25Index, fuse
+from chunking import MathChunker
+from metrics import metrics, span
+from embeddings import get_embedding_service, warm_up
+from namespaces import (KB_AUTO_NAMESPACE, KB_USER_NAMESPACE, METADATA_VERSION, chunk_metadata, classify_topic,
+                        route_namespaces)
 
 load_dotenv()
 
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME")
-EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DIMENSION = 384
 DATA_DIR_NAME = "Data"
 
+# Vector backend: "pinecone" (remote) or "local" (memory-mapped in-process index)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", ".kb_index")
+LOCAL_INDEX_TYPE = os.getenv("LOCAL_INDEX_TYPE", "flat")  # flat, hnsw or ivf
+
+# Records what has been ingested so re-runs only embed new or changed chunks
+INGEST_MANIFEST_PATH = os.getenv("INGEST_MANIFEST_PATH", ".ingest_manifest.json")
+CHUNKER_FINGERPRINT = "recursive-1000-200"
+# "math" (equation- and theorem-aware, variable size) or "recursive" (fixed 1000/200)
+KB_CHUNKER = os.getenv("KB_CHUNKER", "math")
+
+# Hybrid retrieval: a BM25 index over the same chunks, fused with the dense scores
+KB_HYBRID = os.getenv("KB_HYBRID", "true").lower() in ("1", "true", "yes")
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", ".kb_lexical.json")
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", 10))
+# Most a full BM25 match adds to a chunk's dense score for the router's KB/web threshold
+HYBRID_GATE_BOOST = float(os.getenv("HYBRID_GATE_BOOST", 0.1))
+# IDs per fetch when rebuilding the lexical index from the vector index (fetch IDs travel in the URL)
+LEXICAL_REBUILD_BATCH_SIZE = 100
+
+# Passed as search_knowledge_base's namespace to let the query classifier choose
+AUTO_NAMESPACE = "auto"
+# An auto-namespace search whose best result scores below this also searches everything (the router passes its threshold)
+KB_NAMESPACE_FALLBACK_SCORE = float(os.getenv("KB_NAMESPACE_FALLBACK_SCORE", 0.7))
+
+metrics.describe("kb_namespace_queries", "Knowledge base searches by namespace searched (all = unrestricted)")
+
+def gate_score(doc, score):
+    """
+    Score a result is thresholded on: with hybrid retrieval the dense score plus a bounded
+    BM25 boost (HYBRID_GATE_BOOST), not the fused score used for ordering.
+    """
+    return doc.metadata.get("gate_score", doc.metadata.get("dense_score", score))
+
+def build_filter(namespace=None, source=None, pages=None, topic=None, doc_type=None):
+    """
+    Pinecone metadata filter for the given restrictions, or None for no restriction.
+    ``namespace``, ``source``, ``topic`` and ``doc_type`` take a value or a list of values;
+    ``pages`` is an inclusive (first, last) page range, either end may be None.
+    """
+    clauses = []
+    for field, value in (("namespace", namespace), ("source", source), ("topic", topic), ("doc_type", doc_type)):
+        if value is None:
+            continue
+        values = [value] if isinstance(value, str) else list(value)
+        clauses.append({field: {"$in": values}} if len(values) > 1 else {field: {"$eq": values[0]}})
+    if pages is not None:
+        first, last = pages
+        page_range = {}
+        if first is not None:
+            page_range["$gte"] = first
+        if last is not None:
+            page_range["$lte"] = last
+        if page_range:
+            clauses.append({"page": page_range})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
 class MathKnowledgeBase:
-    def __init__(self):
-        """Initialize the math knowledge base with Pinecone."""
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=EMBEDDING_MODEL_NAME
+    def __init__(self, backend: str = None, embeddings=None, index=None, manifest_path: str = None,
+                 lexical_index: BM25Index = None):
+        """
+        Initialize the math knowledge base with Pinecone or a local vector index.
+        An embeddings object, index and lexical index may be passed in (e.g. offline
+        stand-ins for benchmarks).
+        By default queries go through the process-wide embedding service, which batches
+        concurrent requests and caches vectors, over one lazily loaded model (see embeddings.py).
+        """
+        self.embeddings = embeddings if embeddings is not None else get_embedding_service()
+        self.project_root = os.path.dirname(os.path.abspath(__file__))
+        self.absolute_data_dir = os.path.join(self.project_root, DATA_DIR_NAME)
+        self.backend = backend or VECTOR_BACKEND
+        self.manifest_path = manifest_path or INGEST_MANIFEST_PATH
+
+        if lexical_index is not None:
+            self.lexical = lexical_index
+        elif KB_HYBRID:
+            lexical_path = LEXICAL_INDEX_PATH
+            if not os.path.isabs(lexical_path):
+                lexical_path = os.path.join(self.project_root, lexical_path)
+            self.lexical = BM25Index(lexical_path)
+        else:
+            self.lexical = None
+
+        if index is not None:
+            self.pc = None
+            self.index = index
+            self.index_name = getattr(index, "name", type(index).__name__)
+        elif self.backend == "local":
+            self._init_local_index()
+        else:
+            self._init_pinecone_index()
+
+    def _init_local_index(self):
+        """Open (or create) the local memory-mapped vector index."""
+        index_dir = LOCAL_INDEX_DIR
+        if not os.path.isabs(index_dir):
+            index_dir = os.path.join(self.project_root, index_dir)
+
+        self.pc = None
+        self.index_name = index_dir
+        self.index = LocalVectorIndex(
+            index_dir,
+            dimension=EMBEDDING_DIMENSION,
+            index_type=LOCAL_INDEX_TYPE
         )
-        
-        # Initialize Pinecone client and get index instance
+        stats = self.index.describe_index_stats()
+        print(f"Loaded local vector index '{self.index_name}' with {stats['total_vector_count']} vectors.")
+
+    def _init_pinecone_index(self):
+        """Connect to the remote Pinecone index."""
         try:
             # Initialize the Pinecone client
             self.pc = pinecone.Pinecone(api_key=PINECONE_API_KEY)
@@ -31,68 +141,125 @@ class MathKnowledgeBase:
             # Store the index name
             self.index_name = PINECONE_INDEX_NAME
             
-            # Connect to the index
+            # Connect to the index; stats are not fetched here to keep startup to no round-trips
             self.index = self.pc.Index(self.index_name)
-            
-            # Get stats to verify connection
-            stats = self.index.describe_index_stats()
-            print(f"Connected to Pinecone index '{self.index_name}' with {stats['total_vector_count']} vectors.")
+            print(f"Connected to Pinecone index '{self.index_name}'.")
             
         except Exception as e:
             print(f"Error initializing Pinecone connection: {e}")
             self.index = None
             raise
 
-        self.project_root = os.path.dirname(os.path.abspath(__file__))
-        self.absolute_data_dir = os.path.join(self.project_root, DATA_DIR_NAME)
+    def _persist_index(self):
+        """Flush the local index (and the lexical index) to disk; Pinecone persists upserts itself."""
+        if hasattr(self.index, "persist"):
+            self.index.persist()
+        if self.lexical is not None:
+            self.lexical.save()
+
+    def _initialize_knowledge_base(self, **pipeline_options):
+        """
+        Sync the knowledge base with the PDF files in the DATA folder.
 
-    def _initialize_knowledge_base(self):
-        """Initialize the knowledge base with data from PDF files in the DATA folder."""
+        A manifest of file, page and chunk hashes is kept next to the index, and chunk IDs
+        are derived from content, so a re-run only embeds and upserts new or changed chunks
+        and deletes chunks that no longer exist. Parsing, chunking, embedding and upserting
+        run as an overlapping streaming pipeline (see ``ingest.IngestionPipeline``, whose
+        concurrency settings can be passed as keyword arguments).
+
+        Returns:
+            Dict: Counts of chunks skipped, added and removed plus throughput figures
+        """
+        report = {"skipped": 0, "added": 0, "removed": 0}
         try:
-            pdf_files = glob.glob(os.path.join(self.absolute_data_dir, "*.pdf"))
+            if not self.index:
+                print("Pinecone index is not initialized. Cannot add documents.")
+                return report
 
-            if not pdf_files:
+            pdf_files = sorted(glob.glob(os.path.join(self.absolute_data_dir, "*.pdf")))
+            text_splitter = self._text_splitter()
+            fingerprint = getattr(text_splitter, "fingerprint", CHUNKER_FINGERPRINT)
+            manifest = IngestionManifest(self._manifest_path(), self.index_name, fingerprint, METADATA_VERSION)
+            if self.lexical is not None and not len(self.lexical) and manifest.files:
+                self._rebuild_lexical(manifest)
+
+            if not pdf_files and not manifest.files:
                 print(f"No PDF files found in {self.absolute_data_dir}. No data to add.")
-                return
-
-            all_docs = []
-            for pdf_path in pdf_files:
-                try:
-                    loader = PyPDFLoader(pdf_path)
-                    documents = loader.load()
-                    
-                    for doc in documents:
-                        doc.metadata["source"] = os.path.basename(pdf_path)
-                        doc.metadata["page"] = doc.metadata.get("page", 0) + 1
-
-                    text_splitter = RecursiveCharacterTextSplitter(
-                        chunk_size=1000,
-                        chunk_overlap=200,
-                        length_function=len,
-                        separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""]
-                    )
-                    chunked_documents = text_splitter.split_documents(documents)
-                    all_docs.extend(chunked_documents)
-                    print(f"Processed {len(chunked_documents)} chunks from {os.path.basename(pdf_path)}")
-                except Exception as load_ex:
-                    print(f"Error processing PDF file {pdf_path}: {load_ex}")
-            
-            if all_docs and self.index:
-                print(f"Adding {len(all_docs)} chunks to Pinecone index '{self.index_name}'...")
-                self._add_documents_to_pinecone(all_docs)
-                print(f"Successfully added documents to Pinecone index '{self.index_name}'.")
-            elif not self.index:
-                print("Pinecone index is not initialized. Cannot add documents.")
+                return report
+
+            pipeline = IngestionPipeline(
+                self.index,
+                self.embeddings,
+                text_splitter,
+                manifest,
+                lexical=self.lexical,
+                chunk_metadata=chunk_metadata,
+                **pipeline_options
+            )
+            report = pipeline.run(pdf_files)
+            self._persist_index()
+
+            print(f"Knowledge base sync complete: {report['added']} added, "
+                  f"{report['skipped']} skipped, {report['removed']} removed.")
+            print(f"Throughput: {report['pages_per_s']} pages/s, {report['chunks_per_s']} chunks/s, "
+                  f"{report['vectors_per_s']} vectors/s over {report['elapsed_s']}s")
+            if getattr(text_splitter, "sizes", None):
+                report["chunk_sizes"] = text_splitter.size_report()
+                print(f"Chunk sizes (chars) of re-chunked pages: {report['chunk_sizes']}")
 
         except Exception as e:
             print(f"Error adding data to knowledge base: {e}")
+        return report
+
+    def _rebuild_lexical(self, manifest):
+        """
+        Build an empty lexical index from the chunk texts stored with the vectors
+        (``metadata["text"]``), fetched by the chunk IDs in the manifest. Files with chunks
+        missing from the index are dropped from the manifest so the sync re-ingests them.
+        """
+        print("Lexical index is empty; rebuilding it from the indexed chunk texts.")
+        rebuilt = 0
+        for source in list(manifest.files):
+            ids = list(manifest.files[source].get("chunks", {}))
+            found = {}
+            try:
+                for i in range(0, len(ids), LEXICAL_REBUILD_BATCH_SIZE):
+                    response = self.index.fetch(ids=ids[i:i+LEXICAL_REBUILD_BATCH_SIZE])
+                    found.update({vector_id: dict(vector.metadata or {})
+                                  for vector_id, vector in response.vectors.items()})
+            except Exception as e:
+                print(f"Error fetching chunks of {source}: {e}")
+            if len(found) < len(ids) or any("text" not in metadata for metadata in found.values()):
+                print(f"Re-ingesting {source}: not all of its chunk texts are in the index.")
+                manifest.files.pop(source)
+                continue
+            self.lexical.add_many(found.items())
+            rebuilt += len(found)
+        print(f"Rebuilt lexical index with {rebuilt} chunks.")
+
+    def _text_splitter(self):
+        if KB_CHUNKER == "math":
+            return MathChunker()
+        return RecursiveCharacterTextSplitter(
+            chunk_size=1000,
+            chunk_overlap=200,
+            length_function=len,
+            separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""]
+        )
 
-    def _add_documents_to_pinecone(self, documents, batch_size=100):
-        """Add documents to Pinecone in batches."""
+    def _manifest_path(self):
+        path = self.manifest_path
+        if not os.path.isabs(path):
+            path = os.path.join(self.project_root, path)
+        return path
+
+    def _add_documents_to_pinecone(self, documents, batch_size=100, ids=None):
+        """Add documents to Pinecone in batches, using the given vector IDs if provided."""
         total_batches = (len(documents) + batch_size - 1) // batch_size
         
         for i in range(0, len(documents), batch_size):
             batch = documents[i:i+batch_size]
+            batch_ids = ids[i:i+batch_size] if ids is not None else None
             texts = [doc.page_content for doc in batch]
             metadatas = [doc.metadata for doc in batch]
             
@@ -102,8 +269,8 @@ class MathKnowledgeBase:
             # Prepare vectors for upsert
             vectors = []
             for j, (text, embedding, metadata) in enumerate(zip(texts, embeddings, metadatas)):
-                # Create a unique ID for each vector
-                vector_id = f"doc_{uuid.uuid4()}"
+                # Use the content-derived ID when given, otherwise a unique one
+                vector_id = batch_ids[j] if batch_ids is not None else f"doc_{uuid.uuid4()}"
                 vectors.append({
                     "id": vector_id,
                     "values": embedding,
@@ -115,53 +282,160 @@ class MathKnowledgeBase:
             
             print(f"Added batch {i//batch_size + 1} of {total_batches}")
 
-    def search_knowledge_base(self, query, top_k=3):
-        """Search the knowledge base for similar text chunks."""
+    def embed_query(self, query):
+        """Embed a query so callers (e.g. the answer cache) can reuse the vector."""
+        with span("kb_embed"):
+            return self.embeddings.embed_query(query)
+
+    def embed_queries(self, queries):
+        """
+        Embed many queries in one batched forward pass.
+        The embedder applies no query-specific prefix, so this matches embed_query per item.
+        """
+        with span("kb_embed_batch"):
+            if hasattr(self.embeddings, "embed_queries"):
+                return self.embeddings.embed_queries(list(queries))
+            return self.embeddings.embed_documents(list(queries))
+
+    def search_knowledge_base(self, query, top_k=3, query_embedding=None,
+                              namespace=AUTO_NAMESPACE, filters=None,
+                              fallback_score=KB_NAMESPACE_FALLBACK_SCORE):
+        """
+        Search the knowledge base for similar text chunks.
+
+        Args:
+            namespace: Namespace(s) to search; AUTO_NAMESPACE lets the query classifier pick
+                (everything when the query is ambiguous or KB_AUTO_NAMESPACE is off), None searches all
+            filters (Optional[Dict]): Metadata restrictions as build_filter keyword arguments:
+                source, pages (first, last), topic, doc_type
+            fallback_score (float): With AUTO_NAMESPACE, also search everything when the chosen
+                namespaces' best result scores below this, and merge the two result sets
+        """
         if not hasattr(self, 'index') or self.index is None:
             print("Error: Pinecone index not initialized.")
             return []
         
         try:
-            # Get the embedding for the query
-            query_embedding = self.embeddings.embed_query(query)
-            
-            # Search Pinecone
-            results = self.index.query(
-                vector=query_embedding,
-                top_k=top_k,
-                include_metadata=True
-            )
-            
-            # Convert to Document objects with scores
-            formatted_results = []
-            for match in results.matches:
-                doc = Document(
-                    page_content=match.metadata.get("text", ""),
-                    metadata={k: v for k, v in match.metadata.items() if k != "text"}
-                )
-                formatted_results.append((doc, match.score))
-            
-            return formatted_results
+            # Get the embedding for the query unless the caller already computed it
+            if query_embedding is None:
+                query_embedding = self.embed_query(query)
+
+            auto = namespace == AUTO_NAMESPACE
+            if auto:
+                namespace = route_namespaces(query) if KB_AUTO_NAMESPACE else None
+            results = self._query(query, query_embedding, top_k, build_filter(namespace, **(filters or {})))
+            best = max((gate_score(doc, score) for doc, score in results), default=None)
+            if auto and namespace is not None and (best is None or best < fallback_score):
+                # Nothing good enough in the chosen namespaces (a misclassified query, or chunks not
+                # yet tagged): search them all and keep the best of both
+                namespace = None
+                everywhere = self._query(query, query_embedding, top_k, build_filter(**(filters or {})))
+                results = self._merge_results(results, everywhere, top_k)
+            metrics.inc("kb_namespace_queries", namespace=",".join(namespace) if isinstance(namespace, list)
+                        else namespace or "all")
+            return results
             
         except Exception as e:
+            metrics.inc("component_errors", component="kb_search")
             print(f"Error searching index '{self.index_name}': {e}")
             return []
 
-    def add_to_knowledge_base(self, text_content, metadata=None):
-        """Add a new text content (document) to the knowledge base."""
+    @staticmethod
+    def _merge_results(first, second, top_k):
+        """Union of two (Document, score) lists without duplicate chunks, best first."""
+        merged = {}
+        for doc, score in first + second:
+            key = (doc.metadata.get("source"), doc.metadata.get("page"), doc.page_content)
+            if key not in merged or score > merged[key][1]:
+                merged[key] = (doc, score)
+        return sorted(merged.values(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    def _query(self, query, query_embedding, top_k, metadata_filter):
+        """Dense (and, when available, BM25-fused) search restricted by a metadata filter."""
+        # Search Pinecone, taking extra candidates when they will be fused with BM25
+        hybrid = self.lexical is not None and len(self.lexical) > 0
+        options = {"filter": metadata_filter} if metadata_filter else {}
+        with span("kb_query", backend=self.backend):
+            results = self.index.query(
+                vector=query_embedding,
+                top_k=max(top_k, HYBRID_CANDIDATES) if hybrid else top_k,
+                include_metadata=True,
+                **options
+            )
+
+        if hybrid:
+            return self._fuse_with_lexical(query, results.matches, top_k, metadata_filter)
+
+        # Convert to Document objects with scores
+        formatted_results = []
+        for match in results.matches:
+            doc = Document(
+                page_content=match.metadata.get("text", ""),
+                metadata={k: v for k, v in match.metadata.items() if k != "text"}
+            )
+            formatted_results.append((doc, match.score))
+        
+        return formatted_results
+
+    def _fuse_with_lexical(self, query, matches, top_k, metadata_filter=None):
+        """
+        Combine dense matches with BM25 hits by relevance-weighted reciprocal-rank fusion
+        (see lexical.fuse). Results are ordered by the fused score; each also carries its
+        dense score in ``metadata["dense_score"]`` and, in ``metadata["gate_score"]``, the
+        score the router's similarity threshold applies to: the dense score plus at most
+        HYBRID_GATE_BOOST for BM25 relevance. BM25-only hits get the lowest dense
+        candidate's score, an upper bound on their own.
+        """
+        with span("kb_lexical"):
+            lexical_hits = self.lexical.search(query, top_k=max(top_k, HYBRID_CANDIDATES),
+                                               metadata_filter=metadata_filter)
+
+        metadata = {match.id: match.metadata for match in matches}
+        dense = {match.id: match.score for match in matches}
+        dense_floor = min(dense.values(), default=0.0)
+        lexical = {doc_id: relevance for doc_id, _, relevance, _ in lexical_hits}
+        for doc_id, _, _, doc_metadata in lexical_hits:
+            metadata.setdefault(doc_id, doc_metadata)
+        fused = fuse([
+            [(match.id, match.score) for match in matches],
+            [(doc_id, relevance) for doc_id, _, relevance, _ in lexical_hits],
+        ])
+
+        formatted_results = []
+        for doc_id, score in sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]:
+            dense_score = dense.get(doc_id, dense_floor)
+            doc = Document(
+                page_content=metadata[doc_id].get("text", ""),
+                metadata={**{k: v for k, v in metadata[doc_id].items() if k != "text"},
+                          "dense_score": dense_score,
+                          "gate_score": min(1.0, dense_score + HYBRID_GATE_BOOST * lexical.get(doc_id, 0.0))}
+            )
+            formatted_results.append((doc, score))
+        return formatted_results
+
+    def add_to_knowledge_base(self, text_content, metadata=None, namespace=None):
+        """
+        Add a new text content (document) to the knowledge base, in ``namespace`` (or
+        metadata["namespace"], else KB_USER_NAMESPACE). doc_type defaults to "note" and
+        topic to the classifier's guess.
+        """
         if not hasattr(self, 'index') or self.index is None:
             print("Error: Pinecone index not initialized.")
             return False, "Pinecone index not initialized."
         
         try:
-            if metadata is None:
-                metadata = {}
+            metadata = dict(metadata or {})
+            metadata["namespace"] = namespace or metadata.get("namespace") or KB_USER_NAMESPACE
+            metadata.setdefault("doc_type", "note")
+            topic = metadata.get("topic") or classify_topic(text_content)
+            if topic:
+                metadata["topic"] = topic
                 
             # Get embedding for the text
             embedding = self.embeddings.embed_query(text_content)
             
-            # Create a unique ID
-            vector_id = f"doc_{uuid.uuid4()}"
+            # Derive the ID from content so adding the same text twice does not duplicate it
+            vector_id = chunk_id(metadata.get("source", "user"), text_content)
             
             # Upsert to Pinecone
             self.index.upsert(
@@ -171,6 +445,9 @@ class MathKnowledgeBase:
                     "metadata": {**metadata, "text": text_content}
                 }]
             )
+            if self.lexical is not None:
+                self.lexical.add(vector_id, {**metadata, "text": text_content})
+            self._persist_index()
             
             print(f"Successfully added document to Pinecone index '{self.index_name}'.")
             return True, "Added to knowledge base successfully"
@@ -181,6 +458,8 @@ class MathKnowledgeBase:
 if __name__ == "__main__":
     print("Attempting to initialize Math Knowledge Base...")
     try:
+        # Load the embedding model while the index connects and the first PDFs are parsed
+        warm_up()
         math_kb = MathKnowledgeBase()
         print("MathKnowledgeBase object created.")
         
@@ -0,0 +1,195 @@
+#lexical.py
+import os
+import re
+import json
+import math
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from vector_store import matches_filter
+
+LEXICAL_INDEX_VERSION = 1
+
+# Terms matched with at least this much IDF weight count as a confident lexical hit
+LEXICAL_MIN_IDF = float(os.getenv("LEXICAL_MIN_IDF", 3.0))
+# Reciprocal-rank fusion constant
+RRF_K = int(os.getenv("RRF_K", 60))
+
+_OPERATOR_SPACING = re.compile(r"\s*([=+\-*/^])\s*")
+_POSSESSIVE = re.compile(r"'s\b")
+# Words, numbers and compact expressions such as "x^2+5x+6" or "cauchy-schwarz"
+_TOKEN = re.compile(r"[a-z0-9]+(?:[\^+\-*/=.][a-z0-9]+)*")
+_PART = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i if in into is it its me of on or "
+    "please show tell that the then this to was we what when where which who why with you your".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased terms of ``text``. Expressions and hyphenated names are kept whole
+    ("x^2+5x+6", "cauchy-schwarz") and also split into their parts, so both exact
+    and partial mentions match.
+    """
+    text = _OPERATOR_SPACING.sub(r"\1", _POSSESSIVE.sub("", text.lower()))
+    terms = []
+    for token in _TOKEN.findall(text):
+        token = token.strip(".")
+        if not token or token in STOPWORDS:
+            continue
+        terms.append(token)
+        parts = _PART.findall(token)
+        if len(parts) > 1:
+            terms.extend(p for p in parts if p not in STOPWORDS)
+    return terms
+
+class BM25Index:
+    """
+    In-process BM25 inverted index over knowledge base chunks, persisted as JSON next
+    to the vectors. Each document keeps its metadata (including the text) so lexical-only
+    hits can be returned without a round-trip to the vector store.
+    """
+    def __init__(self, path: Optional[str] = None, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._docs: Dict[str, Dict] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, doc_id: str, metadata: Dict):
+        """Index (or re-index) a chunk; ``metadata["text"]`` is what gets tokenized."""
+        terms = Counter(tokenize(metadata.get("text", "")))
+        with self._lock:
+            self._remove(doc_id)
+            self._docs[doc_id] = {"terms": dict(terms), "length": sum(terms.values()), "metadata": metadata}
+            self._total_length += sum(terms.values())
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[doc_id] = tf
+
+    def add_many(self, docs: Iterable[Tuple[str, Dict]]):
+        for doc_id, metadata in docs:
+            self.add(doc_id, metadata)
+
+    def remove(self, doc_ids: Iterable[str]):
+        with self._lock:
+            for doc_id in doc_ids:
+                self._remove(doc_id)
+
+    def _remove(self, doc_id: str):
+        doc = self._docs.pop(doc_id, None)
+        if doc is None:
+            return
+        self._total_length -= doc["length"]
+        for term in doc["terms"]:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self._postings[term]
+
+    def idf(self, term: str) -> float:
+        df = len(self._postings.get(term, ()))
+        n = len(self._docs)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, top_k: int = 10,
+               metadata_filter: Optional[Dict] = None) -> List[Tuple[str, float, float, Dict]]:
+        """
+        Return up to ``top_k`` (doc_id, bm25_score, relevance, metadata), best first,
+        among chunks whose metadata matches ``metadata_filter`` (Pinecone filter syntax).
+
+        ``relevance`` in [0, 1] is the share of the query's IDF weight the chunk matches,
+        damped when the matched terms are too common (below LEXICAL_MIN_IDF in total) to
+        be a confident hit on their own.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            if not terms or not self._docs:
+                return []
+            avgdl = self._total_length / len(self._docs) or 1.0
+            weights = {term: self.idf(term) for term in terms}
+            query_weight = sum(weights.values()) or 1.0
+
+            scores: Dict[str, float] = {}
+            matched: Dict[str, float] = {}
+            for term in terms:
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                idf = weights[term]
+                for doc_id, tf in posting.items():
+                    length = self._docs[doc_id]["length"]
+                    denom = tf + self.k1 * (1 - self.b + self.b * length / avgdl)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / denom
+                    matched[doc_id] = matched.get(doc_id, 0.0) + idf
+
+            if metadata_filter:
+                scores = {doc_id: score for doc_id, score in scores.items()
+                          if matches_filter(self._docs[doc_id]["metadata"], metadata_filter)}
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+            results = []
+            for doc_id, score in ranked:
+                relevance = matched[doc_id] / query_weight
+                relevance *= min(1.0, matched[doc_id] / LEXICAL_MIN_IDF) if LEXICAL_MIN_IDF else 1.0
+                results.append((doc_id, score, relevance, self._docs[doc_id]["metadata"]))
+            return results
+
+    def save(self, path: Optional[str] = None):
+        """Atomically write the index to JSON."""
+        path = path or self.path
+        if not path:
+            return
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            data = {"version": LEXICAL_INDEX_VERSION, "k1": self.k1, "b": self.b,
+                    "docs": {doc_id: {"terms": doc["terms"], "metadata": doc["metadata"]}
+                             for doc_id, doc in self._docs.items()}}
+        with open(path + ".tmp", 'w') as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Ignoring unreadable lexical index {self.path}: {e}")
+            return
+        if data.get("version") != LEXICAL_INDEX_VERSION:
+            return
+        for doc_id, doc in data.get("docs", {}).items():
+            terms = doc["terms"]
+            self._docs[doc_id] = {"terms": terms, "length": sum(terms.values()), "metadata": doc["metadata"]}
+            self._total_length += self._docs[doc_id]["length"]
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[doc_id] = tf
+
+def fuse(ranked_lists: List[List[Tuple[str, float]]], k: int = RRF_K) -> Dict[str, float]:
+    """
+    Relevance-weighted reciprocal-rank fusion.
+
+    Each list holds (id, relevance in [0, 1]) best first. A list contributes
+    relevance * (k + 1) / (k + rank), i.e. its relevance discounted RRF-style by rank and
+    normalized so rank 1 keeps it whole; contributions combine as a noisy-OR. The fused
+    score therefore stays on the 0..1 scale of cosine similarity: a top dense hit keeps its
+    cosine score, and agreement between the lists pushes a chunk higher. It is meant for
+    ordering; agreement lifts it above either list's relevance, so thresholds belong on
+    the dense score (kb adds a bounded lexical boost to it for the router).
+    """
+    misses: Dict[str, float] = {}
+    for results in ranked_lists:
+        for rank, (doc_id, relevance) in enumerate(results, 1):
+            contribution = max(0.0, min(1.0, relevance)) * (k + 1) / (k + rank)
+            misses[doc_id] = misses.get(doc_id, 1.0) * (1 - contribution)
+    return {doc_id: 1 - miss for doc_id, miss in misses.items()}
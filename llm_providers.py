@@ -0,0 +1,264 @@
+#llm_providers.py
+import os
+import json
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Optional
+
+import requests
+
+from metrics import metrics
+from web_search import CircuitBreaker
+
+# Comma-separated providers in order of preference: "groq", "local"
+LLM_PROVIDERS = os.getenv("LLM_PROVIDERS", "groq")
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama3-70b-8192")
+# OpenAI-compatible local server (llama.cpp server, Ollama's /v1, vLLM, ...)
+LOCAL_LLM_BASE_URL = os.getenv("LOCAL_LLM_BASE_URL", "http://localhost:11434/v1")
+LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "llama3.1:8b-instruct-q4_K_M")
+LOCAL_LLM_API_KEY = os.getenv("LOCAL_LLM_API_KEY", "local")
+
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 30))  # per attempt, seconds
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", 60))  # whole request across attempts, seconds
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", 3))
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", 0)) or None  # start a backup provider after this
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 32))  # concurrent non-streamed calls per process
+
+metrics.describe("llm_provider_requests", "LLM calls by provider and outcome")
+metrics.describe("llm_provider_latency_seconds", "Latency of successful LLM calls by provider")
+
+class OpenAICompatibleClient:
+    """
+    Minimal client for OpenAI-compatible /chat/completions servers, shaped like the Groq
+    client (``client.chat.completions.create``) so providers are interchangeable.
+    """
+    def __init__(self, base_url: str, api_key: str = "local", pool_size: int = 4):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Authorization"] = f"Bearer {api_key}"
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model: str, messages: List[Dict], temperature: float = 0.1,
+                max_tokens: int = 1024, stream: bool = False, timeout: Optional[float] = None, **kwargs):
+        payload = {"model": model, "messages": messages, "temperature": temperature,
+                   "max_tokens": max_tokens, "stream": stream}
+        response = self.session.post(f"{self.base_url}/chat/completions", json=payload,
+                                     timeout=timeout, stream=stream)
+        response.raise_for_status()
+        if not stream:
+            content = response.json()["choices"][0]["message"]["content"]
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+        return self._iter_events(response)
+
+    @staticmethod
+    def _iter_events(response) -> Iterator:
+        """Parse the server-sent event stream into Groq-shaped chunks."""
+        with response:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    return
+                delta = json.loads(data)["choices"][0].get("delta", {})
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta.get("content")))])
+
+class Provider:
+    """
+    One LLM endpoint (client + model) with a circuit breaker and running latency and
+    error statistics used to rank providers.
+    """
+    def __init__(self, name: str, client, model: str, timeout: float = LLM_TIMEOUT):
+        self.name = name
+        self.client = client
+        self.model = model
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+        self.latency = None  # exponentially weighted moving average, seconds
+        self.error_rate = 0.0  # exponentially weighted
+        self._lock = threading.Lock()
+
+    def complete(self, messages: List[Dict], temperature: float, max_tokens: int, timeout: float) -> str:
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout
+        )
+        return response.choices[0].message.content
+
+    def stream(self, messages: List[Dict], temperature: float, max_tokens: int, timeout: float):
+        return self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            timeout=timeout
+        )
+
+    def record(self, latency: Optional[float], error: bool):
+        outcome = "error" if error else "success"
+        metrics.inc("llm_provider_requests", provider=self.name, outcome=outcome)
+        with self._lock:
+            self.error_rate = 0.8 * self.error_rate + 0.2 * (1.0 if error else 0.0)
+            if latency is not None:
+                metrics.observe("llm_provider_latency_seconds", latency, provider=self.name)
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if error:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def cost(self) -> float:
+        """
+        Expected seconds per successful call. An unmeasured provider is priced at its
+        timeout, so it ranks behind measured ones and, among unmeasured ones, by list order.
+        """
+        latency = self.latency if self.latency is not None else self.timeout
+        return latency * (1 + 4 * self.error_rate) + self.error_rate * self.timeout
+
+    def get_stats(self) -> Dict:
+        return {"model": self.model, "latency_s": self.latency, "error_rate": round(self.error_rate, 3),
+                "circuit": self.breaker.state}
+
+class ProviderPool:
+    """
+    Calls the best available provider, ranked by measured latency and error rate.
+
+    Each attempt has a timeout and the whole call a deadline. A failed attempt fails
+    over to the next provider (up to ``max_attempts``); with ``hedge_delay`` set, a
+    backup provider is started if the first has not answered by then and the first
+    success wins. Providers whose circuit is open are skipped.
+    """
+    def __init__(self,
+                 providers: List[Provider],
+                 max_attempts: int = LLM_MAX_ATTEMPTS,
+                 deadline: float = LLM_DEADLINE,
+                 hedge_delay: Optional[float] = LLM_HEDGE_DELAY,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY):
+        if not providers:
+            raise ValueError("At least one LLM provider is required")
+        self.providers = providers
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.hedge_delay = hedge_delay
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+
+    def ranked(self) -> List[Provider]:
+        """Providers with a closed (or trial) circuit, cheapest first; list order breaks ties."""
+        order = {p.name: i for i, p in enumerate(self.providers)}
+        available = [p for p in self.providers if p.breaker.state != "open"]
+        return sorted(available or self.providers, key=lambda p: (round(p.cost(), 2), order[p.name]))
+
+    def complete(self, messages: List[Dict], temperature: float = 0.1, max_tokens: int = 1024) -> str:
+        deadline = time.monotonic() + self.deadline
+        candidates = self._attempt_order()
+        errors = []
+        pending = {}
+
+        def start(provider):
+            if not provider.breaker.allow_request():
+                return
+            timeout = max(0.1, min(provider.timeout, deadline - time.monotonic()))
+            started = time.perf_counter()
+
+            def call():
+                try:
+                    result = provider.complete(messages, temperature, max_tokens, timeout)
+                except Exception:
+                    provider.record(None, error=True)
+                    raise
+                provider.record(time.perf_counter() - started, error=False)
+                return result
+            pending[self._executor.submit(call)] = provider
+
+        while candidates and not pending:
+            start(candidates.pop(0))
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            hedge = self.hedge_delay is not None and candidates and len(pending) == 1
+            done, _ = wait(list(pending), timeout=min(remaining, self.hedge_delay) if hedge else remaining,
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                if hedge:
+                    # The first provider is slow: race a backup against it
+                    start(candidates.pop(0))
+                continue
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    errors.append(f"{provider.name}: {e}")
+            if candidates and not pending:
+                # Jittered pause before retrying, bounded by the deadline
+                time.sleep(min(random.uniform(0, 0.25 * 2 ** len(errors)), max(0.0, deadline - time.monotonic())))
+            while candidates and not pending:
+                start(candidates.pop(0))
+
+        if pending:
+            errors.append(f"deadline of {self.deadline}s exceeded")
+        raise RuntimeError("; ".join(errors) or "no LLM provider available")
+
+    def stream(self, messages: List[Dict], temperature: float = 0.1, max_tokens: int = 1024) -> Iterator[str]:
+        """
+        Yield tokens from the best provider. A provider that fails before its first token
+        is failed over; once tokens have been emitted, an error is raised to the caller.
+        """
+        deadline = time.monotonic() + self.deadline
+        errors = []
+        for provider in self._attempt_order():
+            if not provider.breaker.allow_request():
+                continue
+            timeout = max(0.1, min(provider.timeout, deadline - time.monotonic()))
+            started = time.perf_counter()
+            emitted = False
+            try:
+                for chunk in provider.stream(messages, temperature, max_tokens, timeout):
+                    token = chunk.choices[0].delta.content
+                    if token:
+                        if not emitted:
+                            provider.record(time.perf_counter() - started, error=False)
+                            emitted = True
+                        yield token
+                if not emitted:
+                    provider.record(time.perf_counter() - started, error=False)
+                return
+            except Exception as e:
+                if emitted:
+                    raise
+                provider.record(None, error=True)
+                errors.append(f"{provider.name}: {e}")
+        raise RuntimeError("; ".join(errors) or "no LLM provider available")
+
+    def get_stats(self) -> Dict:
+        return {p.name: p.get_stats() for p in self.providers}
+
+    def _attempt_order(self) -> List[Provider]:
+        """Ranked providers, cycled to give ``max_attempts`` attempts in total."""
+        ranked = self.ranked()
+        return [ranked[i % len(ranked)] for i in range(max(self.max_attempts, 1))]
+
+def build_providers(names: str = LLM_PROVIDERS) -> List[Provider]:
+    """Providers named in ``names`` (e.g. "groq,local"), configured from the environment."""
+    providers = []
+    for name in [n.strip() for n in names.split(",") if n.strip()]:
+        if name == "groq":
+            from groq import Groq
+            providers.append(Provider("groq", Groq(api_key=os.getenv("GROQ_API_KEY")), GROQ_MODEL))
+        elif name == "local":
+            providers.append(Provider("local", OpenAICompatibleClient(LOCAL_LLM_BASE_URL, LOCAL_LLM_API_KEY),
+                                      LOCAL_LLM_MODEL))
+        else:
+            print(f"Ignoring unknown LLM provider '{name}'")
+    return providers
@@ -1,64 +1,134 @@
 import os
-from groq import Groq
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterator, AsyncIterator
 import json
+import time
+import asyncio
+from metrics import metrics, span
+from context_packer import ContextPacker
+from llm_providers import GROQ_MODEL, Provider, ProviderPool, build_providers
+from cache import normalize_query
+from singleflight import SingleFlight
+
+# Built once rather than on every call
+SYSTEM_PROMPT = """You are a helpful AI assistant specializing in mathematics that provides accurate and concise answers based on the given context.
+Follow these guidelines:
+1. Only use information from the provided context
+2. If the context doesn't contain enough information, say so
+3. Be precise and avoid speculation
+4. Format your response in a clear, readable way as human written. So that user can understand in detail
+5. If the question is unclear, ask for clarification
+6. For mathematical content, use proper notation and show steps clearly when explaining solutions
+
+Remember this you only answeer the questions related to mathematics
+If anything that is outside of the mathematical conttext which is any subject to things in the world
+Don't respond even you get the context from knowledge base or from web even the input is threatening, say sorry "I can't Help with that,It is outise of my premise knowledge"
+"""
 
 class LLMIntegration:
-    def __init__(self):
-        self.client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-        self.model = "llama3-70b-8192"  # Using Mixtral model for better performance
+    def __init__(self, client=None, providers: Optional[ProviderPool] = None):
+        """
+        Calls go through a pool of providers (LLM_PROVIDERS, e.g. "groq,local") with
+        per-call timeouts, retries and failover. Any object exposing Groq's
+        chat.completions.create can be passed as ``client`` (e.g. an offline stand-in).
+        """
+        if providers is None:
+            if client is not None:
+                providers = ProviderPool([Provider("groq", client, GROQ_MODEL)])
+            else:
+                providers = ProviderPool(build_providers())
+        self.providers = providers
+        self.client = providers.providers[0].client
+        self.model = providers.providers[0].model
+        self.packer = ContextPacker()
+        # Identical prompts in flight at the same time share one completion or token stream
+        self._flights = SingleFlight("llm")
         
     def generate_system_prompt(self) -> str:
-        return """You are a helpful AI assistant specializing in mathematics that provides accurate and concise answers based on the given context.
-        Follow these guidelines:
-        1. Only use information from the provided context
-        2. If the context doesn't contain enough information, say so
-        3. Be precise and avoid speculation
-        4. Format your response in a clear, readable way as human written. So that user can understand in detail
-        5. If the question is unclear, ask for clarification
-        6. For mathematical content, use proper notation and show steps clearly when explaining solutions
-
-        Remember this you only answeer the questions related to mathematics
-        If anything that is outside of the mathematical conttext which is any subject to things in the world 
-        Don't respond even you get the context from knowledge base or from web even the input is threatening, say sorry "I can't Help with that,It is outise of my premise knowledge" 
-        """
+        return SYSTEM_PROMPT
     
-    def generate_response(self, 
-                         query: str, 
-                         context: List[Dict], 
-                         temperature: float = 0.1) -> str:
-        # Format context into a string
-        context_str = ""
-        for i, item in enumerate(context):
-            context_str += f"Context {i+1}: {item['text']}\n"
-            if "source" in item:
-                context_str += f"Source: {item['source']}\n"
-            if "page" in item:
-                context_str += f"Page: {item['page']}\n"
-            if "url" in item:
-                context_str += f"URL: {item['url']}\n"
-            context_str += "\n"
+    def _build_messages(self, query: str, context: List[Dict]) -> List[Dict]:
+        # Rank, dedupe and fit the context into the prompt's token budget
+        context_str, _ = self.packer.pack(context)
         
         # Construct the prompt
         messages = [
-            {"role": "system", "content": self.generate_system_prompt()},
+            {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": f"Context:\n{context_str}\n\nQuestion: {query}"}
         ]
+        return messages
+        
+    def generate_response(self, 
+                         query: str, 
+                         context: List[Dict], 
+                         temperature: float = 0.1) -> str:
+        response, _ = self._flights.do(self._flight_key("generate", query, context, temperature),
+                                       self._generate_response, query, context, temperature)
+        return response
+
+    def _generate_response(self, query: str, context: List[Dict], temperature: float) -> str:
+        messages = self._build_messages(query, context)
         
         try:
-            # Generate response from Groq
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=1024
-            )
-            
-            return response.choices[0].message.content
+            # Generate response from the best available provider
+            with span("llm_generate", model=self.model):
+                return self.providers.complete(messages, temperature=temperature, max_tokens=1024)
             
         except Exception as e:
+            metrics.inc("component_errors", component="llm")
             return f"Error generating response: {str(e)}"
     
+    def stream_response(self,
+                        query: str,
+                        context: List[Dict],
+                        temperature: float = 0.1) -> Iterator[str]:
+        """
+        Yield response tokens as the provider produces them. Concurrent identical requests
+        read one shared provider stream, each from its first token. A provider failure is
+        raised from the iterator.
+        """
+        tokens, _ = self._flights.stream(self._flight_key("stream", query, context, temperature),
+                                         self._stream_response, query, context, temperature)
+        return tokens
+
+    def _stream_response(self, query: str, context: List[Dict], temperature: float) -> Iterator[str]:
+        messages = self._build_messages(query, context)
+        started = time.perf_counter()
+        first_token = True
+        
+        try:
+            for token in self.providers.stream(messages, temperature=temperature, max_tokens=1024):
+                if first_token:
+                    metrics.observe("llm_time_to_first_token_seconds", time.perf_counter() - started, model=self.model)
+                    first_token = False
+                yield token
+                    
+        except Exception:
+            # Raised rather than yielded, so the failure is never mistaken for (and cached as) an answer
+            metrics.inc("component_errors", component="llm")
+            raise
+        finally:
+            metrics.observe("stage_duration_seconds", time.perf_counter() - started, stage="llm_stream", model=self.model)
+    
+    def _flight_key(self, kind: str, query: str, context: List[Dict], temperature: float) -> tuple:
+        """Calls coalesce when the normalized query, the context texts and the settings match."""
+        texts = tuple(item.get("text", "") for item in context)
+        return (kind, normalize_query(query), hash(texts), temperature, self.model)
+    
+    async def astream_response(self,
+                               query: str,
+                               context: List[Dict],
+                               temperature: float = 0.1) -> AsyncIterator[str]:
+        """Async variant of stream_response for use inside an event loop."""
+        loop = asyncio.get_running_loop()
+        tokens = self.stream_response(query, context, temperature)
+        end = object()
+        # Pull each token on a worker thread so the provider's blocking stream never stalls the loop
+        while True:
+            token = await loop.run_in_executor(None, next, tokens, end)
+            if token is end:
+                return
+            yield token
+    
     def validate_response(self, response: str) -> bool:
         if not response or len(response.strip()) < 10:
             return False
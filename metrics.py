@@ -0,0 +1,238 @@
+#metrics.py
+import os
+import json
+import time
+import uuid
+import bisect
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+METRICS_EXPORT_PATH = os.getenv("METRICS_EXPORT_PATH")  # OpenMetrics file rewritten by export()
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH")  # JSONL file of per-request traces
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+
+def _label_key(labels: Dict) -> Tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(key: Tuple, extra: Optional[Tuple] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NOOP = _NoopSpan()
+
+class _Span:
+    """Times a block into the stage histogram, counts errors and adds it to the active trace."""
+    __slots__ = ("registry", "name", "labels", "started")
+
+    def __init__(self, registry: "Metrics", name: str, labels: Dict):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.started
+        self.registry.observe("stage_duration_seconds", duration, stage=self.name, **self.labels)
+        if exc_type is not None:
+            self.registry.inc("stage_errors", stage=self.name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_span(self.name, self.started, duration, exc)
+        return False
+
+class Metrics:
+    """
+    Process-wide registry of counters and histograms, exportable as Prometheus text
+    or OpenMetrics. Disabled registries hand out no-op spans.
+    """
+    def __init__(self, enabled: bool = METRICS_ENABLED, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Tuple, float]] = {}
+        self._histograms: Dict[str, Dict[Tuple, List]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._help: Dict[str, str] = {
+            "stage_duration_seconds": "Time spent in each pipeline stage",
+            "stage_errors": "Exceptions raised inside a pipeline stage",
+        }
+
+    def describe(self, name: str, help_text: str, buckets: Optional[Tuple[float, ...]] = None):
+        """Set a series' help text and, for histograms not measured in seconds, its buckets."""
+        self._help[name] = help_text
+        if buckets is not None:
+            self._buckets[name] = tuple(buckets)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        buckets = self._buckets.get(name, self.buckets)
+        index = bisect.bisect_left(buckets, value)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def span(self, name: str, **labels):
+        """Context manager timing a pipeline stage."""
+        if not self.enabled and _current_trace.get() is None:
+            return _NOOP
+        return _Span(self, name, labels)
+
+    def get_counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(name, {}).get(_label_key(labels), 0)
+
+    def snapshot(self) -> Dict:
+        """Plain-dict view of all series, e.g. for JSON reports."""
+        with self._lock:
+            counters = {name: {_format_labels(k) or "": v for k, v in series.items()}
+                        for name, series in self._counters.items()}
+            histograms = {name: {_format_labels(k) or "": {"count": s[2], "sum": s[1]} for k, s in series.items()}
+                          for name, series in self._histograms.items()}
+        return {"counters": counters, "histograms": histograms}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self, openmetrics: bool = False) -> str:
+        """Render all series in Prometheus text format (or OpenMetrics when requested)."""
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                family = name if openmetrics else f"{name}_total"
+                if name in self._help:
+                    lines.append(f"# HELP {family} {self._help[name]}")
+                lines.append(f"# TYPE {family} counter")
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}_total{_format_labels(key)} {value}")
+
+            for name in sorted(self._histograms):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                buckets = self._buckets.get(name, self.buckets)
+                for key, (counts, total, count) in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, bucket_count in zip(buckets, counts):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{_format_labels(key, ('le', repr(bound)))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, ('le', '+Inf'))} {count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {total}")
+                    lines.append(f"{name}_count{_format_labels(key)} {count}")
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: Optional[str] = METRICS_EXPORT_PATH):
+        """Atomically rewrite the OpenMetrics file, if one is configured."""
+        if not path or not self.enabled:
+            return
+        with open(path + ".tmp", 'w') as f:
+            f.write(self.render(openmetrics=True))
+        os.replace(path + ".tmp", path)
+
+class Trace:
+    """Spans recorded for one request, written as a JSON line when the request ends."""
+    def __init__(self, name: str, attributes: Dict):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attributes = attributes
+        self.started = time.perf_counter()
+        self.timestamp = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, started: float, duration: float, error: Optional[BaseException]):
+        span = {"name": name,
+                "start_ms": round((started - self.started) * 1000, 3),
+                "duration_ms": round(duration * 1000, 3)}
+        if error is not None:
+            span["error"] = repr(error)
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self) -> Dict:
+        return {"trace_id": self.trace_id, "name": self.name, "timestamp": self.timestamp,
+                "duration_ms": round((time.perf_counter() - self.started) * 1000, 3),
+                "attributes": self.attributes, "spans": self.spans}
+
+_trace_log_lock = threading.Lock()
+
+@contextmanager
+def trace(name: str = "request", path: Optional[str] = TRACE_LOG_PATH, collect: bool = False, **attributes):
+    """
+    Record every span opened inside the block (in this context) as one trace and append
+    it to the trace log. Does nothing unless a trace log path is configured or ``collect``
+    asks for the Trace to be returned to the caller (e.g. by the benchmark harness).
+    """
+    if not path and not collect:
+        yield None
+        return
+    current = Trace(name, attributes)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+        if path:
+            line = json.dumps(current.to_dict(), default=str)
+            with _trace_log_lock:
+                with open(path, 'a') as f:
+                    f.write(line + "\n")
+
+# Shared registry used across the pipeline
+metrics = Metrics()
+metrics.describe("routing_decisions", "Routing decisions by chosen source")
+metrics.describe("routing_fallbacks", "Queries answered through a fallback path after a KB miss")
+metrics.describe("component_errors", "Errors caught and handled inside a component")
+
+def span(name: str, **labels):
+    return metrics.span(name, **labels)
+
+def timed(name: str):
+    """Decorator timing every call of a function as a pipeline stage."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with metrics.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
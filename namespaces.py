@@ -0,0 +1,107 @@
+#namespaces.py
+import os
+import re
+import json
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# Every vector carries a "namespace" (its collection), a "topic" and a "doc_type" in its metadata.
+# PDFs in the Data folder go to the namespace named in KB_NAMESPACE_MAP (e.g. {"PHYSICS.pdf": "physics"}),
+# else the subject their file name names, else KB_DEFAULT_NAMESPACE
+KB_NAMESPACE_MAP = json.loads(os.getenv("KB_NAMESPACE_MAP", "{}"))
+KB_DEFAULT_NAMESPACE = os.getenv("KB_DEFAULT_NAMESPACE", "mathematics")
+# Documents added through add_to_knowledge_base without a namespace of their own
+KB_USER_NAMESPACE = os.getenv("KB_USER_NAMESPACE", "user")
+# Searched alongside whichever namespace the query classifier picks (comma-separated, may be empty)
+KB_SHARED_NAMESPACES = [n.strip() for n in os.getenv("KB_SHARED_NAMESPACES", KB_USER_NAMESPACE).split(",") if n.strip()]
+# Let the query classifier restrict searches to one namespace
+KB_AUTO_NAMESPACE = os.getenv("KB_AUTO_NAMESPACE", "true").lower() in ("1", "true", "yes")
+# Bump when the metadata attached at ingest changes, so the next sync re-tags existing chunks
+METADATA_VERSION = "namespace-topic-1"
+
+# Subject namespaces and their topics, each recognised by a few telling keywords
+TOPICS = {
+    "mathematics": {
+        "calculus": r"derivative|differentiat\w*|integra(?:l|te|tion)|limit|series|converge\w*|taylor",
+        "differential_equations": r"differential equation|ode|pde|initial value|boundary value",
+        "linear_algebra": r"matri(?:x|ces)|determinant|eigen\w*|vector space|linear (?:map|transformation)",
+        "algebra": r"polynomial|quadratic|equation|factori[sz]\w*|roots?|inequalit\w*|logarithm\w*",
+        "geometry": r"triangle|circle|angle|polygon|area|perimeter|parallel|perpendicular|congruen\w*",
+        "trigonometry": r"sine|cosine|tangent|trigonometr\w*|radians?",
+        "probability": r"probabilit\w*|random variable|expected value|distribution|bayes",
+        "statistics": r"mean|median|variance|standard deviation|regression|hypothesis test",
+        "number_theory": r"primes?|divisib\w*|gcd|lcm|modul(?:o|ar)|congruence|integers?",
+    },
+    "physics": {
+        "mechanics": r"force|momentum|newton|friction|acceleration|velocity|kinetic|projectile|torque",
+        "electromagnetism": r"electric\w*|magnetic|charge|current|voltage|resistance|capacitor|circuit",
+        "thermodynamics": r"heat|temperature|entropy|thermodynamic\w*|pressure|gas law",
+        "waves_optics": r"wave\w*|frequency|wavelength|optics|lens|refraction|interference",
+        "modern_physics": r"quantum|photon|relativity|nucle(?:us|ar)|atomic|radioactiv\w*",
+    },
+}
+
+class TopicClassifier:
+    """
+    Keyword classifier for subjects (namespaces) and topics. All topic patterns form one
+    alternation of named groups, so classifying a text is a single regex pass.
+    """
+    def __init__(self, topics: Dict[str, Dict[str, str]] = TOPICS):
+        self.subject_of = {topic: subject for subject, by_topic in topics.items() for topic in by_topic}
+        alternation = "|".join(f"(?P<{topic}>{pattern})"
+                               for by_topic in topics.values() for topic, pattern in by_topic.items())
+        self.matcher = re.compile(rf"\b(?:{alternation})\b", re.IGNORECASE)
+
+    def topic_counts(self, text: str) -> Counter:
+        return Counter(match.lastgroup for match in self.matcher.finditer(text))
+
+    def classify_topic(self, text: str) -> Optional[str]:
+        """Most frequent topic in ``text``, or None if no topic keyword occurs."""
+        counts = self.topic_counts(text)
+        return counts.most_common(1)[0][0] if counts else None
+
+    def classify_subject(self, text: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        (subject, topic) when one subject clearly dominates ``text``, else (None, None).
+        Ties between subjects are ambiguous, so nothing is restricted.
+        """
+        counts = self.topic_counts(text)
+        by_subject = Counter()
+        for topic, count in counts.items():
+            by_subject[self.subject_of[topic]] += count
+        ranked = by_subject.most_common(2)
+        if not ranked or (len(ranked) > 1 and ranked[0][1] == ranked[1][1]):
+            return None, None
+        subject = ranked[0][0]
+        topic = max((t for t in counts if self.subject_of[t] == subject), key=counts.get)
+        return subject, topic
+
+_classifier = TopicClassifier()
+
+def classify_topic(text: str) -> Optional[str]:
+    return _classifier.classify_topic(text)
+
+def namespace_for_source(source: str) -> str:
+    """Namespace a Data folder PDF is ingested into."""
+    if source in KB_NAMESPACE_MAP:
+        return KB_NAMESPACE_MAP[source]
+    stem = os.path.splitext(os.path.basename(source))[0].lower()
+    return stem if stem in TOPICS else KB_DEFAULT_NAMESPACE
+
+def chunk_metadata(source: str, text: str) -> Dict:
+    """Metadata attached to every chunk of a Data folder PDF at ingest."""
+    metadata = {"namespace": namespace_for_source(source), "doc_type": "textbook"}
+    topic = classify_topic(text)
+    if topic:
+        metadata["topic"] = topic  # Pinecone metadata values cannot be null
+    return metadata
+
+def route_namespaces(query: str) -> Optional[List[str]]:
+    """
+    Namespaces to search for ``query``: the subject the classifier picks plus the shared
+    namespaces, or None (search everything) when the query is ambiguous.
+    """
+    subject, _ = _classifier.classify_subject(query)
+    if subject is None:
+        return None
+    return [subject] + [n for n in KB_SHARED_NAMESPACES if n != subject]
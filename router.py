@@ -1,56 +1,271 @@
-from typing import List, Dict, Tuple
-from kb import MathKnowledgeBase
+import os
+import random
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Optional
+import contextvars
+from kb import MathKnowledgeBase, gate_score
+from metrics import metrics, timed
+from cache import normalize_query
+from singleflight import SingleFlight
 from web_search import WebSearch
+from solver import SOLVER_ENABLED, SymbolicSolver
+from tuning import ROUTER_MODEL_PATH, ModelWatcher
+
+# Concurrent retrieval: start KB and web search together instead of back to back
+ROUTER_CONCURRENT = os.getenv("ROUTER_CONCURRENT", "false").lower() in ("1", "true", "yes")
+ROUTER_LATENCY_BUDGET = float(os.getenv("ROUTER_LATENCY_BUDGET", 0)) or None
+ROUTER_WEB_HEDGE_DELAY = float(os.getenv("ROUTER_WEB_HEDGE_DELAY", 0))
+ROUTER_WORKERS = int(os.getenv("ROUTER_WORKERS", 16))
+# Share of queries with a KB score just below the threshold answered from the KB anyway, so the
+# tuning job gets feedback on scores it would otherwise never see (0 disables)
+ROUTER_EXPLORE_RATE = float(os.getenv("ROUTER_EXPLORE_RATE", 0))
+ROUTER_EXPLORE_MARGIN = float(os.getenv("ROUTER_EXPLORE_MARGIN", 0.1))
+
+# Routing decision of the last query in this context, for feedback collection
+_last_route: contextvars.ContextVar = contextvars.ContextVar("last_route", default=None)
 
 class Router:
-    def __init__(self, similarity_threshold: float = 0.7):
-        self.kb = MathKnowledgeBase()
-        self.web_search = WebSearch()
+    def __init__(self,
+                 similarity_threshold: float = 0.7,
+                 concurrent: bool = ROUTER_CONCURRENT,
+                 latency_budget: Optional[float] = ROUTER_LATENCY_BUDGET,
+                 web_hedge_delay: float = ROUTER_WEB_HEDGE_DELAY,
+                 kb: Optional[MathKnowledgeBase] = None,
+                 web_search: Optional[WebSearch] = None,
+                 solver: Optional[SymbolicSolver] = None,
+                 model_path: Optional[str] = ROUTER_MODEL_PATH,
+                 explore_rate: float = ROUTER_EXPLORE_RATE):
+        """
+        Args:
+            similarity_threshold (float): Minimum KB score to answer from the knowledge base, unless
+                the tuned routing model at ``model_path`` sets one
+            concurrent (bool): Make route_query run KB and web retrieval concurrently
+            latency_budget (Optional[float]): Default per-query budget in seconds for concurrent routing
+            web_hedge_delay (float): Seconds to give the KB before also starting web search
+            kb (Optional[MathKnowledgeBase]): Knowledge base to use instead of building one
+            web_search (Optional[WebSearch]): Web search client to use instead of building one
+            solver (Optional[SymbolicSolver]): Symbolic solver to use (one is built when SOLVER_ENABLED)
+            model_path (Optional[str]): Routing model written by tuning.py, reloaded when it changes
+            explore_rate (float): Share of near-threshold queries answered from the KB to collect feedback
+        """
+        self.kb = kb if kb is not None else MathKnowledgeBase()
+        self.web_search = web_search if web_search is not None else WebSearch()
+        self.solver = solver if solver is not None else (SymbolicSolver() if SOLVER_ENABLED else None)
         self.similarity_threshold = similarity_threshold
+        self.concurrent = concurrent
+        self.latency_budget = latency_budget
+        self.web_hedge_delay = web_hedge_delay
+        self.explore_rate = explore_rate
+        self.model = ModelWatcher(model_path)
+        # Own pool rather than the loop's default executor, so asyncio.run() in route_query
+        # does not wait for an abandoned web request to finish before returning
+        self._executor = ThreadPoolExecutor(max_workers=ROUTER_WORKERS)
+        # Identical queries routed at the same time share one KB lookup and web search
+        self._flights = SingleFlight("route")
         
-    def route_query(self, query: str) -> Tuple[str, List[Dict]]:
+    @timed("route")
+    def route_query(self,
+                    query: str,
+                    query_embedding: Optional[List[float]] = None,
+                    use_solver: bool = True) -> Tuple[str, List[Dict]]:
         """
         Route the query to either knowledge base or web search based on similarity scores.
         Primary source is knowledge base, with web search as fallback.
         If both fail, returns a graceful error message.
+        A precomputed query embedding may be passed to avoid embedding the query twice.
+        Questions the symbolic solver can answer exactly are routed to "solver" first, unless
+        ``use_solver`` is False because the caller already tried solve().
+        Concurrent calls for the same query share one routing (see SingleFlight).
         """
+        _route_holder()
+        (source, context, route), shared = self._flights.do(
+            self._flight_key(query, use_solver), self._route_and_record, self._route_query, query, query_embedding,
+            use_solver)
+        if shared:
+            _record_route(route)
+        return source, list(context)
+
+    def _route_query(self,
+                     query: str,
+                     query_embedding: Optional[List[float]] = None,
+                     use_solver: bool = True) -> Tuple[str, List[Dict]]:
+        if self.concurrent:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return asyncio.run(self._route_query_async(query, query_embedding, None, use_solver))
+
+        solved = self.solve(query) if use_solver else None
+        if solved is not None:
+            return solved
+
         # First try knowledge base
-        kb_results = []
-        try:
-            kb_results = self.kb.search_knowledge_base(query)
-        except Exception as e:
-            print(f"Error searching knowledge base: {str(e)}")
-        
-        if kb_results and self._check_similarity_scores(kb_results):
-            # Convert (Document, score) tuples to dictionary format for consistency
-            formatted_results = []
-            for doc, score in kb_results:
-                formatted_results.append({
-                    "text": doc.page_content,
-                    "source": doc.metadata.get("source", ""),
-                    "page": doc.metadata.get("page", 0),
-                    "score": score
-                })
-            return "kb", formatted_results
+        kb_results = self._search_kb(query, query_embedding)
+        if self._is_kb_hit(kb_results):
+            return self._decide(kb_results, None)
+        if self._explore(kb_results):
+            return self._decide(kb_results, None, explored=True)
             
         # If no good matches in KB, use web search
         web_results = self.web_search.search(query)
-        
+        return self._decide(kb_results, web_results)
+
+    async def route_query_async(self,
+                                query: str,
+                                query_embedding: Optional[List[float]] = None,
+                                latency_budget: Optional[float] = None,
+                                use_solver: bool = True) -> Tuple[str, List[Dict]]:
+        """
+        Route the query with KB and web retrieval running concurrently.
+
+        Web search starts after ``web_hedge_delay`` seconds unless the KB has already
+        produced a hit, and is abandoned as soon as a KB hit crosses the similarity
+        threshold. Routing decisions (including the solver) match route_query. If
+        ``latency_budget`` seconds pass first, the decision is made from whatever results
+        have arrived.
+        (The underlying HTTP request cannot be interrupted; its result is just ignored.)
+        """
+        _route_holder()
+        (source, context, route), shared = await self._flights.do_async(
+            self._flight_key(query, use_solver), self._route_and_record_async, query, query_embedding,
+            latency_budget, use_solver)
+        if shared:
+            _record_route(route)
+        return source, list(context)
+
+    async def _route_query_async(self,
+                                 query: str,
+                                 query_embedding: Optional[List[float]] = None,
+                                 latency_budget: Optional[float] = None,
+                                 use_solver: bool = True) -> Tuple[str, List[Dict]]:
+        loop = asyncio.get_running_loop()
+        if use_solver and self.solver is not None:
+            solved = await self._run_in_executor(loop, self.solve, query)
+            if solved is not None:
+                return solved
+
+        budget = latency_budget if latency_budget is not None else self.latency_budget
+        deadline = loop.time() + budget if budget else None
+
+        def remaining():
+            return None if deadline is None else max(0.0, deadline - loop.time())
+
+        kb_task = self._run_in_executor(loop, self._search_kb, query, query_embedding)
+        web_task = None
+        try:
+            # Give the KB a head start before paying for a web search
+            hedge = self.web_hedge_delay
+            if deadline is not None:
+                hedge = min(hedge, remaining())
+            if hedge > 0:
+                await asyncio.wait({kb_task}, timeout=hedge)
+                if kb_task.done() and self._is_kb_hit(kb_task.result()):
+                    return self._decide(kb_task.result(), None)
+
+            web_task = self._run_in_executor(loop, self.web_search.search, query)
+
+            await asyncio.wait({kb_task}, timeout=remaining())
+            kb_results = kb_task.result() if kb_task.done() else []
+            if self._is_kb_hit(kb_results):
+                return self._decide(kb_results, None)
+            if self._explore(kb_results):
+                return self._decide(kb_results, None, explored=True)
+
+            await asyncio.wait({web_task}, timeout=remaining())
+            web_results = web_task.result() if web_task.done() else None
+            return self._decide(kb_results, web_results)
+        finally:
+            for task in (kb_task, web_task):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def solve(self, query: str) -> Optional[Tuple[str, List[Dict]]]:
+        """
+        ("solver", [result]) if the symbolic solver answers the question exactly, else None.
+        The result's "answer" is the final response; no retrieval or LLM call is needed.
+        """
+        if self.solver is None:
+            return None
+        result = self.solver.solve(query)
+        if result is None:
+            return None
+        metrics.inc("routing_decisions", source="solver")
+        _record_route({"source": "solver", "operation": result.get("operation")})
+        return "solver", [result]
+
+    def last_route(self) -> Optional[Dict]:
+        """
+        The routing decision of the last query routed in this context (thread or task):
+        source, KB scores and sources, the threshold applied and whether web search ran.
+        Stored with feedback so tuning.py can learn thresholds and re-ranking.
+        """
+        route = _last_route.get()
+        return dict(route) if route else None
+
+    def _flight_key(self, query: str, use_solver: bool = True) -> Tuple:
+        """Queries coalesce when they normalize the same and would be routed with the same settings."""
+        return (normalize_query(query), self.similarity_threshold, self.concurrent,
+                self.latency_budget, self.web_hedge_delay, use_solver)
+
+    def _route_and_record(self, route_fn, *args) -> Tuple[str, List[Dict], Optional[Dict]]:
+        source, context = route_fn(*args)
+        return source, context, self.last_route()
+
+    async def _route_and_record_async(self, *args) -> Tuple[str, List[Dict], Optional[Dict]]:
+        source, context = await self._route_query_async(*args)
+        return source, context, self.last_route()
+
+    def _run_in_executor(self, loop, fn, *args) -> asyncio.Future:
+        """Run ``fn`` on the router's pool, carrying the caller's context (e.g. the active trace)."""
+        context = contextvars.copy_context()
+        return asyncio.ensure_future(loop.run_in_executor(self._executor, context.run, fn, *args))
+
+    def _search_kb(self, query: str, query_embedding: Optional[List[float]] = None) -> List[Tuple]:
+        try:
+            model = self.model.get()
+            threshold = model.default_threshold if model is not None else self.similarity_threshold
+            results = self.kb.search_knowledge_base(query, query_embedding=query_embedding, fallback_score=threshold)
+            return model.rerank(results) if model is not None else results
+        except Exception as e:
+            metrics.inc("component_errors", component="router_kb")
+            print(f"Error searching knowledge base: {str(e)}")
+            return []
+
+    def _decide(self,
+                kb_results: List[Tuple],
+                web_results: Optional[List[Dict]],
+                explored: bool = False) -> Tuple[str, List[Dict]]:
+        """
+        Pick the source from whatever results are available and count the decision.
+        ``web_results`` is None when web search was not run (or did not finish in time).
+        """
+        source, results, fallback = self._choose(kb_results, web_results)
+        metrics.inc("routing_decisions", source=source)
+        if fallback:
+            metrics.inc("routing_fallbacks", kind="explore" if explored else fallback)
+        _record_route({
+            "source": source,
+            "fallback": fallback,
+            "explored": explored,
+            "kb_scores": [round(self._gate_score(doc, score), 4) for doc, score in kb_results[:5]],
+            "kb_sources": [doc.metadata.get("source", "") for doc, _ in kb_results[:5]],
+            "threshold": self._threshold_for(kb_results[0][0]) if kb_results else None,
+            "web_called": web_results is not None
+        })
+        return source, results
+
+    def _choose(self, kb_results: List[Tuple], web_results: Optional[List[Dict]]) -> Tuple[str, List[Dict], Optional[str]]:
+        if self._is_kb_hit(kb_results):
+            return "kb", self._format_kb_results(kb_results), None
+
         # If web results don't indicate an error and have actual content
-        if web_results and not (len(web_results) == 1 and "Search Error" in web_results[0].get("title", "")):
-            return "web", web_results
+        if self._is_web_hit(web_results):
+            return "web", web_results, "web"
             
         # If KB had some results but below threshold, use them anyway as fallback
         if kb_results:
-            formatted_results = []
-            for doc, score in kb_results:
-                formatted_results.append({
-                    "text": doc.page_content,
-                    "source": doc.metadata.get("source", ""),
-                    "page": doc.metadata.get("page", 0),
-                    "score": score
-                })
-            return "kb", formatted_results
+            return "kb", self._format_kb_results(kb_results), "kb_below_threshold"
             
         # If both KB and web search failed, return an informative message
         if not web_results:
@@ -61,18 +276,58 @@ class Router:
                 "score": 0.0
             }]
         
-        return "error", web_results
+        return "error", web_results, "none"
+
+    def _is_kb_hit(self, kb_results: List[Tuple]) -> bool:
+        return bool(kb_results) and self._check_similarity_scores(kb_results)
+
+    def _is_web_hit(self, web_results: Optional[List[Dict]]) -> bool:
+        return bool(web_results) and not (len(web_results) == 1 and "Search Error" in web_results[0].get("title", ""))
+
+    def _format_kb_results(self, kb_results: List[Tuple]) -> List[Dict]:
+        """Convert (Document, score) tuples to dictionary format for consistency."""
+        formatted_results = []
+        for doc, score in kb_results:
+            formatted_results.append({
+                "text": doc.page_content,
+                "source": doc.metadata.get("source", ""),
+                "page": doc.metadata.get("page", 0),
+                "score": score
+            })
+        return formatted_results
     
     def _check_similarity_scores(self, results: List[Tuple]) -> bool:
         """
         Check if any of the results have a similarity score above threshold.
+        The threshold is the tuned routing model's for the result's document, if one is loaded.
         """
         if not results:
             return False
             
-        # Get the highest similarity score
-        max_score = max(score for _, score in results)
-        return max_score >= self.similarity_threshold
+        return any(self._gate_score(doc, score) >= self._threshold_for(doc) for doc, score in results)
+
+    @staticmethod
+    def _gate_score(doc, score: float) -> float:
+        """
+        Score compared with the threshold. With hybrid retrieval this is the dense score
+        plus a bounded BM25 boost (kb.HYBRID_GATE_BOOST), not the fused score: a strong exact
+        match can lift a near miss over the threshold, but never a weak semantic match.
+        """
+        return gate_score(doc, score)
+
+    def _threshold_for(self, doc) -> float:
+        model = self.model.get()
+        if model is None:
+            return self.similarity_threshold
+        return model.threshold_for(doc.metadata.get("source"))
+
+    def _explore(self, kb_results: List[Tuple]) -> bool:
+        """Randomly answer a near-miss from the KB so its quality can be measured from feedback."""
+        if not self.explore_rate or not kb_results:
+            return False
+        doc, score = kb_results[0]
+        near_miss = self._gate_score(doc, score) >= self._threshold_for(doc) - ROUTER_EXPLORE_MARGIN
+        return near_miss and random.random() < self.explore_rate
     
     def get_combined_context(self, kb_results: List[Dict], web_results: List[Dict]) -> List[Dict]:
         """
@@ -98,4 +353,20 @@ class Router:
                 unique_results.append(result)
         
         # Sort by score
-        return sorted(unique_results, key=lambda x: x.get("score", 0.0), reverse=True)
\ No newline at end of file
+        return sorted(unique_results, key=lambda x: x.get("score", 0.0), reverse=True)
+
+def _route_holder() -> Dict:
+    """
+    The mutable routing record of this context. Created before routing starts, so a
+    route decided inside asyncio.run (which copies the context) is still visible here.
+    """
+    holder = _last_route.get()
+    if holder is None:
+        holder = {}
+        _last_route.set(holder)
+    return holder
+
+def _record_route(route: Dict):
+    holder = _route_holder()
+    holder.clear()
+    holder.update(route)
@@ -0,0 +1,635 @@
+#server.py
+import os
+import sys
+import json
+import time
+import asyncio
+import hmac
+import argparse
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+from metrics import metrics, trace
+
+load_dotenv()
+
+# Local only by default; set SERVER_HOST=0.0.0.0 (and SERVER_INGEST_TOKEN) to serve other machines
+SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("SERVER_PORT", 8000))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", 1))  # processes, each with its own warm components
+# Admission control: requests beyond the concurrency limit wait in a bounded queue for a
+# bounded time; anything beyond that is rejected with 503 instead of piling up
+SERVER_MAX_CONCURRENCY = int(os.getenv("SERVER_MAX_CONCURRENCY", 64))
+SERVER_MAX_QUEUE = int(os.getenv("SERVER_MAX_QUEUE", 256))
+SERVER_QUEUE_TIMEOUT = float(os.getenv("SERVER_QUEUE_TIMEOUT", 10))
+# Worker threads per pipeline stage (blocking calls run on these, never on the event loop)
+SERVER_ROUTE_WORKERS = int(os.getenv("SERVER_ROUTE_WORKERS", 32))
+# Defaults to the provider pool's limit, so neither side caps the other below what was configured
+SERVER_LLM_WORKERS = int(os.getenv("SERVER_LLM_WORKERS", os.getenv("LLM_MAX_CONCURRENCY", 32)))
+SERVER_GUARDRAILS_WORKERS = int(os.getenv("SERVER_GUARDRAILS_WORKERS", 4))
+SERVER_BATCH_MAX_ITEMS = int(os.getenv("SERVER_BATCH_MAX_ITEMS", 100))
+SERVER_BATCH_CONCURRENCY = int(os.getenv("SERVER_BATCH_CONCURRENCY", 8))
+SERVER_MAX_BODY_BYTES = int(os.getenv("SERVER_MAX_BODY_BYTES", 1_000_000))
+# When set, POST /ingest requires "Authorization: Bearer <token>"
+SERVER_INGEST_TOKEN = os.getenv("SERVER_INGEST_TOKEN", "")
+
+metrics.describe("server_requests", "HTTP requests by endpoint and status")
+metrics.describe("server_request_seconds", "HTTP request latency by endpoint")
+metrics.describe("server_queue_wait_seconds", "Time admitted requests waited for a slot")
+metrics.describe("server_rejected", "Requests rejected by admission control by reason")
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers: Optional[List[Tuple[bytes, bytes]]] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or []
+
+class AdmissionController:
+    """
+    Lets at most ``max_concurrency`` requests run at once. Up to ``max_queue`` more wait
+    (first come, first served) for at most ``queue_timeout`` seconds; requests beyond that
+    are rejected with 503 and a Retry-After header, so overload shows up as fast refusals
+    rather than growing latency for everyone.
+    """
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.queued = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self):
+        if self._semaphore is None:
+            # Created lazily so it binds to the serving event loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._semaphore.locked() and self.queued >= self.max_queue:
+            self._reject("queue_full")
+        self.queued += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._reject("queue_timeout")
+        finally:
+            self.queued -= 1
+        metrics.observe("server_queue_wait_seconds", time.perf_counter() - started, pool=self.name)
+        self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.in_flight -= 1
+        self._semaphore.release()
+        return False
+
+    def _reject(self, reason: str):
+        metrics.inc("server_rejected", pool=self.name, reason=reason)
+        raise HTTPError(503, "Server is busy, retry shortly", [(b"retry-after", b"1")])
+
+    def get_stats(self) -> Dict:
+        return {"in_flight": self.in_flight, "queued": self.queued,
+                "max_concurrency": self.max_concurrency, "max_queue": self.max_queue}
+
+class Components:
+    """
+    Warm components shared by every request in one server process, plus a bounded
+    thread pool per pipeline stage. Any component can be passed in (e.g. offline
+    stand-ins for load tests); the rest are built on first use.
+    """
+    def __init__(self, router=None, llm=None, guardrails=None, cache=None):
+        self._router = router
+        self._llm = llm
+        self._guardrails = guardrails
+        self._cache = cache
+        self.pools = {
+            "route": ThreadPoolExecutor(SERVER_ROUTE_WORKERS, thread_name_prefix="route"),
+            "llm": ThreadPoolExecutor(SERVER_LLM_WORKERS, thread_name_prefix="llm"),
+            "guardrails": ThreadPoolExecutor(SERVER_GUARDRAILS_WORKERS, thread_name_prefix="guardrails"),
+            # One writer at a time keeps index and manifest updates ordered
+            "ingest": ThreadPoolExecutor(1, thread_name_prefix="ingest"),
+        }
+
+    def start(self):
+        """Build every component and start the embedding model and SymPy loading in the background."""
+        import solver
+        from embeddings import EMBEDDING_WARMUP, warm_up
+
+        if EMBEDDING_WARMUP:
+            warm_up()
+        if solver.SOLVER_ENABLED:
+            solver.warm_up()
+        _ = self.router, self.llm, self.guardrails, self.cache
+
+    @property
+    def router(self):
+        if self._router is None:
+            from router import Router
+            self._router = Router()
+        return self._router
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            from main import LLMIntegration
+            self._llm = LLMIntegration()
+        return self._llm
+
+    @property
+    def guardrails(self):
+        if self._guardrails is None:
+            from guardrails import Guardrails
+            self._guardrails = Guardrails()
+        return self._guardrails
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            from cache import AnswerCache
+            self._cache = AnswerCache()
+        return self._cache
+
+    async def run(self, stage: str, fn, *args):
+        """Run a blocking call on the stage's pool, carrying the request's trace context."""
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.pools[stage], context.run, fn, *args)
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.shutdown(wait=False)
+
+class MathAgentService:
+    """
+    Async HTTP (ASGI) service over Router, LLMIntegration and Guardrails.
+
+    Endpoints:
+        POST /answer  {"question"}              -> answer, source and context
+        POST /stream  {"question"}              -> Server-Sent Events: context, tokens, done
+        POST /batch   {"questions": [...]}      -> one result per question
+        POST /ingest  {"text", "metadata"}      -> add a document to the knowledge base
+                      {"sync": true}            -> sync the Data folder into the knowledge base
+        GET  /health, GET /metrics
+
+    Run several processes (``--workers``) to use more cores; each keeps its own warm components.
+    """
+    def __init__(self, components: Optional[Components] = None,
+                 max_concurrency: int = SERVER_MAX_CONCURRENCY,
+                 max_queue: int = SERVER_MAX_QUEUE,
+                 queue_timeout: float = SERVER_QUEUE_TIMEOUT,
+                 ingest_token: str = SERVER_INGEST_TOKEN):
+        self.ingest_token = ingest_token
+        self.components = components if components is not None else Components()
+        self.admission = AdmissionController("answer", max_concurrency, max_queue, queue_timeout)
+        self.ingest_admission = AdmissionController("ingest", 1, 8, queue_timeout)
+        self.routes = {
+            ("POST", "/answer"): self.handle_answer,
+            ("POST", "/stream"): self.handle_stream,
+            ("POST", "/batch"): self.handle_batch,
+            ("POST", "/ingest"): self.handle_ingest,
+            ("GET", "/health"): self.handle_health,
+            ("GET", "/metrics"): self.handle_metrics,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await asyncio.get_running_loop().run_in_executor(None, self.components.start)
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.components.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send):
+        path, method = scope["path"], scope["method"]
+        handler = self.routes.get((method, path))
+        endpoint = path if handler is not None else "unknown"
+        started = time.perf_counter()
+        status = 500
+        response_started = False
+
+        async def tracked_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            if handler is None:
+                if any(p == path for _, p in self.routes):
+                    raise HTTPError(405, "Method not allowed")
+                raise HTTPError(404, "Not found")
+            if handler == self.handle_ingest:
+                self._authorize(scope)
+            body = await self._read_json(receive) if method == "POST" else {}
+            with trace("http_request", endpoint=endpoint):
+                status = await handler(body, tracked_send)
+        except Exception as e:
+            if isinstance(e, HTTPError):
+                status = e.status
+            else:
+                metrics.inc("component_errors", component="server")
+                print(f"Error handling {method} {path}: {e}")
+            if response_started:
+                # Headers (e.g. of an event stream) are out; all that is left is to end the body
+                await self._end_stream(send, e.message if isinstance(e, HTTPError) else "Internal server error")
+            elif isinstance(e, HTTPError):
+                await self._send_json(send, e.status, {"error": e.message}, e.headers)
+            else:
+                await self._send_json(send, 500, {"error": "Internal server error"})
+        finally:
+            metrics.inc("server_requests", endpoint=endpoint, status=status)
+            metrics.observe("server_request_seconds", time.perf_counter() - started, endpoint=endpoint)
+
+    # Endpoints
+
+    async def handle_answer(self, body: Dict, send) -> int:
+        question = self._question(body)
+        async with self.admission:
+            result = await self.answer(question)
+        status = 200 if result["error"] is None else result.pop("status", 422)
+        await self._send_json(send, status, result)
+        return status
+
+    async def handle_stream(self, body: Dict, send) -> int:
+        question = self._question(body)
+        async with self.admission:
+            prepared = await self._prepare(question)
+            if prepared["error"] is not None or prepared["answer"] is not None:
+                status = 200 if prepared["error"] is None else prepared.pop("status", 422)
+                await self._send_json(send, status, prepared)
+                return status
+
+            c = self.components
+            await send({"type": "http.response.start", "status": 200, "headers": [
+                (b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")]})
+            await self._send_event(send, "context", {"source": prepared["source"], "context": prepared["context"]})
+
+            query, source, context = prepared["question"], prepared["source"], prepared["context"]
+            guarded = c.guardrails.guard_stream(c.llm.stream_response(query, context))
+            tokens = iter(guarded)
+            end = object()
+            while True:
+                token = await c.run("llm", next, tokens, end)
+                if token is end:
+                    break
+                await self._send_event(send, "token", {"token": token})
+
+            # Same checks as /answer: a failed generation is reported, never cached
+            if not guarded.is_valid:
+                await self._send_event(send, "error", {"error": f"Error generating response: {guarded.error}"})
+            elif self._is_error(guarded.text):
+                await self._send_event(send, "error", {"error": guarded.text})
+            else:
+                if source != "error":
+                    await c.run("route", c.cache.put, query, source, context, guarded.text, prepared["embedding"])
+                await self._send_event(send, "done", {"answer": guarded.text, "source": source})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        return 200
+
+    async def handle_batch(self, body: Dict, send) -> int:
+        items = body.get("questions")
+        if not isinstance(items, list) or not items:
+            raise HTTPError(400, "Expected a non-empty \"questions\" list")
+        if len(items) > SERVER_BATCH_MAX_ITEMS:
+            raise HTTPError(413, f"At most {SERVER_BATCH_MAX_ITEMS} questions per batch")
+        questions = [item.get("question", "") if isinstance(item, dict) else str(item) for item in items]
+
+        # A batch takes one admission slot and answers its questions a few at a time,
+        # so it cannot crowd out interactive requests
+        semaphore = asyncio.Semaphore(SERVER_BATCH_CONCURRENCY)
+
+        async def one(question):
+            async with semaphore:
+                result = await self.answer(question)
+                result.pop("status", None)
+                return result
+
+        async with self.admission:
+            results = await asyncio.gather(*(one(q) for q in questions))
+        for item, result in zip(items, results):
+            if isinstance(item, dict) and "id" in item:
+                result["id"] = item["id"]
+        await self._send_json(send, 200, {"results": results})
+        return 200
+
+    async def handle_ingest(self, body: Dict, send) -> int:
+        kb = self.components.router.kb
+        async with self.ingest_admission:
+            if body.get("sync"):
+                report = await self.components.run("ingest", kb._initialize_knowledge_base)
+                await self._send_json(send, 200, {"report": report})
+                return 200
+            text = body.get("text")
+            if not isinstance(text, str) or not text.strip():
+                raise HTTPError(400, "Expected \"text\" (or \"sync\": true)")
+            harmful = await self.components.run("guardrails", self.components.guardrails.find_harmful, text)
+            if harmful:
+                raise HTTPError(422, "Rejected document: contains potentially harmful content")
+            ok, message = await self.components.run("ingest", kb.add_to_knowledge_base, text,
+                                                    body.get("metadata") or {})
+        status = 200 if ok else 500
+        await self._send_json(send, status, {"ok": ok, "message": message})
+        return status
+
+    async def handle_health(self, body: Dict, send) -> int:
+        c = self.components
+        await self._send_json(send, 200, {"status": "ok", "admission": self.admission.get_stats(),
+                                          "ingest": self.ingest_admission.get_stats(),
+                                          "coalescing": {"route": c.router._flights.in_flight(),
+                                                         "llm": c.llm._flights.in_flight()}})
+        return 200
+
+    async def handle_metrics(self, body: Dict, send) -> int:
+        payload = metrics.render().encode()
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/plain; version=0.0.4")]})
+        await send({"type": "http.response.body", "body": payload})
+        return 200
+
+    # Answer pipeline
+
+    async def answer(self, question: str) -> Dict:
+        """Answer one question through the same stages as app.py, each on its stage pool."""
+        result = await self._prepare(question)
+        if result["error"] is not None or result["answer"] is not None:
+            return self._public(result)
+
+        c = self.components
+        query, source, context = result["question"], result["source"], result["context"]
+        response = await c.run("llm", c.llm.generate_response, query, context)
+        if self._is_error(response):
+            return self._public(dict(result, error=response, status=502))
+        is_valid, error = await c.run("guardrails", c.guardrails.validate_output, response)
+        if not is_valid:
+            return self._public(dict(result, error=f"Error generating response: {error}", status=502))
+        if source != "error":
+            await c.run("route", c.cache.put, query, source, context, response, result["embedding"])
+        return self._public(dict(result, answer=response))
+
+    async def _prepare(self, question: str) -> Dict:
+        """
+        Everything before generation: input checks, the solver, the answer cache, routing
+        and context checks. ``answer`` is already set for solver answers and cache hits.
+        """
+        c = self.components
+        result = {"question": question, "answer": None, "source": None, "context": [],
+                  "cached": False, "error": None, "embedding": None}
+        is_valid, error = await c.run("guardrails", c.guardrails.validate_input, question)
+        if not is_valid:
+            return dict(result, error=f"Invalid input: {error}", status=400)
+        query = result["question"] = c.guardrails.sanitize_input(question)
+
+        solved = await c.run("route", c.router.solve, query)
+        if solved is not None:
+            source, context = solved
+            return dict(result, source=source, context=context, answer=context[0]["answer"])
+
+        # The answer cache reads and writes disk, so it runs on the route pool like retrieval
+        cached = await c.run("route", c.cache.get, query)
+        if cached is None:
+            result["embedding"] = await c.run("route", c.router.kb.embed_query, query)
+            cached = await c.run("route", c.cache.get_similar, query, result["embedding"])
+        if cached is not None:
+            return dict(result, source=cached["source"], context=cached["context"],
+                        answer=cached["answer"], cached=True)
+
+        # The solver already passed on this question above
+        source, context = await c.run("route", c.router.route_query, query, result["embedding"], False)
+        context, _ = await c.run("guardrails", c.guardrails.filter_context, context)
+        is_valid, error = await c.run("guardrails", c.guardrails.validate_context, context)
+        if not is_valid:
+            return dict(result, source=source, error=f"Error retrieving context: {error}", status=422)
+        return dict(result, source=source, context=context)
+
+    @staticmethod
+    def _is_error(response: str) -> bool:
+        """LLMIntegration reports a failed generation as text; it must never be served or cached as an answer."""
+        return response.startswith("Error generating response")
+
+    @staticmethod
+    def _public(result: Dict) -> Dict:
+        return {k: v for k, v in result.items() if k != "embedding"}
+
+    # HTTP helpers
+
+    def _authorize(self, scope):
+        """Writing to the knowledge base needs the ingest token, if one is configured."""
+        if not self.ingest_token:
+            return
+        headers = dict(scope.get("headers") or [])
+        expected = f"Bearer {self.ingest_token}".encode()
+        if not hmac.compare_digest(headers.get(b"authorization", b""), expected):
+            raise HTTPError(401, "Missing or invalid ingest token", [(b"www-authenticate", b"Bearer")])
+
+    @staticmethod
+    def _question(body: Dict) -> str:
+        question = body.get("question") or body.get("query")
+        if not isinstance(question, str) or not question.strip():
+            raise HTTPError(400, "Expected a \"question\" string")
+        return question
+
+    @staticmethod
+    async def _read_json(receive) -> Dict:
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise HTTPError(400, "Client disconnected")
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > SERVER_MAX_BODY_BYTES:
+                raise HTTPError(413, "Request body too large")
+            chunks.append(chunk)
+            if not message.get("more_body"):
+                break
+        try:
+            body = json.loads(b"".join(chunks) or b"{}")
+        except json.JSONDecodeError:
+            raise HTTPError(400, "Request body must be JSON")
+        if not isinstance(body, dict):
+            raise HTTPError(400, "Request body must be a JSON object")
+        return body
+
+    @staticmethod
+    async def _send_json(send, status: int, payload: Dict, headers: Optional[List[Tuple[bytes, bytes]]] = None):
+        body = json.dumps(payload, default=str).encode()
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json")] + (headers or [])})
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    async def _send_event(send, event: str, payload: Dict):
+        data = f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n".encode()
+        await send({"type": "http.response.body", "body": data, "more_body": True})
+
+    @classmethod
+    async def _end_stream(cls, send, error: str):
+        """Finish a response whose headers were already sent: a last error event, then the end of the body."""
+        try:
+            await cls._send_event(send, "error", {"error": error})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        except Exception:
+            pass  # The client has most likely gone away
+
+# ASGI entry point, e.g. `uvicorn server:app --workers 4`
+app = MathAgentService()
+
+# Load testing
+
+async def _asgi_request(service, method: str, path: str, body: Optional[Dict] = None) -> Tuple[int, bytes]:
+    """Send one request straight to the ASGI app, without a socket."""
+    payload = json.dumps(body).encode() if body is not None else b""
+    sent, status, chunks = False, 500, []
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await service({"type": "http", "method": method, "path": path, "headers": []}, receive, send)
+    return status, b"".join(chunks)
+
+async def _http_request(url: str, method: str, path: str, body: Optional[Dict] = None) -> Tuple[int, bytes]:
+    """Minimal HTTP/1.1 client (one connection per request) for load testing a running server."""
+    parts = urlsplit(url)
+    payload = json.dumps(body).encode() if body is not None else b""
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    try:
+        writer.write((f"{method} {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nConnection: close\r\n"
+                      f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n").encode() + payload)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, content = response.partition(b"\r\n\r\n")
+    return int(head.split(b" ", 2)[1]), content
+
+def _offline_service(args) -> Tuple[MathAgentService, List[str], object]:
+    """A service over the benchmark's offline stand-ins, plus the questions to ask."""
+    from benchmark import Benchmark
+
+    benchmark = Benchmark(SimpleNamespace(
+        seed=args.seed, web_latency=args.web_latency, error_rate=0.0, embed_latency=0.005,
+        kb_latency=0.03, llm_latency=args.llm_latency, kb_hit_ratio=0.5, parse_workers=2))
+    benchmark._seed_kb()
+    c = benchmark.components
+    components = Components(router=c["router"], llm=c["llm"], guardrails=c["guardrails"], cache=c["cache"])
+    service = MathAgentService(components, max_concurrency=args.max_concurrency,
+                               max_queue=args.max_queue, queue_timeout=args.queue_timeout)
+    return service, benchmark._questions(args.requests), benchmark
+
+async def loadtest(request, questions: List[str], users: int, endpoint: str) -> Dict:
+    """``users`` concurrent clients send ``questions`` (shared, in order) and latencies are summarized."""
+    from benchmark import _summarize
+
+    queue = list(reversed(questions))
+    latencies, statuses = [], {}
+
+    async def user():
+        while queue:
+            question = queue.pop()
+            body = {"questions": [question]} if endpoint == "/batch" else {"question": question}
+            started = time.perf_counter()
+            try:
+                status, _ = await request("POST", endpoint, body)
+            except OSError:
+                status = "connection_error"
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(users)))
+    elapsed = time.perf_counter() - started
+    return {
+        "endpoint": endpoint,
+        "users": users,
+        "requests": len(questions),
+        "statuses": {str(k): v for k, v in sorted(statuses.items(), key=str)},
+        "latency_ms": _summarize([latency * 1000 for latency in latencies]),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "elapsed_s": round(elapsed, 3)
+    }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve the math agent over HTTP, or load test it.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="run the ASGI app with uvicorn")
+    serve.add_argument("--host", default=SERVER_HOST)
+    serve.add_argument("--port", type=int, default=SERVER_PORT)
+    serve.add_argument("--workers", type=int, default=SERVER_WORKERS)
+
+    test = commands.add_parser("loadtest", help="send concurrent requests and report latency and throughput")
+    test.add_argument("--url", default=f"http://127.0.0.1:{SERVER_PORT}", help="server to load test")
+    test.add_argument("--offline", action="store_true",
+                      help="drive the app in-process with the benchmark's offline stand-ins instead of --url")
+    test.add_argument("--endpoint", default="/answer", choices=["/answer", "/stream", "/batch"])
+    test.add_argument("--users", type=int, default=100, help="concurrent clients")
+    test.add_argument("--requests", type=int, default=500)
+    test.add_argument("--max-concurrency", type=int, default=SERVER_MAX_CONCURRENCY, help="offline only")
+    test.add_argument("--max-queue", type=int, default=SERVER_MAX_QUEUE, help="offline only")
+    test.add_argument("--queue-timeout", type=float, default=SERVER_QUEUE_TIMEOUT, help="offline only")
+    test.add_argument("--web-latency", type=float, default=0.4, help="offline Tavily latency (s)")
+    test.add_argument("--llm-latency", type=float, default=0.5, help="offline Groq time to first token (s)")
+    test.add_argument("--seed", type=int, default=0)
+    test.add_argument("--questions", help="file with one question per line (default: generated)")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        try:
+            import uvicorn
+        except ImportError:
+            print("Serving needs uvicorn: pip install uvicorn")
+            return 1
+        uvicorn.run("server:app", host=args.host, port=args.port, workers=args.workers, lifespan="on")
+        return 0
+
+    benchmark = None
+    if args.offline:
+        service, questions, benchmark = _offline_service(args)
+        request = lambda method, path, body: _asgi_request(service, method, path, body)
+    else:
+        questions = [f"Solve question {i} about quadratic equations" for i in range(args.requests)]
+        request = lambda method, path, body: _http_request(args.url, method, path, body)
+    if args.questions:
+        with open(args.questions, 'r') as f:
+            lines = [line.strip() for line in f if line.strip()]
+        questions = [lines[i % len(lines)] for i in range(args.requests)]
+    try:
+        report = asyncio.run(loadtest(request, questions, args.users, args.endpoint))
+    finally:
+        if benchmark is not None:
+            benchmark.close()
+    print(json.dumps(report, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+#singleflight.py
+import os
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, Hashable, Iterator, List, Tuple
+
+from metrics import metrics
+
+# Identical concurrent calls share one computation instead of each running it
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() in ("1", "true", "yes")
+
+metrics.describe("singleflight_calls", "Coalescable calls by operation and role (leader ran it, follower shared it)")
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller (the leader) runs the
+    computation and callers arriving while it is in flight (followers) wait for and share
+    its result or exception. Works across threads (``do``, ``stream``) and from coroutines
+    (``do_async``), on one shared set of in-flight calls. Nothing is kept once a call
+    finishes; later calls with the same key run again.
+    """
+    def __init__(self, name: str, enabled: bool = SINGLEFLIGHT_ENABLED):
+        self.name = name
+        self.enabled = enabled
+        self._calls: Dict[Hashable, Any] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn, *args) -> Tuple[Any, bool]:
+        """Return ``(fn(*args), shared)``, where ``shared`` is True for a follower."""
+        if not self.enabled:
+            return fn(*args), False
+        future, leader = self._join(key, Future)
+        if not leader:
+            return future.result(), True
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            self._leave(key, future)
+        return result, False
+
+    async def do_async(self, key: Hashable, coroutine_fn, *args) -> Tuple[Any, bool]:
+        """Async variant of ``do``; followers may be threads or other tasks."""
+        if not self.enabled:
+            return await coroutine_fn(*args), False
+        future, leader = self._join(key, Future)
+        if not leader:
+            # Shielded so a cancelled follower does not cancel the shared call
+            return await asyncio.shield(asyncio.wrap_future(future)), True
+        try:
+            result = await coroutine_fn(*args)
+        except asyncio.CancelledError:
+            future.set_exception(RuntimeError(f"Coalesced {self.name} call was cancelled"))
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            self._leave(key, future)
+        return result, False
+
+    def stream(self, key: Hashable, fn, *args) -> Tuple[Iterator, bool]:
+        """
+        Share the items of the iterator ``fn(*args)``. Every caller gets an iterator over
+        all items from the first one, at its own pace; whichever caller needs the next item
+        first pulls it from the source, so a slow or abandoned reader never stalls the rest.
+        Readers that stop early should ``close()`` their iterator (dropping it also works);
+        when the last one does, the source is closed and the call is forgotten.
+        """
+        if not self.enabled:
+            return iter(fn(*args)), False
+        broadcast, leader = self._join(key, lambda: _Broadcast(fn, args), enter=_Broadcast.add_reader)
+        broadcast.on_done = lambda: self._leave(key, broadcast)
+        return _Reader(broadcast, lambda: self._release(key, broadcast)), not leader
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def _join(self, key: Hashable, factory, enter=None) -> Tuple[Any, bool]:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = factory()
+            if enter is not None:
+                enter(call)
+        metrics.inc("singleflight_calls", operation=self.name, role="leader" if leader else "follower")
+        return call, leader
+
+    def _leave(self, key: Hashable, call):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+    def _release(self, key: Hashable, broadcast: "_Broadcast"):
+        """A stream reader is done; the last one closes the source."""
+        with self._lock:
+            broadcast.readers -= 1
+            if broadcast.readers:
+                return
+            # Under the lock, so no new reader can join a stream that is being closed
+            if self._calls.get(key) is broadcast:
+                del self._calls[key]
+        broadcast.close()
+
+class _Broadcast:
+    """Items of one source iterator, created on first use, replayed to any number of readers."""
+    def __init__(self, fn, args: tuple):
+        self.fn = fn
+        self.args = args
+        self.source = None
+        self.items: List = []
+        self.done = False
+        self.error = None
+        self.on_done = None
+        self.readers = 0
+        self._pulling = False
+        self._condition = threading.Condition()
+
+    def add_reader(self):
+        self.readers += 1
+
+    def get(self, position: int):
+        """Item ``position``, pulling from the source if nobody has yet; StopIteration at the end."""
+        while True:
+            with self._condition:
+                while position >= len(self.items) and not self.done and self._pulling:
+                    self._condition.wait()
+                if position < len(self.items):
+                    return self.items[position]
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    raise StopIteration
+                self._pulling = True
+            self._pull()
+
+    def close(self):
+        """Stop early: close the source (e.g. a provider stream) if it is still open."""
+        with self._condition:
+            if self.done:
+                return
+            self.done = True
+            source, self.source = self.source, None
+            self._condition.notify_all()
+        close = getattr(source, "close", None)
+        if close is not None:
+            close()
+
+    def _pull(self):
+        """Advance the source by one item; only one reader does this at a time."""
+        end = object()
+        try:
+            if self.source is None:
+                self.source = iter(self.fn(*self.args))
+            item, error = next(self.source, end), None
+        except Exception as e:
+            item, error = end, e
+        with self._condition:
+            self._pulling = False
+            if item is end:
+                self.done, self.error = True, error
+            else:
+                self.items.append(item)
+            self._condition.notify_all()
+        if item is end and self.on_done is not None:
+            self.on_done()
+
+class _Reader:
+    """One caller's position in a _Broadcast; releases its place when closed or dropped."""
+    def __init__(self, broadcast: _Broadcast, release):
+        self.broadcast = broadcast
+        self.position = 0
+        self._release = release
+
+    def __iter__(self) -> Iterator:
+        return self
+
+    def __next__(self):
+        if self._release is None:
+            raise StopIteration
+        try:
+            item = self.broadcast.get(self.position)
+        except BaseException:
+            self.close()
+            raise
+        self.position += 1
+        return item
+
+    def close(self):
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,337 @@
+#solver.py
+import os
+import re
+import sys
+import time
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Dict, List, Optional, Tuple
+
+from metrics import metrics
+
+# Answer plain algebra/calculus questions with SymPy instead of retrieval and the LLM
+SOLVER_ENABLED = os.getenv("SOLVER_ENABLED", "true").lower() in ("1", "true", "yes")
+# Give up (and fall back to the normal route) if SymPy takes longer than this, in seconds
+SOLVER_TIMEOUT = float(os.getenv("SOLVER_TIMEOUT", 2))
+SOLVER_MAX_CHARS = int(os.getenv("SOLVER_MAX_CHARS", 200))
+# Expressions whose numbers could grow past this many digits (e.g. "9^9^9") are not attempted:
+# SymPy's big-integer arithmetic holds the GIL, so no timeout could interrupt it
+SOLVER_MAX_DIGITS = int(os.getenv("SOLVER_MAX_DIGITS", 10000))
+# Computations abandoned after a timeout that may still be running; past this many the solver is skipped
+SOLVER_MAX_ABANDONED = 4
+
+metrics.describe("solver_requests", "Questions seen by the symbolic solver by outcome")
+metrics.describe("solver_seconds", "Time to parse and solve a question symbolically",
+                 buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2, 5))
+
+# Functions and constants an expression may use; any other identifier must be a single-letter variable
+_FUNCTIONS = frozenset(
+    "sin cos tan cot sec csc asin acos atan sinh cosh tanh exp log ln sqrt abs pi oo".split()
+)
+_ALLOWED_CHARS = re.compile(r"[0-9a-z+\-*/^().,=! ]+")
+# Trailing "!" is punctuation unless it follows an operand, where it is a factorial ("what is 5!")
+_TRAILING_PUNCTUATION = re.compile(r"[ ?.]+$|(?<![0-9a-z)!])!+[ ?.!]*$")
+_IDENTIFIER = re.compile(r"[a-z]+")
+_REPLACEMENTS = {"²": "^2", "³": "^3", "×": "*", "·": "*", "÷": "/", "−": "-", "–": "-", "√": "sqrt ", "π": "pi",
+                 "∞": "oo", "infinity": "oo", "**": "^"}
+
+# (operation, pattern capturing the expression); checked in order, first match wins
+_INTENTS: List[Tuple[str, re.Pattern]] = [
+    ("limit", re.compile(r"^(?:find |compute |evaluate |what is )?(?:the )?lim(?:it)?(?: of)? (?P<expr>.+?) "
+                         r"as (?P<var>[a-z]) (?:->|→|approaches|tends to|goes to) (?P<point>[^ ]+)$")),
+    ("diff", re.compile(r"^(?:find |compute |what is )?(?:the )?(?P<order>second |2nd |third |3rd )?"
+                        r"(?:derivative of|differentiate|d/d(?P<dvar>[a-z])(?: of)?) (?P<expr>.+?)"
+                        r"(?: with respect to (?P<var>[a-z]))?$")),
+    ("integrate", re.compile(r"^(?:find |compute |evaluate |what is )?(?:the )?(?:integrate|integral of|"
+                             r"antiderivative of|indefinite integral of|definite integral of) (?P<expr>.+?)"
+                             r"(?: from (?P<lower>[^ ]+) to (?P<upper>[^ ]+))?$")),
+    ("factor", re.compile(r"^(?:factor|factorise|factorize) (?P<expr>.+)$")),
+    ("expand", re.compile(r"^(?:expand|multiply out) (?P<expr>.+)$")),
+    ("simplify", re.compile(r"^simplify (?P<expr>.+)$")),
+    ("solve", re.compile(r"^(?:solve|find the (?:roots|zeros|solutions?) (?:of|to)|find [a-z] (?:if|when|given)) "
+                         r"(?:the equations? )?(?P<expr>.+?)(?: for (?P<var>[a-z]))?$")),
+    ("evaluate", re.compile(r"^(?:evaluate|compute|calculate|what is|what's) (?P<expr>.+)$")),
+    # A bare equation such as "x^2 + 5x + 6 = 0"
+    ("solve", re.compile(r"^(?P<expr>[^a-z]*[a-z][^=]*=[^=]+)$")),
+]
+
+_pool: Optional[ThreadPoolExecutor] = None
+_abandoned: List = []
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="solver")
+        return _pool
+
+def _abandon(future):
+    """
+    Give up on a timed-out computation. Its thread cannot be stopped, so the pool it occupies
+    is retired and later questions get a fresh one.
+    """
+    global _pool
+    with _pool_lock:
+        _abandoned.append(future)
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+            _pool = None
+
+def _too_busy() -> bool:
+    with _pool_lock:
+        _abandoned[:] = [future for future in _abandoned if not future.done()]
+        return len(_abandoned) >= SOLVER_MAX_ABANDONED
+
+def warm_up():
+    """Import SymPy in the background so the first solved question does not pay for it."""
+    _get_pool().submit(__import__, "sympy")
+
+class UnsupportedQuestion(ValueError):
+    """The question is not one the solver can handle; route it normally."""
+
+class SymbolicSolver:
+    """
+    Detects questions a computer algebra system can answer exactly (solve, differentiate,
+    integrate, limits, factor/expand/simplify, arithmetic) and answers them with SymPy.
+
+    Only expressions made of numbers, operators, single-letter variables and a small set
+    of known functions are parsed; anything else is left to retrieval and the LLM.
+    Expressions that could produce numbers of more than ``SOLVER_MAX_DIGITS`` digits are
+    rejected before SymPy evaluates anything. SymPy runs on a worker thread with a
+    ``timeout``: a runaway computation is abandoned (the thread finishes in the background)
+    and the question falls back to the normal route.
+    """
+    def __init__(self, timeout: float = SOLVER_TIMEOUT, max_chars: int = SOLVER_MAX_CHARS):
+        self.timeout = timeout
+        self.max_chars = max_chars
+
+    def solve(self, query: str) -> Optional[Dict]:
+        """
+        Return a context item with the exact ``answer`` (Markdown with LaTeX), or None if
+        the question is not a supported symbolic problem or could not be solved in time.
+        """
+        started = time.perf_counter()
+        outcome = "solved"
+        try:
+            intent = self.classify(query)
+            if intent is None:
+                outcome = "unsupported"
+                return None
+            if _too_busy():
+                outcome = "busy"
+                return None
+            future = _get_pool().submit(self._compute, *intent)
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeout:
+                _abandon(future)
+                raise
+        except FutureTimeout:
+            outcome = "timeout"
+            return None
+        except UnsupportedQuestion:
+            outcome = "unsupported"
+            return None
+        except Exception as e:
+            outcome = "error"
+            print(f"Error solving symbolically: {e}")
+            return None
+        finally:
+            metrics.inc("solver_requests", outcome=outcome)
+            if outcome not in ("unsupported", "busy"):
+                metrics.observe("solver_seconds", time.perf_counter() - started)
+
+    def classify(self, query: str) -> Optional[Tuple[str, Dict[str, str]]]:
+        """(operation, captured parts) if the question looks like a symbolic problem."""
+        text = query.strip().lower()
+        if not text or len(text) > self.max_chars:
+            return None
+        for old, new in _REPLACEMENTS.items():
+            text = text.replace(old, new)
+        text = _TRAILING_PUNCTUATION.sub("", re.sub(r"\s+", " ", text))
+        for operation, pattern in _INTENTS:
+            match = pattern.match(text)
+            if match is None:
+                continue
+            parts = {k: v for k, v in match.groupdict().items() if v}
+            parts["expr"] = re.sub(r"^(?:the )?(?:expression |equation |function )?", "", parts["expr"])
+            if operation == "integrate":
+                parts["expr"] = re.sub(r"\s*d[a-z]$", "", parts["expr"])
+            if all(self._is_math(v) for k, v in parts.items() if k not in ("order",)):
+                return operation, parts
+        return None
+
+    @staticmethod
+    def _is_math(text: str) -> bool:
+        if not _ALLOWED_CHARS.fullmatch(text):
+            return False
+        return all(len(name) == 1 or name in _FUNCTIONS for name in _IDENTIFIER.findall(text))
+
+    def _compute(self, operation: str, parts: Dict[str, str]) -> Dict:
+        # Imported here so the app starts without paying for SymPy
+        import sympy
+
+        if operation == "solve":
+            equations = [self._equation(e) for e in re.split(r",| and ", parts["expr"]) if e.strip()]
+            variables = self._variables(equations, parts.get("var"))
+            solutions = sympy.solve(equations if len(equations) > 1 else equations[0], variables, dict=True)
+            statement = ", ".join(sympy.latex(e) for e in equations)
+            if not solutions:
+                answer = f"${statement}$ has no solutions."
+            else:
+                lines = []
+                for solution in solutions:
+                    lines.append(", ".join(f"${sympy.latex(v)} = {sympy.latex(s)}${self._approx(s)}"
+                                           for v, s in solution.items()))
+                answer = f"Solutions of ${statement}$:\n\n" + "\n\n".join(f"* {line}" for line in lines)
+            return self._result(operation, answer, f"solve({', '.join(sympy.sstr(e) for e in equations)})")
+
+        expr = self._parse(parts["expr"])
+        var = self._variables([expr], parts.get("var") or parts.get("dvar"))
+        var = var[0] if var else sympy.Symbol("x")
+
+        if operation == "diff":
+            order = {"second": 2, "2nd": 2, "third": 3, "3rd": 3}.get(parts.get("order", "").strip(), 1)
+            value = sympy.simplify(sympy.diff(expr, var, order))
+            notation = f"\\frac{{d{'^' + str(order) if order > 1 else ''}}}{{d{var}{'^' + str(order) if order > 1 else ''}}}"
+            answer = f"${notation}\\left({sympy.latex(expr)}\\right) = {sympy.latex(value)}$"
+        elif operation == "integrate":
+            if "lower" in parts:
+                lower, upper = self._parse(parts["lower"]), self._parse(parts["upper"])
+                value = sympy.integrate(expr, (var, lower, upper))
+                answer = (f"$\\int_{{{sympy.latex(lower)}}}^{{{sympy.latex(upper)}}} {sympy.latex(expr)}\\,d{var}"
+                          f" = {sympy.latex(value)}${self._approx(value)}")
+            else:
+                value = sympy.integrate(expr, var)
+                if value.has(sympy.Integral):
+                    raise UnsupportedQuestion("no closed form")
+                answer = f"$\\int {sympy.latex(expr)}\\,d{var} = {sympy.latex(value)} + C$"
+        elif operation == "limit":
+            point = self._parse(parts["point"])
+            value = sympy.limit(expr, var, point)
+            answer = (f"$\\lim_{{{var} \\to {sympy.latex(point)}}} {sympy.latex(expr)} = {sympy.latex(value)}$"
+                      f"{self._approx(value)}")
+        elif operation in ("factor", "expand", "simplify"):
+            value = getattr(sympy, operation)(expr)
+            answer = f"${sympy.latex(expr)} = {sympy.latex(value)}$"
+        else:
+            if expr.free_symbols:
+                raise UnsupportedQuestion("expression has free variables")
+            value = sympy.simplify(expr)
+            if not value.is_finite:
+                raise UnsupportedQuestion("result is not a finite number")
+            shown = self._parse(parts["expr"], evaluate=False)
+            answer = f"${sympy.latex(shown)} = {sympy.latex(value)}${self._approx(value)}"
+        if value.has(sympy.zoo, sympy.nan):
+            # Undefined (e.g. a pole); better answered in words than as "zoo"
+            raise UnsupportedQuestion("result is undefined")
+        return self._result(operation, answer, f"{operation}({sympy.sstr(expr)})")
+
+    def _parse(self, text: str, evaluate: bool = True):
+        from sympy import E, Symbol, Abs, log, oo, factorial, factorial2
+        from sympy.parsing.sympy_parser import (parse_expr, standard_transformations,
+                                                implicit_multiplication_application, convert_xor)
+
+        if not self._is_math(text) or "=" in text:
+            raise UnsupportedQuestion(f"cannot parse '{text}'")
+        # Single letters are always variables (except e), so "xy" cannot turn into a sympy name
+        local_dict = {name: Symbol(name) for name in set(_IDENTIFIER.findall(text)) if len(name) == 1}
+        local_dict.update({"e": E, "ln": log, "abs": Abs, "oo": oo})
+        transformations = standard_transformations + (implicit_multiplication_application, convert_xor)
+        # evaluate=False leaves function calls alone, so factorials need telling not to evaluate
+        unevaluated = dict(local_dict, factorial=lambda n: factorial(n, evaluate=False),
+                           factorial2=lambda n: factorial2(n, evaluate=False))
+        try:
+            # Parsed unevaluated first, so its size can be checked before any arithmetic happens
+            expr = parse_expr(text, local_dict=unevaluated, transformations=transformations, evaluate=False)
+            if _digits(expr) > SOLVER_MAX_DIGITS:
+                raise UnsupportedQuestion(f"'{text}' may be too large to compute")
+            if not evaluate:
+                return expr
+            return parse_expr(text, local_dict=local_dict, transformations=transformations)
+        except UnsupportedQuestion:
+            raise
+        except Exception as e:
+            raise UnsupportedQuestion(f"cannot parse '{text}': {e}")
+
+    def _equation(self, text: str):
+        import sympy
+
+        if text.count("=") > 1:
+            raise UnsupportedQuestion("chained equation")
+        if "=" in text:
+            left, right = text.split("=")
+            return sympy.Eq(self._parse(left.strip()), self._parse(right.strip()))
+        return sympy.Eq(self._parse(text.strip()), 0)
+
+    @staticmethod
+    def _variables(expressions, requested: Optional[str]) -> List:
+        import sympy
+
+        if requested:
+            return [sympy.Symbol(requested)]
+        symbols = set().union(*(e.free_symbols for e in expressions))
+        # Prefer the usual unknowns when several letters appear
+        return sorted(symbols, key=lambda s: (s.name not in ("x", "y", "z", "t"), s.name))
+
+    @staticmethod
+    def _approx(value) -> str:
+        """`` ≈ 1.41421`` for irrational or otherwise inexact numeric results."""
+        import sympy
+
+        try:
+            if value.free_symbols or value.is_Rational or value.is_Float or not value.is_real:
+                return ""
+            return f" ≈ {sympy.N(value, 6)}"
+        except Exception:
+            return ""
+
+    @staticmethod
+    def _result(operation: str, answer: str, interpretation: str) -> Dict:
+        return {
+            "text": f"Computed exactly with SymPy as {interpretation}",
+            "title": "Symbolic solver",
+            "answer": answer,
+            "operation": operation,
+            "score": 1.0
+        }
+
+def _digits(expr) -> float:
+    """
+    Rough upper bound on log10 of the size of any number ``expr`` can evaluate to
+    (variables count as at most 10), computed on the unevaluated expression tree.
+    """
+    if expr.is_Integer or expr.is_Rational:
+        return math.log10(max(abs(expr.p), expr.q, 1))
+    if expr.is_Float:
+        return max(0.0, math.log10(abs(float(expr)) or 1))
+    if expr.is_Atom:
+        return 1.0
+    args = [_digits(arg) for arg in expr.args]
+    if expr.is_Pow:
+        base, exponent = args
+        if exponent > 7:
+            return math.inf  # exponents beyond ten million (including power towers)
+        return max(base, 1.0) * 10 ** exponent
+    if expr.func.__name__ in ("exp", "sinh", "cosh"):
+        return math.inf if args[0] > 7 else 10 ** args[0]
+    if expr.func.__name__ in ("factorial", "factorial2"):
+        # n! < n^n, so it has at most n * log10(n) digits
+        return math.inf if args[0] > 7 else 10 ** args[0] * max(args[0], 1.0)
+    if expr.is_Mul:
+        return sum(args)
+    return max(args, default=0.0) + 1
+
+def main(argv: List[str]):
+    """Print how each question would be answered by the solver."""
+    solver = SymbolicSolver()
+    for question in argv or ["solve x^2 + 5x + 6 = 0", "differentiate sin(x)x^2"]:
+        started = time.perf_counter()
+        result = solver.solve(question)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"{question!r} ({elapsed:.1f}ms): {result['answer'] if result else 'not handled'}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
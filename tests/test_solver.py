@@ -0,0 +1,36 @@
+#tests/test_solver.py
+import pytest
+
+pytest.importorskip("sympy")
+
+from solver import SymbolicSolver
+
+@pytest.fixture(scope="module")
+def solver():
+    return SymbolicSolver(timeout=10)
+
+@pytest.mark.parametrize("question, answer", [
+    ("what is 5!", "$5! = 120$"),
+    ("calculate 4!?", "$4! = 24$"),
+    ("what is 10!/8!", "$\\frac{10!}{8!} = 90$"),
+    ("what is 2^2^2", "$2^{2^{2}} = 16$"),
+    ("integrate x^2 from 0 to 1", "$\\int_{0}^{1} x^{2}\\,dx = \\frac{1}{3}$"),
+])
+def test_exact_answers(solver, question, answer):
+    assert solver.solve(question)["answer"] == answer
+
+def test_trailing_punctuation_is_not_a_factorial(solver):
+    assert solver.classify("what is 5?")[1]["expr"] == "5"
+    assert solver.classify("hello!") is None
+
+@pytest.mark.parametrize("question", [
+    "what is 9^9^9",          # too large to compute
+    "what is 100000000!",
+    "what is exp(10^10)",
+    "what is 1/0",            # undefined
+    "what is 0/0",
+    "what is x + 1",          # free variable
+    "who proved fermat's last theorem",
+])
+def test_declined_questions(solver, question):
+    assert solver.solve(question) is None
@@ -0,0 +1,106 @@
+#tests/test_vector_store.py
+import numpy as np
+import pytest
+
+from vector_store import LocalVectorIndex, matches_filter
+
+def _vector(vector_id, values, **metadata):
+    return {"id": vector_id, "values": values, "metadata": metadata}
+
+@pytest.fixture
+def index(tmp_path):
+    index = LocalVectorIndex(str(tmp_path / "index"), dimension=3)
+    index.upsert([
+        _vector("x", [1, 0, 0], source="A.pdf", page=1, namespace="mathematics"),
+        _vector("y", [0, 1, 0], source="A.pdf", page=2, namespace="mathematics"),
+        _vector("z", [1, 1, 0], source="B.pdf", page=1, namespace="physics"),
+    ])
+    return index
+
+def test_query_ranks_by_cosine_similarity(index):
+    matches = index.query(vector=[2, 0, 0], top_k=3).matches
+    assert [m.id for m in matches] == ["x", "z", "y"]
+    assert matches[0].score == pytest.approx(1.0)
+    assert matches[1].score == pytest.approx(1 / np.sqrt(2))
+    assert matches[2].score == pytest.approx(0.0)
+    assert matches[0].metadata["source"] == "A.pdf"
+
+def test_query_limits_top_k_and_metadata(index):
+    matches = index.query(vector=[0, 1, 0], top_k=1, include_metadata=False).matches
+    assert [m.id for m in matches] == ["y"]
+    assert matches[0].metadata == {}
+
+def test_query_on_empty_index(tmp_path):
+    index = LocalVectorIndex(str(tmp_path / "empty"), dimension=3)
+    assert index.query(vector=[1, 0, 0], top_k=3).matches == []
+
+def test_upsert_replaces_existing_ids(index):
+    index.upsert([_vector("x", [0, 0, 1], source="C.pdf")])
+    assert index.describe_index_stats()["total_vector_count"] == 3
+    top = index.query(vector=[0, 0, 1], top_k=1).matches[0]
+    assert top.id == "x"
+    assert top.metadata == {"source": "C.pdf"}
+
+def test_upsert_rejects_wrong_dimension(index):
+    with pytest.raises(ValueError):
+        index.upsert([_vector("w", [1, 0])])
+
+def test_delete(index):
+    index.delete(ids=["x", "missing"])
+    assert index.describe_index_stats()["total_vector_count"] == 2
+    assert [m.id for m in index.query(vector=[1, 0, 0], top_k=3).matches] == ["z", "y"]
+
+def test_filtered_query_scans_matching_rows_only(index):
+    matches = index.query(vector=[1, 0, 0], top_k=3, filter={"namespace": "mathematics"}).matches
+    assert [m.id for m in matches] == ["x", "y"]
+    matches = index.query(vector=[1, 0, 0], top_k=3, filter={"namespace": {"$in": ["physics"]}}).matches
+    assert [m.id for m in matches] == ["z"]
+    assert index.query(vector=[1, 0, 0], top_k=3, filter={"namespace": "chemistry"}).matches == []
+
+def test_filter_cache_is_invalidated_by_mutations(index):
+    query = {"vector": [1, 0, 0], "top_k": 3, "filter": {"source": "A.pdf"}}
+    assert len(index.query(**query).matches) == 2
+    index.upsert([_vector("w", [1, 0, 1], source="A.pdf")])
+    assert len(index.query(**query).matches) == 3
+    index.delete(ids=["x"])
+    assert [m.id for m in index.query(**query).matches] == ["w", "y"]
+
+def test_fetch(index):
+    vectors = index.fetch(ids=["y", "missing"]).vectors
+    assert list(vectors) == ["y"]
+    assert vectors["y"].metadata["page"] == 2
+    assert vectors["y"].values == pytest.approx([0, 1, 0])
+
+def test_persist_and_reload(index, tmp_path):
+    index.persist()
+    reloaded = LocalVectorIndex(str(tmp_path / "index"), dimension=3)
+    assert reloaded.describe_index_stats() == {"total_vector_count": 3, "dimension": 3}
+    assert [m.id for m in reloaded.query(vector=[1, 1, 0], top_k=1).matches] == ["z"]
+    # The reloaded matrix is memory-mapped read-only; writes must still work
+    reloaded.upsert([_vector("w", [0, 0, 1])])
+    reloaded.delete(ids=["x"])
+    assert [m.id for m in reloaded.query(vector=[0, 0, 1], top_k=1).matches] == ["w"]
+
+def test_ann_index_type_without_its_library_still_answers(tmp_path):
+    index = LocalVectorIndex(str(tmp_path / "ivf"), dimension=3, index_type="ivf")
+    index.upsert([_vector("x", [1, 0, 0]), _vector("y", [0, 1, 0])])
+    assert index.query(vector=[0, 1, 0], top_k=1).matches[0].id == "y"
+
+@pytest.mark.parametrize("metadata_filter, expected", [
+    ({}, True),
+    ({"topic": "calculus"}, True),
+    ({"topic": {"$ne": "calculus"}}, False),
+    ({"page": {"$gte": 3, "$lt": 5}}, True),
+    ({"page": {"$gt": 4}}, False),
+    ({"topic": {"$nin": ["algebra", "geometry"]}}, True),
+    ({"doc_type": {"$exists": False}}, True),
+    ({"$or": [{"topic": "algebra"}, {"page": 4}]}, True),
+    ({"$and": [{"topic": "calculus"}, {"page": 5}]}, False),
+    ({"missing": {"$gt": 1}}, False),
+])
+def test_matches_filter(metadata_filter, expected):
+    assert matches_filter({"topic": "calculus", "page": 4}, metadata_filter) is expected
+
+def test_matches_filter_rejects_unknown_operators():
+    with pytest.raises(ValueError):
+        matches_filter({"page": 1}, {"page": {"$regex": "1"}})
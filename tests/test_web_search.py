@@ -0,0 +1,149 @@
+#tests/test_web_search.py
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from web_search import WebSearch
+
+class StubTavily:
+    """Local stand-in for the Tavily endpoint, replying with scripted responses in order."""
+    def __init__(self):
+        self.requests = []
+        self.responses = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.requests.append({"headers": dict(self.headers), "body": body})
+                status, payload, headers, delay = stub.responses.pop(0) if stub.responses else (200, {"results": []}, {}, 0)
+                time.sleep(delay)
+                data = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # The client timed out and went away
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/search"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def reply(self, status=200, payload=None, headers=None, delay=0.0):
+        self.responses.append((status, payload if payload is not None else {"results": []}, headers or {}, delay))
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+RESULTS = {"results": [
+    {"title": "Quadratic formula", "content": "x = (-b ± sqrt(b^2 - 4ac)) / 2a",
+     "url": "https://mathworld.wolfram.com/QuadraticFormula.html", "score": 0.92},
+    {"title": "Factoring", "content": "x^2 + 5x + 6 = (x + 2)(x + 3)",
+     "url": "https://math.stackexchange.com/questions/1", "score": 0.81},
+]}
+
+@pytest.fixture
+def tavily(monkeypatch):
+    monkeypatch.setenv("TAVILY_API_KEY", "test-key")
+    stub = StubTavily()
+    yield stub
+    stub.close()
+
+def _client(tavily, **options):
+    settings = {"base_url": tavily.url, "backoff_base": 0.01, "cache_ttl": 0, "timeout": 2, "deadline": 5}
+    settings.update(options)
+    return WebSearch(**settings)
+
+def test_search_formats_results(tavily):
+    tavily.reply(payload=RESULTS)
+    results = _client(tavily).search("solve x^2 + 5x + 6 = 0", max_results=2)
+
+    assert [r["title"] for r in results] == ["Quadratic formula", "Factoring"]
+    assert results[0]["text"].startswith("x = ")
+    assert results[0]["domain"] == "mathworld.wolfram.com"
+    assert results[1]["score"] == 0.81
+    request = tavily.requests[0]
+    assert request["headers"]["Authorization"] == "Bearer test-key"
+    assert request["body"]["query"].endswith("solve x^2 + 5x + 6 = 0")
+    assert request["body"]["max_results"] == 2
+    assert "math.stackexchange.com" in request["body"]["include_domains"]
+
+def test_identical_searches_are_cached(tavily):
+    tavily.reply(payload=RESULTS)
+    search = _client(tavily, cache_ttl=60)
+    first = search.search("pythagorean theorem")
+    first[0]["title"] = "changed by the caller"
+    second = search.search("pythagorean theorem")
+
+    assert len(tavily.requests) == 1
+    assert second[0]["title"] == "Quadratic formula"
+
+def test_server_errors_are_retried(tavily):
+    tavily.reply(503)
+    tavily.reply(502)
+    tavily.reply(payload=RESULTS)
+    results = _client(tavily).search("limits")
+
+    assert len(tavily.requests) == 3
+    assert results[0]["title"] == "Quadratic formula"
+
+def test_client_errors_are_not_retried(tavily):
+    tavily.reply(400, {"error": "bad request"})
+    search = _client(tavily)
+    results = search.search("limits")
+
+    assert len(tavily.requests) == 1
+    assert results[0]["title"] == "Search Error"
+    assert "400" in results[0]["text"]
+    assert search.circuit_breaker.failures == 0
+
+def test_read_timeouts_are_not_retried(tavily):
+    tavily.reply(payload=RESULTS, delay=1.0)
+    started = time.monotonic()
+    results = _client(tavily, timeout=0.2).search("integrals")
+
+    assert time.monotonic() - started < 0.9
+    assert len(tavily.requests) == 1
+    assert results[0]["title"] == "Search Error"
+
+def test_retries_stop_at_the_deadline(tavily):
+    for _ in range(4):
+        tavily.reply(503, headers={"Retry-After": "2"})
+    started = time.monotonic()
+    results = _client(tavily, deadline=1).search("series")
+
+    # Waiting out Retry-After would pass the deadline, so the 503 is final
+    assert time.monotonic() - started < 1
+    assert len(tavily.requests) == 1
+    assert results[0]["title"] == "Search Error"
+
+def test_circuit_opens_after_repeated_failures(tavily):
+    search = _client(tavily, max_retries=0)
+    for _ in range(search.circuit_breaker.failure_threshold):
+        tavily.reply(500)
+        search.search("vectors")
+    results = search.search("vectors")
+
+    assert search.circuit_breaker.state == "open"
+    assert len(tavily.requests) == search.circuit_breaker.failure_threshold
+    assert "temporarily unavailable" in results[0]["text"]
+
+def test_missing_api_key_disables_search(tavily, monkeypatch):
+    monkeypatch.delenv("TAVILY_API_KEY")
+    results = _client(tavily).search("matrices")
+
+    assert results[0]["title"] == "API Key Not Found"
+    assert tavily.requests == []
@@ -0,0 +1,256 @@
+#tuning.py
+import os
+import json
+import time
+import argparse
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+ROUTING_MODEL_VERSION = 1
+# Artifact written by the tuning job and hot-loaded by Router
+ROUTER_MODEL_PATH = os.getenv("ROUTER_MODEL_PATH", ".router_model.json")
+# How often Router checks the artifact for changes, seconds
+ROUTER_MODEL_CHECK_INTERVAL = float(os.getenv("ROUTER_MODEL_CHECK_INTERVAL", 30))
+
+# A threshold (or a document's threshold) is only learned from at least this many rated KB answers
+TUNING_MIN_SAMPLES = int(os.getenv("TUNING_MIN_SAMPLES", 20))
+# KB answers may be this much less helpful than web answers before the threshold is raised
+TUNING_TOLERANCE = float(os.getenv("TUNING_TOLERANCE", 0.05))
+TUNING_MIN_THRESHOLD = 0.4
+# A threshold is only chosen if its TUNING_MIN_SAMPLES marginal KB answers all score within this of it,
+# so it never drops further below the lowest rated KB scores than this in one run
+TUNING_MAX_STEP = float(os.getenv("TUNING_MAX_STEP", 0.05))
+TUNING_MAX_THRESHOLD = 0.95
+# Re-ranker: per-chunk score adjustments stay within +/- this, smoothed with this many pseudo-ratings
+RERANK_MAX_BOOST = float(os.getenv("RERANK_MAX_BOOST", 0.05))
+RERANK_PRIOR_WEIGHT = 10
+
+class RoutingModel:
+    """
+    Learned routing parameters: a default KB similarity threshold, per-document
+    thresholds, and score boosts for chunks ("file.pdf#page") and documents that
+    re-rank KB results.
+    """
+    def __init__(self,
+                 default_threshold: float,
+                 source_thresholds: Optional[Dict[str, float]] = None,
+                 boosts: Optional[Dict[str, float]] = None,
+                 created_at: Optional[str] = None,
+                 report: Optional[Dict] = None):
+        self.default_threshold = default_threshold
+        self.source_thresholds = source_thresholds or {}
+        self.boosts = boosts or {}
+        self.created_at = created_at or datetime.now().isoformat()
+        self.report = report or {}
+
+    def threshold_for(self, source: Optional[str]) -> float:
+        return self.source_thresholds.get(source or "", self.default_threshold)
+
+    def rerank(self, kb_results: List[Tuple]) -> List[Tuple]:
+        """Apply chunk/document boosts to (Document, score) results and re-sort them."""
+        if not self.boosts:
+            return kb_results
+        reranked = []
+        for doc, score in kb_results:
+            source = doc.metadata.get("source", "")
+            boost = self.boosts.get(f"{source}#{doc.metadata.get('page', '')}", self.boosts.get(source, 0.0))
+            reranked.append((doc, min(1.0, max(0.0, score + boost))))
+        return sorted(reranked, key=lambda item: item[1], reverse=True)
+
+    def to_dict(self) -> Dict:
+        return {"version": ROUTING_MODEL_VERSION, "created_at": self.created_at,
+                "default_threshold": self.default_threshold, "source_thresholds": self.source_thresholds,
+                "boosts": self.boosts, "report": self.report}
+
+    def save(self, path: str = ROUTER_MODEL_PATH):
+        """Atomically write the artifact, so a Router never reads a partial file."""
+        with open(path + ".tmp", 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str = ROUTER_MODEL_PATH) -> Optional["RoutingModel"]:
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Ignoring unreadable routing model {path}: {e}")
+            return None
+        if data.get("version") != ROUTING_MODEL_VERSION:
+            return None
+        return cls(data["default_threshold"], data.get("source_thresholds"), data.get("boosts"),
+                   data.get("created_at"), data.get("report"))
+
+class ModelWatcher:
+    """Returns the routing model at ``path``, reloading it when the file changes."""
+    def __init__(self, path: Optional[str] = ROUTER_MODEL_PATH, check_interval: float = ROUTER_MODEL_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._model: Optional[RoutingModel] = None
+        self._mtime = None
+        self._checked_at = float("-inf")
+
+    def get(self) -> Optional[RoutingModel]:
+        if not self.path:
+            return None
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime != self._mtime:
+                self._mtime = mtime
+                self._model = RoutingModel.load(self.path) if mtime is not None else None
+        return self._model
+
+def _rate(outcomes: List[bool]) -> float:
+    return sum(outcomes) / len(outcomes) if outcomes else 0.0
+
+def _upper_bound(outcomes: List[bool], z: float = 1.0) -> float:
+    """Wilson score upper bound of the helpful rate (z=1: about 84% one-sided)."""
+    n = len(outcomes)
+    if not n:
+        return 1.0
+    p = _rate(outcomes)
+    centre = p + z * z / (2 * n)
+    margin = z * ((p * (1 - p) + z * z / (4 * n)) / n) ** 0.5
+    return (centre + margin) / (1 + z * z / n)
+
+def _choose_threshold(observations: List[Tuple[float, bool]], target: float, min_samples: int) -> Optional[float]:
+    """
+    Lowest threshold whose marginal KB answers are still good enough.
+
+    Scanning down from the top, a threshold t is rejected once the ``min_samples``
+    lowest-scoring KB answers at or above t are confidently less helpful than ``target``
+    (the upper bound of their helpful rate is below it). The scan stops there, so a bad
+    score band is never hidden by good answers below it. A threshold is only chosen when
+    those answers lie within ``TUNING_MAX_STEP`` of it: there is evidence for the band it
+    opens up. None if there is not enough data.
+    """
+    best = None
+    for step in range(int(TUNING_MAX_THRESHOLD * 100), int(TUNING_MIN_THRESHOLD * 100) - 1, -1):
+        t = step / 100
+        above = sorted((score, helpful) for score, helpful in observations if score >= t)
+        if len(above) < min_samples or above[min_samples - 1][0] >= t + TUNING_MAX_STEP:
+            continue
+        if _upper_bound([helpful for _, helpful in above[:min_samples]]) < target:
+            break
+        best = t
+    return best
+
+def fit(entries: Iterable[Dict],
+        default_threshold: float = 0.7,
+        min_samples: int = TUNING_MIN_SAMPLES,
+        tolerance: float = TUNING_TOLERANCE) -> RoutingModel:
+    """
+    Learn a RoutingModel from feedback entries that carry their routing decision
+    (``route``: source, KB scores and sources at routing time).
+
+    KB answers must be about as helpful as web answers (within ``tolerance``); the
+    threshold is lowered as far as that holds, which sends fewer queries to web search,
+    and raised where KB answers near it fall short. Chunk/document boosts come from the
+    smoothed helpfulness of answers whose context included them.
+    """
+    kb_observations: List[Tuple[float, bool]] = []
+    by_document: Dict[str, List[Tuple[float, bool]]] = {}
+    web_outcomes: List[bool] = []
+    web_kb_scores: List[Tuple[float, Optional[str]]] = []
+    chunk_outcomes: Dict[str, List[bool]] = {}
+    used = 0
+
+    for entry in entries:
+        route = entry.get("route") or {}
+        helpful = bool(entry.get("is_helpful"))
+        kb_scores = route.get("kb_scores") or []
+        kb_sources = route.get("kb_sources") or []
+        if route.get("source") == "kb" and kb_scores:
+            used += 1
+            top_source = kb_sources[0] if kb_sources else None
+            kb_observations.append((kb_scores[0], helpful))
+            if top_source:
+                by_document.setdefault(top_source, []).append((kb_scores[0], helpful))
+            for item in entry.get("context", []):
+                if item.get("source"):
+                    for key in (item["source"], f"{item['source']}#{item.get('page', '')}"):
+                        chunk_outcomes.setdefault(key, []).append(helpful)
+        elif route.get("source") == "web":
+            used += 1
+            web_outcomes.append(helpful)
+            if kb_scores:
+                web_kb_scores.append((kb_scores[0], kb_sources[0] if kb_sources else None))
+
+    web_rate = _rate(web_outcomes) if len(web_outcomes) >= min_samples else None
+    kb_rate = _rate([helpful for _, helpful in kb_observations])
+    # Without enough web ratings to compare against, hold KB answers to their own overall rate
+    target = (web_rate if web_rate is not None else kb_rate) - tolerance
+
+    learned = _choose_threshold(kb_observations, target, min_samples)
+    threshold = learned if learned is not None else default_threshold
+    source_thresholds = {}
+    for source, observations in by_document.items():
+        document_threshold = _choose_threshold(observations, target, min_samples)
+        if document_threshold is not None and document_threshold != threshold:
+            source_thresholds[source] = document_threshold
+
+    # Documents are smoothed towards the overall KB rate and their chunks towards the document's
+    def smoothed(outcomes: List[bool], prior: float) -> float:
+        return (sum(outcomes) + RERANK_PRIOR_WEIGHT * prior) / (len(outcomes) + RERANK_PRIOR_WEIGHT)
+
+    document_rates = {key: smoothed(outcomes, kb_rate) for key, outcomes in chunk_outcomes.items() if "#" not in key}
+    boosts = {}
+    for key, outcomes in chunk_outcomes.items():
+        if len(outcomes) < 3:
+            continue
+        document = key.split("#", 1)[0]
+        rate = smoothed(outcomes, document_rates[document]) if "#" in key else document_rates[key]
+        boost = max(-RERANK_MAX_BOOST, min(RERANK_MAX_BOOST, rate - kb_rate))
+        if abs(boost) >= 0.005:
+            boosts[key] = round(boost, 4)
+
+    model = RoutingModel(round(threshold, 2), source_thresholds, boosts)
+    # Web-routed queries whose KB score now clears the threshold would skip Tavily
+    avoided = sum(1 for score, source in web_kb_scores if score >= model.threshold_for(source))
+    model.report = {
+        "entries_used": used,
+        "kb_answers": len(kb_observations),
+        "web_answers": len(web_outcomes),
+        "kb_helpfulness": round(kb_rate, 3),
+        "web_helpfulness": round(web_rate, 3) if web_rate is not None else None,
+        "previous_threshold": default_threshold,
+        "threshold": model.default_threshold,
+        "learned": learned is not None,
+        "document_thresholds": len(source_thresholds),
+        "boosts": len(boosts),
+        "web_calls_avoided": avoided,
+        "web_calls_avoided_rate": round(avoided / len(web_outcomes), 3) if web_outcomes else 0.0
+    }
+    return model
+
+def main(argv: Optional[List[str]] = None):
+    """Fit the routing model from collected feedback and write the artifact Router hot-loads."""
+    from feedback_store import FEEDBACK_DB_PATH, FeedbackStore
+
+    parser = argparse.ArgumentParser(description="Learn routing thresholds and a KB re-ranker from feedback.")
+    parser.add_argument("--db", default=FEEDBACK_DB_PATH, help="feedback SQLite store")
+    parser.add_argument("--output", default=ROUTER_MODEL_PATH, help="routing model artifact to write")
+    parser.add_argument("--threshold", type=float, default=0.7, help="threshold to keep when data is too thin")
+    parser.add_argument("--since", help="only use feedback from this ISO timestamp on")
+    parser.add_argument("--min-samples", type=int, default=TUNING_MIN_SAMPLES)
+    parser.add_argument("--dry-run", action="store_true", help="print the report without writing the artifact")
+    args = parser.parse_args(argv)
+
+    store = FeedbackStore(args.db)
+    model = fit(store.iter_entries(since=args.since), default_threshold=args.threshold,
+                min_samples=args.min_samples)
+    for name, value in model.report.items():
+        print(f"{name:>24}: {value}")
+    if not args.dry_run:
+        model.save(args.output)
+        print(f"Wrote routing model to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+#vector_store.py
+import os
+import json
+import threading
+from types import SimpleNamespace
+from typing import List, Dict, Optional
+
+import numpy as np
+
+VECTORS_FILE = "vectors.f32"
+META_FILE = "meta.json"
+HNSW_FILE = "hnsw.bin"
+
+_COMPARISONS = {
+    "$eq": lambda value, operand: value == operand,
+    "$ne": lambda value, operand: value != operand,
+    "$in": lambda value, operand: value in operand,
+    "$nin": lambda value, operand: value not in operand,
+    "$gt": lambda value, operand: value is not None and value > operand,
+    "$gte": lambda value, operand: value is not None and value >= operand,
+    "$lt": lambda value, operand: value is not None and value < operand,
+    "$lte": lambda value, operand: value is not None and value <= operand,
+}
+
+def matches_filter(metadata: Dict, metadata_filter: Optional[Dict]) -> bool:
+    """
+    Whether ``metadata`` satisfies a Pinecone-style metadata filter: ``{"field": value}``,
+    ``{"field": {"$in": [...]}}``, comparisons ($eq, $ne, $in, $nin, $gt, $gte, $lt, $lte,
+    $exists) and ``$and`` / ``$or`` lists of filters.
+    """
+    if not metadata_filter:
+        return True
+    for field, condition in metadata_filter.items():
+        if field == "$and":
+            if not all(matches_filter(metadata, part) for part in condition):
+                return False
+            continue
+        if field == "$or":
+            if not any(matches_filter(metadata, part) for part in condition):
+                return False
+            continue
+        value = metadata.get(field)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, operand in condition.items():
+            if operator == "$exists":
+                if (field in metadata) != bool(operand):
+                    return False
+            elif operator not in _COMPARISONS:
+                raise ValueError(f"Unsupported filter operator '{operator}'")
+            else:
+                try:
+                    if not _COMPARISONS[operator](value, operand):
+                        return False
+                except TypeError:
+                    return False
+    return True
+
+class LocalVectorIndex:
+    """
+    In-process vector index holding embeddings in a memory-mapped float32 matrix on disk.
+
+    Exposes the subset of the Pinecone ``Index`` interface used by MathKnowledgeBase
+    (``upsert``, ``query`` with a metadata ``filter``, ``fetch``, ``delete``, ``describe_index_stats``)
+    so either backend can be selected by configuration without changing callers.
+    """
+    def __init__(self, path: str, dimension: int = 384, index_type: str = "flat"):
+        """
+        Args:
+            path (str): Directory holding the persisted matrix and metadata
+            dimension (int): Embedding dimension
+            index_type (str): "flat" (brute-force NumPy), "hnsw" (hnswlib) or "ivf" (faiss)
+        """
+        self.path = path
+        self.dimension = dimension
+        self.index_type = index_type
+        self._lock = threading.RLock()
+
+        self._ids: List[str] = []
+        self._metadata: List[Dict] = []
+        self._id_to_row: Dict[str, int] = {}
+        self._matrix = np.empty((0, dimension), dtype=np.float32)
+        self._buffer = None
+        self._ann = None
+        self._ann_dirty = True
+        # Rows matching each recently used metadata filter, dropped on any mutation
+        self._filter_rows: Dict[str, np.ndarray] = {}
+
+        self.load()
+
+    def load(self) -> bool:
+        """Load a persisted index from disk, memory-mapping the vector matrix."""
+        meta_path = os.path.join(self.path, META_FILE)
+        vectors_path = os.path.join(self.path, VECTORS_FILE)
+        if not (os.path.exists(meta_path) and os.path.exists(vectors_path)):
+            return False
+
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+
+        with self._lock:
+            self.dimension = meta["dimension"]
+            self._ids = meta["ids"]
+            self._metadata = meta["metadata"]
+            self._id_to_row = {vector_id: row for row, vector_id in enumerate(self._ids)}
+            if self._ids:
+                self._matrix = np.memmap(
+                    vectors_path, dtype=np.float32, mode="r",
+                    shape=(len(self._ids), self.dimension)
+                )
+            else:
+                self._matrix = np.empty((0, self.dimension), dtype=np.float32)
+            self._buffer = None
+            self._ann = None
+            self._ann_dirty = True
+            self._filter_rows = {}
+            self._load_ann()
+        return True
+
+    def persist(self):
+        """Write the matrix and metadata to disk so a new worker starts hot."""
+        os.makedirs(self.path, exist_ok=True)
+        meta_path = os.path.join(self.path, META_FILE)
+        vectors_path = os.path.join(self.path, VECTORS_FILE)
+
+        with self._lock:
+            matrix = np.ascontiguousarray(self._matrix, dtype=np.float32)
+            # Write to temporary files first so a crash never leaves a half-written index
+            matrix.tofile(vectors_path + ".tmp")
+            with open(meta_path + ".tmp", 'w') as f:
+                json.dump({
+                    "dimension": self.dimension,
+                    "index_type": self.index_type,
+                    "ids": self._ids,
+                    "metadata": self._metadata
+                }, f)
+            os.replace(vectors_path + ".tmp", vectors_path)
+            os.replace(meta_path + ".tmp", meta_path)
+
+            if self._ann is not None and not self._ann_dirty and self.index_type == "hnsw":
+                self._ann.save_index(os.path.join(self.path, HNSW_FILE))
+
+            if self._ids:
+                self._matrix = np.memmap(
+                    vectors_path, dtype=np.float32, mode="r",
+                    shape=(len(self._ids), self.dimension)
+                )
+                self._buffer = None
+
+    def upsert(self, vectors: List[Dict], **kwargs):
+        """Insert or replace vectors given as ``{"id", "values", "metadata"}`` dicts."""
+        if not vectors:
+            return {"upserted_count": 0}
+
+        values = np.asarray([v["values"] for v in vectors], dtype=np.float32)
+        if values.ndim != 2 or values.shape[1] != self.dimension:
+            raise ValueError(f"Expected vectors of dimension {self.dimension}, got {values.shape}")
+        values = self._normalize(values)
+
+        with self._lock:
+            for vector, row_values in zip(vectors, values):
+                row = self._id_to_row.get(vector["id"])
+                if row is None:
+                    row = len(self._ids)
+                    self._reserve(row + 1)
+                    self._id_to_row[vector["id"]] = row
+                    self._ids.append(vector["id"])
+                    self._metadata.append(vector.get("metadata", {}))
+                else:
+                    self._reserve(len(self._ids))
+                    self._metadata[row] = vector.get("metadata", {})
+                self._buffer[row] = row_values
+            self._matrix = self._buffer[:len(self._ids)]
+            self._ann_dirty = True
+            self._filter_rows = {}
+
+        return {"upserted_count": len(vectors)}
+
+    def _reserve(self, rows: int):
+        """
+        Ensure a writable buffer with room for ``rows`` vectors. Capacity doubles on growth,
+        so batched upserts append in amortized constant time instead of copying the matrix.
+        """
+        if self._buffer is not None and len(self._buffer) >= rows:
+            return
+        count = len(self._ids)
+        capacity = max(rows, 2 * count, 1024)
+        buffer = np.empty((capacity, self.dimension), dtype=np.float32)
+        # Copy out of the read-only memmap (or the outgrown buffer) before mutating
+        buffer[:count] = (self._buffer if self._buffer is not None else self._matrix)[:count]
+        self._buffer = buffer
+        self._matrix = buffer[:count]
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs):
+        """Delete vectors by ID."""
+        if not ids:
+            return {}
+
+        with self._lock:
+            doomed = {self._id_to_row[i] for i in ids if i in self._id_to_row}
+            if not doomed:
+                return {}
+            keep = [row for row in range(len(self._ids)) if row not in doomed]
+            self._matrix = np.array(self._matrix[keep], dtype=np.float32).reshape(-1, self.dimension)
+            self._buffer = None
+            self._ids = [self._ids[row] for row in keep]
+            self._metadata = [self._metadata[row] for row in keep]
+            self._id_to_row = {vector_id: row for row, vector_id in enumerate(self._ids)}
+            self._ann_dirty = True
+            self._filter_rows = {}
+        return {}
+
+    def query(self, vector: List[float], top_k: int = 3, include_metadata: bool = True,
+              filter: Optional[Dict] = None, **kwargs):
+        """
+        Return the ``top_k`` nearest vectors by cosine similarity, among those whose
+        metadata matches ``filter`` (Pinecone filter syntax, see matches_filter).
+
+        The result mimics a Pinecone query response: an object with a ``matches`` list
+        whose items expose ``id``, ``score`` and ``metadata``.
+        """
+        with self._lock:
+            matrix = self._matrix
+            ids = self._ids
+            metadata = self._metadata
+            rows_filter = self._rows_matching(filter) if filter else None
+            ann = self._get_ann() if rows_filter is None else None
+
+        if not ids or (rows_filter is not None and not len(rows_filter)):
+            return SimpleNamespace(matches=[])
+
+        query_vector = self._normalize(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+
+        if rows_filter is not None:
+            # Filtered queries scan only the matching rows, exactly
+            top_k = min(top_k, len(rows_filter))
+            subset, scores = self._query_flat(matrix[rows_filter], query_vector, top_k)
+            rows = rows_filter[subset].tolist()
+        elif ann is not None:
+            top_k = min(top_k, len(ids))
+            rows, scores = self._query_ann(ann, query_vector, top_k)
+        else:
+            top_k = min(top_k, len(ids))
+            rows, scores = self._query_flat(matrix, query_vector, top_k)
+
+        matches = []
+        for row, score in zip(rows, scores):
+            matches.append(SimpleNamespace(
+                id=ids[row],
+                score=float(score),
+                metadata=metadata[row] if include_metadata else {}
+            ))
+        return SimpleNamespace(matches=matches)
+
+    def _rows_matching(self, metadata_filter: Dict) -> np.ndarray:
+        """Row numbers whose metadata matches the filter; call with the lock held."""
+        key = json.dumps(metadata_filter, sort_keys=True, default=str)
+        rows = self._filter_rows.get(key)
+        if rows is None:
+            rows = np.asarray([row for row, metadata in enumerate(self._metadata)
+                               if matches_filter(metadata, metadata_filter)], dtype=np.int64)
+            if len(self._filter_rows) >= 64:
+                self._filter_rows.clear()
+            self._filter_rows[key] = rows
+        return rows
+
+    def fetch(self, ids: List[str], **kwargs):
+        """
+        Look vectors up by ID. Like a Pinecone fetch response, the result's ``vectors`` maps
+        each ID found to an object exposing ``id``, ``values`` and ``metadata``.
+        """
+        with self._lock:
+            found = {vector_id: self._id_to_row[vector_id] for vector_id in ids if vector_id in self._id_to_row}
+            vectors = {
+                vector_id: SimpleNamespace(id=vector_id, values=self._matrix[row].tolist(), metadata=self._metadata[row])
+                for vector_id, row in found.items()
+            }
+        return SimpleNamespace(vectors=vectors)
+
+    def describe_index_stats(self) -> Dict:
+        return {"total_vector_count": len(self._ids), "dimension": self.dimension}
+
+    def _query_flat(self, matrix, query_vector, top_k):
+        """Brute-force inner product over the normalized matrix."""
+        scores = matrix @ query_vector
+        if top_k < len(scores):
+            rows = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            rows = np.arange(len(scores))
+        rows = rows[np.argsort(-scores[rows])]
+        return rows.tolist(), scores[rows].tolist()
+
+    def _query_ann(self, ann, query_vector, top_k):
+        if self.index_type == "hnsw":
+            labels, distances = ann.knn_query(query_vector, k=top_k)
+            # hnswlib's "ip" space returns 1 - inner product
+            return labels[0].tolist(), (1.0 - distances[0]).tolist()
+
+        scores, labels = ann.search(query_vector.reshape(1, -1), top_k)
+        rows = [int(row) for row in labels[0] if row >= 0]
+        return rows, scores[0][:len(rows)].tolist()
+
+    def _get_ann(self):
+        """Return the approximate index, rebuilding it after mutations."""
+        if self.index_type == "flat" or len(self._ids) == 0:
+            return None
+        if self._ann is None or self._ann_dirty:
+            self._ann = self._build_ann()
+            self._ann_dirty = False
+        return self._ann
+
+    def _load_ann(self):
+        """Load a persisted HNSW graph if one matches the loaded matrix."""
+        hnsw_path = os.path.join(self.path, HNSW_FILE)
+        if self.index_type != "hnsw" or not self._ids or not os.path.exists(hnsw_path):
+            return
+        try:
+            import hnswlib
+            ann = hnswlib.Index(space="ip", dim=self.dimension)
+            ann.load_index(hnsw_path, max_elements=len(self._ids))
+            if ann.get_current_count() == len(self._ids):
+                self._ann = ann
+                self._ann_dirty = False
+        except Exception as e:
+            print(f"Could not load HNSW index from {hnsw_path}: {e}")
+
+    def _build_ann(self):
+        matrix = np.ascontiguousarray(self._matrix, dtype=np.float32)
+        try:
+            if self.index_type == "hnsw":
+                import hnswlib
+                ann = hnswlib.Index(space="ip", dim=self.dimension)
+                ann.init_index(max_elements=len(matrix), ef_construction=200, M=16)
+                ann.add_items(matrix, np.arange(len(matrix)))
+                ann.set_ef(64)
+                return ann
+
+            if self.index_type == "ivf":
+                import faiss
+                nlist = max(1, int(np.sqrt(len(matrix))))
+                quantizer = faiss.IndexFlatIP(self.dimension)
+                ann = faiss.IndexIVFFlat(quantizer, self.dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+                ann.train(matrix)
+                ann.add(matrix)
+                ann.nprobe = min(nlist, 8)
+                return ann
+        except ImportError as e:
+            print(f"Index type '{self.index_type}' unavailable ({e}). Falling back to flat search.")
+            self.index_type = "flat"
+        return None
+
+    @staticmethod
+    def _normalize(values: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(values, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return values / norms
@@ -1,18 +1,109 @@
 import os
+import time
+import random
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from typing import List, Dict
 from datetime import datetime
 import logging
+from cache import TTLCache
+from metrics import metrics, timed
 
 # Configure simple logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+TAVILY_BASE_URL = os.getenv("TAVILY_BASE_URL", "https://api.tavily.com/search")
+TAVILY_POOL_SIZE = int(os.getenv("TAVILY_POOL_SIZE", 10))
+TAVILY_MAX_RETRIES = int(os.getenv("TAVILY_MAX_RETRIES", 3))
+TAVILY_CACHE_TTL = float(os.getenv("TAVILY_CACHE_TTL", 3600))
+# Seconds one search may take across all attempts and backoff sleeps before giving up
+TAVILY_DEADLINE = float(os.getenv("TAVILY_DEADLINE", 15))
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class CircuitBreaker:
+    """
+    Fails fast after repeated errors. After ``failure_threshold`` consecutive failures the
+    circuit opens for ``reset_timeout`` seconds; then a single trial call is let through
+    (half-open) and its outcome closes or re-opens the circuit.
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
 class WebSearch:
-    def __init__(self):
-        """Initialize the WebSearch class."""
+    def __init__(self,
+                 base_url: str = TAVILY_BASE_URL,
+                 pool_size: int = TAVILY_POOL_SIZE,
+                 max_retries: int = TAVILY_MAX_RETRIES,
+                 backoff_base: float = 0.5,
+                 cache_ttl: float = TAVILY_CACHE_TTL,
+                 timeout: float = 10,
+                 deadline: float = TAVILY_DEADLINE):
+        """
+        Initialize the WebSearch class.
+
+        Args:
+            base_url (str): Search endpoint; point it at a local stub server for testing
+            pool_size (int): Keep-alive connections held by the HTTP session
+            max_retries (int): Retries on 429/5xx and connection errors
+            backoff_base (float): Base delay in seconds for jittered exponential backoff
+            cache_ttl (float): Seconds identical searches are served from cache (0 disables)
+            timeout (float): Per-request timeout in seconds
+            deadline (float): Total seconds for a search, shared by all attempts
+        """
         self.api_key = os.getenv("TAVILY_API_KEY")
-        self.base_url = "https://api.tavily.com/search"
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.timeout = timeout
+        self.deadline = deadline
+        
+        # Reuse TCP/TLS connections across searches
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        
+        self.circuit_breaker = CircuitBreaker()
+        self.cache = TTLCache(max_entries=1024, ttl=cache_ttl) if cache_ttl > 0 else None
         
         # Math-focused domains to include
         self.math_domains = [
@@ -24,6 +115,7 @@ class WebSearch:
             # Excluding "en.wikipedia.org" as requested
         ]
         
+    @timed("web_search")
     def search(self, query: str, max_results: int = 5) -> List[Dict]:
         """
         Perform a web search using Tavily API, focusing on math resources.
@@ -45,6 +137,25 @@ class WebSearch:
                 "score": 0.0
             }]
             
+        cache_key = (query, max_results, tuple(self.math_domains))
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                metrics.inc("web_search_cache", result="hit")
+                return [dict(result) for result in cached]
+            metrics.inc("web_search_cache", result="miss")
+        
+        # Fail fast while Tavily is known to be down
+        if not self.circuit_breaker.allow_request():
+            logger.warning("Web search circuit is open; skipping Tavily call.")
+            metrics.inc("web_search_circuit_open")
+            return [{
+                "title": "Search Error",
+                "text": "Web search is temporarily unavailable. Falling back to knowledge base only.",
+                "url": "",
+                "score": 0.0
+            }]
+            
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
@@ -62,7 +173,7 @@ class WebSearch:
         }
         
         try:
-            response = requests.post(self.base_url, headers=headers, json=payload, timeout=10)
+            response = self._post_with_retries(headers, payload)
             response.raise_for_status()
             
             results = response.json()
@@ -79,10 +190,15 @@ class WebSearch:
                     "timestamp": datetime.now().isoformat()
                 })
             
-            return formatted_results
+            self.circuit_breaker.record_success()
+            if self.cache is not None:
+                self.cache.set(cache_key, formatted_results)
+            return [dict(result) for result in formatted_results]
             
         except requests.exceptions.HTTPError as http_err:
             logger.error(f"HTTP error during web search: {http_err}")
+            metrics.inc("component_errors", component="web_search")
+            self._record_http_failure(http_err)
             status_code = getattr(http_err.response, 'status_code', None)
             error_detail = f"Status code: {status_code}" if status_code else str(http_err)
             
@@ -95,6 +211,8 @@ class WebSearch:
             
         except Exception as e:
             logger.error(f"Error performing web search: {str(e)}")
+            metrics.inc("component_errors", component="web_search")
+            self.circuit_breaker.record_failure()
             return [{
                 "title": "Search Error", 
                 "text": f"Web search encountered an error: {str(e)}. Falling back to knowledge base only.",
@@ -102,6 +220,59 @@ class WebSearch:
                 "score": 0.0
             }]
     
+    def _post_with_retries(self, headers: Dict, payload: Dict) -> requests.Response:
+        """
+        POST to the search endpoint, retrying 429/5xx responses and connection errors
+        with jittered exponential backoff (honouring Retry-After when given).
+
+        All attempts share one ``deadline``: each request's timeout is cut to the time left,
+        and no retry starts that could not finish in time. A read timeout is not retried,
+        since a server too slow to answer once is unlikely to answer a repeat in time.
+        """
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(self.max_retries + 1):
+            timeout = min(self.timeout, deadline - time.monotonic())
+            if timeout <= 0:
+                raise requests.exceptions.Timeout(f"Web search deadline of {self.deadline}s exceeded")
+            try:
+                response = self.session.post(self.base_url, headers=headers, json=payload, timeout=timeout)
+            except requests.exceptions.ReadTimeout:
+                raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                delay = self._backoff_delay(attempt)
+                if attempt == self.max_retries or time.monotonic() + delay >= deadline:
+                    raise
+                logger.warning(f"Web search request failed ({e}); retrying.")
+                metrics.inc("web_search_retries", reason="connection")
+                time.sleep(delay)
+                continue
+            
+            if response.status_code not in RETRYABLE_STATUS_CODES or attempt == self.max_retries:
+                return response
+            
+            delay = self._backoff_delay(attempt)
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            if time.monotonic() + delay >= deadline:
+                return response
+            logger.warning(f"Web search returned {response.status_code}; retrying in {delay:.2f}s.")
+            metrics.inc("web_search_retries", reason=str(response.status_code))
+            time.sleep(delay)
+        return response
+    
+    def _backoff_delay(self, attempt: int) -> float:
+        """Full-jitter exponential backoff."""
+        return random.uniform(0, self.backoff_base * (2 ** attempt))
+    
+    def _record_http_failure(self, http_err: requests.exceptions.HTTPError):
+        """Only server-side failures count against the circuit; a bad request is not an outage."""
+        status_code = getattr(http_err.response, 'status_code', None)
+        if status_code is None or status_code in RETRYABLE_STATUS_CODES:
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+    
     def _extract_domain(self, url: str) -> str:
         """
         Extract the domain name from a URL.